@@ -0,0 +1,117 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+MARKER = 'bench'
+
+
+class ServerProcess:
+    """Чат-сервер, запущенный в отдельном процессе для замеров."""
+
+    def start(self):
+        """Запускает сервер и ждет, пока он начнет принимать соединения."""
+        command = [
+            sys.executable, '-m', 'server.main', '--host', self.host, '--port', str(self.port),
+            '--history-replay', '0', *self.server_args,
+        ]
+        source_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.process = subprocess.Popen(command, cwd=source_root)
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection((self.host, self.port), timeout=0.2).close()
+                return
+            except OSError:
+                if self.process.poll() is not None:
+                    raise RuntimeError("Сервер завершился с кодом %d." % self.process.returncode)
+                time.sleep(0.05)
+        self.stop()
+        raise RuntimeError("Сервер не начал принимать соединения.")
+
+    def stop(self):
+        """Останавливает сервер."""
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    def __init__(self, host: str, port: int, server_args: list[str]):
+        self.host = host
+        self.port = port
+        self.server_args = server_args
+        self.process: subprocess.Popen | None = None
+
+
+class SimulatedClient:
+    """
+    Клиент для нагрузочного теста на потоках `asyncio`, как и
+    `client.handler.Client`. Отправленные сообщения несут номер
+    клиента и время отправки, по которым получатели считают
+    задержку доставки.
+    """
+
+    async def connect(self):
+        """Подключается и ждет первую строку от сервера."""
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port, limit=1024 * 1024)
+        await self.reader.readline()
+        self.connected_at = time.monotonic()
+
+    async def receive(self):
+        """Читает строки, пока соединение открыто, и считает задержки."""
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            self.received += 1
+            text = line.decode(errors='replace')
+            marker = text.find('] %s ' % MARKER)
+            if marker == -1:
+                continue
+            try:
+                _, sender_id, sent_at = text[marker + 2:].split()
+            except ValueError:
+                continue
+            if int(sender_id) != self.client_id:
+                self.latencies.append((time.perf_counter_ns() - int(sent_at)) / 1e6)
+
+    async def send_messages(self, rate: float, duration: float):
+        """Отправляет сообщения с частотой `rate` в секунду в течение `duration` секунд."""
+        interval = 1 / rate
+        deadline = time.monotonic() + duration
+        next_send = time.monotonic()
+        while next_send < deadline:
+            self.writer.write(b'%s %d %d\n' % (MARKER.encode(), self.client_id, time.perf_counter_ns()))
+            self.sent += 1
+            next_send += interval
+            await asyncio.sleep(max(0.0, next_send - time.monotonic()))
+            await self.writer.drain()
+
+    async def close(self):
+        """Закрывает соединение."""
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+
+    def __init__(self, host: str, port: int, client_id: int):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+        self.connected_at: float | None = None
+        self.sent = 0
+        self.received = 0
+        self.latencies: list[float] = []
@@ -0,0 +1,74 @@
+import argparse
+import asyncio
+import datetime
+import json
+import resource
+import sys
+
+from bench.handler import ServerProcess
+from bench.scenarios import SCENARIOS
+from bench.stats import get_git_commit
+
+
+def get_arguments(argv: list[str]) -> argparse.Namespace:
+    """Разбирает аргументы командной строки до `--`."""
+    parser = argparse.ArgumentParser(description="Нагрузочный тест чат-сервера.")
+    parser.add_argument('scenario', choices=list(SCENARIOS))
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5600)
+    parser.add_argument('--engine', choices=['selectors', 'asyncio'], default='selectors')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=5.0, help="Длительность замера в секундах.")
+    parser.add_argument('--rate', type=float, default=1.0, help="Сообщений в секунду от одного клиента.")
+    parser.add_argument('--slow-fraction', type=float, default=0.0, help="Доля клиентов, которые не читают.")
+    parser.add_argument('--output', help="Файл для результата в JSON, по умолчанию stdout.")
+    return parser.parse_args(argv)
+
+
+def raise_file_limit():
+    """Поднимает ограничение на число открытых файлов до максимума."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main():
+    """Запускает сервер, прогоняет сценарий и выводит результат."""
+    # Аргументы после `--` передаются серверу как есть.
+    argv = sys.argv[1:]
+    separator = argv.index('--') if '--' in argv else len(argv)
+    arguments = get_arguments(argv[:separator])
+    server_args = argv[separator + 1:]
+    raise_file_limit()
+    server_args += ['--engine', arguments.engine, '--workers', str(arguments.workers)]
+    parameters = {
+        'clients': arguments.clients,
+        'duration': arguments.duration,
+        'rate': arguments.rate,
+        'slow_fraction': arguments.slow_fraction,
+    }
+    server = ServerProcess(arguments.host, arguments.port, server_args)
+    server.start()
+    try:
+        results = asyncio.run(SCENARIOS[arguments.scenario](server, **parameters))
+    finally:
+        server.stop()
+    report = {
+        'scenario': arguments.scenario,
+        'parameters': {**parameters, 'engine': arguments.engine, 'workers': arguments.workers,
+                       'server_args': server_args},
+        'commit': get_git_commit(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
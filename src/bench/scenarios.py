@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+from bench.handler import ServerProcess, SimulatedClient
+from bench.stats import get_cpu_seconds, get_rss, summarize_latencies
+
+
+async def connect_clients(server: ServerProcess, count: int, concurrency: int = 200) -> list[SimulatedClient]:
+    """Подключает `count` клиентов, не больше `concurrency` одновременно."""
+    semaphore = asyncio.Semaphore(concurrency)
+    clients = [SimulatedClient(server.host, server.port, client_id) for client_id in range(count)]
+
+    async def connect(client: SimulatedClient):
+        async with semaphore:
+            await client.connect()
+
+    await asyncio.gather(*(connect(client) for client in clients))
+    return clients
+
+
+async def close_clients(clients: list[SimulatedClient], tasks: list[asyncio.Task]):
+    """Отключает клиентов и останавливает их задачи чтения."""
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.gather(*(client.close() for client in clients))
+
+
+async def idle(server: ServerProcess, clients: int, duration: float, **_) -> dict:
+    """
+    Держит `clients` молчащих соединений `duration` секунд и
+    считает, сколько памяти сервера приходится на одно.
+    """
+    rss_before = get_rss(server.pid)
+    connected = await connect_clients(server, clients)
+    tasks = [asyncio.create_task(client.receive()) for client in connected]
+    cpu_before = get_cpu_seconds(server.pid)
+    await asyncio.sleep(duration)
+    cpu_used = get_cpu_seconds(server.pid) - cpu_before
+    rss_after = get_rss(server.pid)
+    await close_clients(connected, tasks)
+    return {
+        'connections': clients,
+        'rss_before_bytes': rss_before,
+        'rss_after_bytes': rss_after,
+        'rss_per_connection_bytes': (rss_after - rss_before) / clients if clients else None,
+        'cpu_seconds': cpu_used,
+    }
+
+
+async def join_storm(server: ServerProcess, clients: int, **_) -> dict:
+    """
+    Подключает `clients` клиентов разом и замеряет скорость
+    подключения до получения первой строки от сервера.
+    """
+    cpu_before = get_cpu_seconds(server.pid)
+    started = time.monotonic()
+    connected = await connect_clients(server, clients)
+    elapsed = time.monotonic() - started
+    cpu_used = get_cpu_seconds(server.pid) - cpu_before
+    connect_times = sorted(client.connected_at - started for client in connected)
+    await close_clients(connected, [])
+    return {
+        'connections': clients,
+        'elapsed_seconds': elapsed,
+        'connections_per_second': clients / elapsed if elapsed else None,
+        'last_connected_seconds': connect_times[-1] if connect_times else None,
+        'rss_bytes': get_rss(server.pid),
+        'cpu_seconds': cpu_used,
+    }
+
+
+async def chatty(server: ServerProcess, clients: int, duration: float, rate: float,
+                 slow_fraction: float = 0.0, **_) -> dict:
+    """
+    Все `clients` клиентов в одной комнате, каждый шлет `rate`
+    сообщений в секунду. Доля `slow_fraction` клиентов не читает
+    ничего, как медленные получатели. Замеряет пропускную
+    способность и задержки доставки у остальных.
+    """
+    connected = await connect_clients(server, clients)
+    slow_count = int(clients * slow_fraction)
+    readers = connected[slow_count:]
+    tasks = [asyncio.create_task(client.receive()) for client in readers]
+    cpu_before = get_cpu_seconds(server.pid)
+    started = time.monotonic()
+    await asyncio.gather(*(client.send_messages(rate, duration) for client in connected))
+    # Даём серверу доставить то, что осталось в очередях.
+    await asyncio.sleep(min(1.0, duration))
+    elapsed = time.monotonic() - started
+    cpu_used = get_cpu_seconds(server.pid) - cpu_before
+    rss = get_rss(server.pid)
+    await close_clients(connected, tasks)
+    latencies = [latency for client in readers for latency in client.latencies]
+    sent = sum(client.sent for client in connected)
+    return {
+        'connections': clients,
+        'slow_connections': slow_count,
+        'messages_sent': sent,
+        'messages_delivered': len(latencies),
+        'sent_per_second': sent / duration,
+        'delivered_per_second': len(latencies) / elapsed,
+        'latency': summarize_latencies(latencies),
+        'rss_bytes': rss,
+        'cpu_seconds': cpu_used,
+    }
+
+
+async def slow_consumers(server: ServerProcess, slow_fraction: float = 0.1, **parameters) -> dict:
+    """Сценарий `chatty`, в котором часть клиентов не читает."""
+    return await chatty(server, slow_fraction=slow_fraction or 0.1, **parameters)
+
+
+SCENARIOS = {
+    'idle': idle,
+    'join-storm': join_storm,
+    'chatty': chatty,
+    'slow-consumers': slow_consumers,
+}
@@ -0,0 +1,78 @@
+import os
+import subprocess
+
+
+def percentile(values: list[float], fraction: float) -> float | None:
+    """
+    Возвращает перцентиль `fraction` (от 0 до 1) по методу
+    ближайшего ранга. `values` должен быть отсортирован.
+    """
+    if not values:
+        return None
+    rank = max(1, round(fraction * len(values) + 0.5))
+    return values[min(rank, len(values)) - 1]
+
+
+def summarize_latencies(latencies: list[float]) -> dict:
+    """Возвращает сводку по задержкам доставки в миллисекундах."""
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'p50_ms': percentile(latencies, 0.5),
+        'p99_ms': percentile(latencies, 0.99),
+        'p999_ms': percentile(latencies, 0.999),
+        'max_ms': latencies[-1] if latencies else None,
+    }
+
+
+def get_process_tree(pid: int) -> list[int]:
+    """Возвращает процесс `pid` и всех его потомков."""
+    pids = [pid]
+    for current in pids:
+        try:
+            for task in os.listdir('/proc/%d/task' % current):
+                with open('/proc/%d/task/%s/children' % (current, task)) as file:
+                    pids.extend(int(child) for child in file.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return pids
+
+
+def get_rss(pid: int) -> int:
+    """Возвращает суммарный RSS процесса и его потомков в байтах."""
+    total = 0
+    for current in get_process_tree(pid):
+        try:
+            with open('/proc/%d/status' % current) as file:
+                for line in file:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+        except FileNotFoundError:
+            continue
+    return total
+
+
+def get_cpu_seconds(pid: int) -> float:
+    """Возвращает процессорное время процесса и его потомков в секундах."""
+    ticks = 0
+    for current in get_process_tree(pid):
+        try:
+            with open('/proc/%d/stat' % current) as file:
+                fields = file.read().rsplit(')', 1)[1].split()
+        except FileNotFoundError:
+            continue
+        # utime и stime - 14-е и 15-е поля, считая от pid.
+        ticks += int(fields[11]) + int(fields[12])
+    return ticks / os.sysconf('SC_CLK_TCK')
+
+
+def get_git_commit() -> str | None:
+    """Возвращает текущий коммит репозитория, если он есть."""
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
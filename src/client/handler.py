@@ -1,41 +1,152 @@
 import asyncio
 from asyncio import Task
 
+from protocol import CHAT_HEADER, FRAME_HEADER, PRESENCE_HEADER, FrameCodec, FrameType, PresenceEvent
+from terminal import BufferedOutput, open_stdin
+
 
 class Client:
     """Класс для взаимодействия с сервером."""
 
+    read_size = 64 * 1024
+    max_line_length = 64 * 1024
+
     async def accept_server_response(self):
-        """Принимает сообщение от сервера."""
+        """Принимает сообщения от сервера, пока он не закроет соединение."""
         while True:
-            response = await self.get_server_response()
-            if response:
-                self.output_message(response)
+            if self.codec is not None:
+                response = await self.get_server_frame()
+                lines = [response] if response is not None else None
             else:
-                await self.close_server_connection()
+                lines = await self.get_server_lines()
+            if lines is None:
                 self.output_message("The server has closed the connection.")
-                self.stop_all_tasks()
-                raise ValueError
+                return
+            if '/ping' in lines:
+                self.writer.write(b'/pong\n')
+                lines = [line for line in lines if line != '/ping']
+            self.output_messages(lines)
+
+    async def get_server_frame(self) -> str | None:
+        """
+        Читает один кадр сервера и возвращает текст для вывода,
+        пустую строку, если выводить нечего, или `None`, если
+        соединение закрыто.
+        """
+        try:
+            header = await self.reader.readexactly(FRAME_HEADER.size)
+            kind, length = FRAME_HEADER.unpack(header)
+            body = await self.reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            return None
+        kind, body = self.codec.decode_body(kind, body)
+        if kind == FrameType.CHAT:
+            sender_id, = CHAT_HEADER.unpack_from(body)
+            name = self.names.get(sender_id, '#%d' % sender_id)
+            return '[%s] %s' % (name, body[CHAT_HEADER.size:].decode('utf-8', 'replace'))
+        if kind == FrameType.PRESENCE:
+            event, user_id = PRESENCE_HEADER.unpack_from(body)
+            name = body[PRESENCE_HEADER.size:].decode('utf-8', 'replace')
+            if event == PresenceEvent.JOIN:
+                self.names[user_id] = name
+                return '* %s is here.' % name
+            self.names.pop(user_id, None)
+            return '* %s has left.' % name
+        if kind in (FrameType.SYSTEM, FrameType.TEXT):
+            return body.decode('utf-8', 'replace').rstrip('\n')
+        if kind == FrameType.PING:
+            self.writer.write(self.codec.encode(FrameType.PONG))
+        return ''
+
+    async def negotiate_binary(self):
+        """
+        Просит сервер перейти на двоичный протокол и выводит
+        текстовые строки до его ответа.
+        """
+        command = '/binary zlib' if self.compression else '/binary'
+        self.writer.write(self.format_message(command))
+        while True:
+            line = await self.get_server_response()
+            if line is None:
+                return
+            if line == command:
+                break
+            if line == '/ping':
+                self.writer.write(b'/pong\n')
+            else:
+                self.output_message(line)
+        self.codec = FrameCodec(self.compression)
 
     async def send_to_server(self):
-        """Отправляет сообщение на сервер."""
+        """
+        Отправляет сообщения на сервер, пока не кончится ввод.
+        Затем закрывает свою сторону соединения: сервер ответит на
+        все отправленное и закроет соединение сам.
+        """
         while True:
             user_input = await self.get_user_input()
+            if user_input is None:
+                self.writer.write_eof()
+                return
             await self.send_message_to_server(user_input)
 
     async def close_server_connection(self):
         """Закрывает соединение с сервером."""
         self.writer.close()
-        await self.writer.wait_closed()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
 
-    async def get_server_response(self) -> str:
-        """Возвращает ответ сервера в виде строки."""
-        response = await self.reader.read(1024)
-        return response.decode()
+    async def get_server_lines(self) -> list[str] | None:
+        """
+        Возвращает все целые строки, которые успел прислать сервер,
+        или `None`, если соединение закрыто. Данные читаются
+        большими кусками и делятся на строки за один проход.
+        Строки длиннее предела `StreamReader` пропускаются.
+        """
+        while True:
+            data = await self.reader.read(self.read_size)
+            if not data:
+                return None
+            lines = (self.partial_line + data).split(b'\n')
+            self.partial_line = lines.pop()
+            if self.skip_line and lines:
+                self.skip_line = False
+                del lines[0]
+            if len(self.partial_line) > self.max_line_length:
+                self.partial_line = b''
+                self.skip_line = True
+            if lines:
+                return [line.decode('utf-8', 'replace').rstrip('\r') for line in lines]
+
+    async def get_server_response(self) -> str | None:
+        """
+        Возвращает одну строку сервера без перевода строки или
+        `None`, если соединение закрыто. Читает ровно до конца
+        строки, поэтому годится, пока за строками могут идти
+        кадры двоичного протокола.
+        """
+        while True:
+            try:
+                line = await self.reader.readuntil(b'\n')
+            except asyncio.IncompleteReadError:
+                return None
+            except asyncio.LimitOverrunError as error:
+                await self.reader.readexactly(error.consumed)
+                self.skip_line = True
+                continue
+            if self.skip_line:
+                self.skip_line = False
+                continue
+            return line.decode('utf-8', 'replace').rstrip('\r\n')
 
     async def send_message_to_server(self, message: str):
         """Форматирует сообщение и отправляет его на сервер."""
-        formatted_message = self.format_message(message)
+        if self.codec is not None:
+            formatted_message = self.codec.encode(FrameType.CHAT, message.rstrip('\n').encode())
+        else:
+            formatted_message = self.format_message(message)
         self.writer.write(formatted_message)
         await self.writer.drain()
 
@@ -52,18 +163,25 @@ class Client:
         взаимодействия с ним.
         """
         self.reader, self.writer = await asyncio.open_connection(self.server_host, self.server_port)
+        if self.binary:
+            await self.negotiate_binary()
 
     async def start_chat(self):
         """
-        Подключается к серверу и отправляет сообщения
-        введенные пользователем.
+        Подключается к серверу и отправляет сообщения,
+        введенные пользователем, пока не закончится ввод или
+        сервер не закроет соединение.
         """
         await self.connect_to_server()
+        self.open_input()
         self.task_list = self.get_tasks()
-        try:
-            await asyncio.gather(*self.task_list)
-        except ValueError:
-            self.stop_all_tasks()
+        server_request, server_response = self.task_list
+        done, _ = await asyncio.wait(self.task_list, return_when=asyncio.FIRST_COMPLETED)
+        if server_response not in done:
+            await asyncio.wait([server_response])
+        self.stop_all_tasks()
+        await self.close_server_connection()
+        self.output.flush()
 
     def get_tasks(self) -> [Task, Task]:
         """Возвращает все задачи на выполнение."""
@@ -76,21 +194,44 @@ class Client:
         for task in self.task_list:
             task.cancel()
 
-    @staticmethod
-    def output_message(message: str):
-        """Выводит сообщение в консоль."""
-        print(message)
+    def output_message(self, message: str):
+        """Выводит сообщение в консоль в конце итерации цикла событий."""
+        self.output.write(message)
 
-    @staticmethod
-    async def get_user_input() -> str:
-        """Возвращает ввод пользователя."""
-        loop = asyncio.get_running_loop()
-        message = await loop.run_in_executor(None, input)
-        return message
+    def output_messages(self, messages: list[str]):
+        """Выводит непустые сообщения пачкой."""
+        self.output.write_many(filter(None, messages))
+
+    def open_input(self):
+        """Начинает читать стандартный ввод."""
+        self.input = open_stdin()
+
+    async def get_user_input(self) -> str | None:
+        """Возвращает строку, введенную пользователем, или `None`, если ввод закончился."""
+        while True:
+            try:
+                line = await self.input.readline()
+            except ValueError:
+                continue
+            if not line:
+                return None
+            return line.decode('utf-8', 'replace').rstrip('\r\n')
 
-    def __init__(self, server_host, server_port):
+    def __init__(self, server_host, server_port, binary: bool = False, compression: bool = False):
         self.server_host = server_host
         self.server_port = server_port
+        # Двоичный протокол и сжатие кадров, см. `protocol`.
+        self.binary = binary or compression
+        self.compression = compression
+        self.codec: FrameCodec | None = None
+        # Имена пользователей по номерам из кадров `PRESENCE`.
+        self.names: dict[int, str] = {}
         self.task_list: list[Task] = []
         self.writer: asyncio.StreamWriter | None = None
         self.reader: asyncio.StreamReader | None = None
+        # Начало строки сервера, конец которой еще не пришел.
+        # Остаток слишком длинной строки нужно пропустить.
+        self.partial_line = b''
+        self.skip_line = False
+        self.input: asyncio.StreamReader | None = None
+        self.output = BufferedOutput()
@@ -0,0 +1,93 @@
+import asyncio
+import itertools
+import resource
+import time
+from typing import Iterator
+
+from handler import Client
+from terminal import BufferedOutput
+
+
+class HeadlessClient(Client):
+    """
+    Клиент без терминала для нагрузочных прогонов: отправляет
+    сообщения из `messages` с частотой `rate` в секунду и пишет
+    в журнал время получения каждой строки.
+    """
+
+    def output_message(self, message: str):
+        """Записывает строку в журнал вида `время<TAB>номер клиента<TAB>строка`."""
+        self.output_messages([message])
+
+    def output_messages(self, messages: list[str]):
+        """Записывает в журнал строки, пришедшие разом, с одним временем получения."""
+        prefix = '%.6f\t%d\t' % (time.time(), self.instance)
+        self.output.write_many(prefix + message for message in messages if message)
+
+    def open_input(self):
+        """Ввод берется из `messages`, стандартный ввод не нужен."""
+        self.started = time.monotonic()
+
+    async def get_user_input(self) -> str | None:
+        """
+        Возвращает следующее сообщение в свой срок. Время
+        отправки считается от начала, поэтому задержки не
+        накапливаются. Когда сообщения или время кончились, ждет
+        `linger` секунд ответов и возвращает `None`.
+        """
+        send_at = self.started + self.sent / self.rate
+        message = next(self.messages, None)
+        if message is None or self.duration is not None and send_at - self.started >= self.duration:
+            await asyncio.sleep(self.linger)
+            return None
+        await asyncio.sleep(send_at - time.monotonic())
+        self.sent += 1
+        return message
+
+    def __init__(self, server_host: str, server_port: int, instance: int, messages: Iterator[str],
+                 output: BufferedOutput, rate: float = 1.0, duration: float = None, linger: float = 1.0,
+                 binary: bool = False, compression: bool = False):
+        super().__init__(server_host, server_port, binary, compression)
+        self.instance = instance
+        self.messages = messages
+        self.output = output
+        self.rate = rate
+        self.duration = duration
+        self.linger = linger
+        self.started = 0.0
+        self.sent = 0
+
+
+def get_messages(script: list[str] | None, instance: int) -> Iterator[str]:
+    """
+    Возвращает сообщения клиента: строки сценария по порядку или,
+    если сценария нет, бесконечный ряд пронумерованных сообщений.
+    """
+    if script is not None:
+        return iter(script)
+    return ('message %d from %d' % (number, instance) for number in itertools.count(1))
+
+
+def raise_file_limit(needed: int):
+    """Поднимает мягкий предел открытых файлов до жесткого, если его не хватит."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+async def run_headless(server_host: str, server_port: int, instances: int, script: list[str] | None,
+                       output: BufferedOutput, rate: float = 1.0, duration: float = None, linger: float = 1.0,
+                       binary: bool = False, compression: bool = False):
+    """
+    Запускает `instances` клиентов в одном процессе и ждет, пока
+    все закончат. Журнал у них общий и пишется раз за итерацию.
+    """
+    raise_file_limit(instances + 64)
+    clients = [
+        HeadlessClient(
+            server_host, server_port, instance, get_messages(script, instance), output,
+            rate, duration, linger, binary, compression,
+        )
+        for instance in range(instances)
+    ]
+    await asyncio.gather(*(client.start_chat() for client in clients))
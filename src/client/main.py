@@ -1,11 +1,53 @@
+import argparse
 import asyncio
+import sys
+
 from handler import Client
+from headless import run_headless
+from terminal import BufferedOutput
+
+
+def get_arguments() -> argparse.Namespace:
+    """Разбирает аргументы командной строки."""
+    parser = argparse.ArgumentParser(description="Клиент чата.")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--binary', action='store_true', help="Двоичный протокол.")
+    parser.add_argument('--zlib', action='store_true', help="Двоичный протокол со сжатием.")
+    headless = parser.add_argument_group("режим без терминала")
+    headless.add_argument('--headless', action='store_true', help="Слать сообщения без участия пользователя.")
+    headless.add_argument('--script', help="Файл с сообщениями, по одному в строке. По умолчанию - генератор.")
+    headless.add_argument('--instances', type=int, default=1, help="Сколько клиентов запустить в процессе.")
+    headless.add_argument('--rate', type=float, default=1.0, help="Сообщений в секунду от одного клиента.")
+    headless.add_argument('--duration', type=float, help="Сколько секунд слать сообщения.")
+    headless.add_argument('--linger', type=float, default=1.0, help="Сколько секунд ждать ответов в конце.")
+    headless.add_argument('--log', help="Файл журнала полученных строк. По умолчанию - стандартный вывод.")
+    arguments = parser.parse_args()
+    if arguments.headless and arguments.script is None and arguments.duration is None:
+        parser.error("Без --script нужно указать --duration.")
+    return arguments
 
 
 async def main():
     """Подключается к серверу."""
-    client_ = Client('localhost', 5555)
-    await client_.start_chat()
+    arguments = get_arguments()
+    if not arguments.headless:
+        client_ = Client(arguments.host, arguments.port, arguments.binary, arguments.zlib)
+        await client_.start_chat()
+        return
+    script = None
+    if arguments.script is not None:
+        with open(arguments.script, encoding='utf-8') as script_file:
+            script = script_file.read().splitlines()
+    log = open(arguments.log, 'w', encoding='utf-8') if arguments.log else sys.stdout
+    try:
+        await run_headless(
+            arguments.host, arguments.port, arguments.instances, script, BufferedOutput(log),
+            arguments.rate, arguments.duration, arguments.linger, arguments.binary, arguments.zlib,
+        )
+    finally:
+        if log is not sys.stdout:
+            log.close()
 
 
 if __name__ == '__main__':
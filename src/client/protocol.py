@@ -0,0 +1,53 @@
+import enum
+import struct
+import zlib
+
+# Те же форматы, что и в `server.protocol`.
+FRAME_HEADER = struct.Struct('!BI')
+COMPRESSED = 0x80
+CHAT_HEADER = struct.Struct('!I')
+PRESENCE_HEADER = struct.Struct('!BI')
+COMPRESS_THRESHOLD = 256
+
+
+class FrameType(enum.IntEnum):
+    """Типы кадров двоичного протокола."""
+
+    CHAT = 1
+    PRESENCE = 2
+    SYSTEM = 3
+    TEXT = 4
+    PING = 5
+    PONG = 6
+
+
+class PresenceEvent(enum.IntEnum):
+    """События кадра `PRESENCE`."""
+
+    JOIN = 1
+    LEAVE = 2
+
+
+class FrameCodec:
+    """
+    Кодирует кадры клиента и распаковывает кадры сервера. Кадры
+    сжимаются независимо друг от друга, как и на сервере.
+    """
+
+    def encode(self, kind: FrameType, body: bytes = b'') -> bytes:
+        """Возвращает кадр, сжатый, если включено сжатие и тело длинное."""
+        if self.compression and len(body) >= COMPRESS_THRESHOLD:
+            body = self.compressor.compress(body) + self.compressor.flush(zlib.Z_FULL_FLUSH)
+            kind |= COMPRESSED
+        return FRAME_HEADER.pack(kind, len(body)) + body
+
+    def decode_body(self, kind: int, body: bytes) -> tuple[int, bytes]:
+        """Возвращает тип и тело кадра, распаковывая сжатое."""
+        if kind & COMPRESSED:
+            return kind & ~COMPRESSED, self.decompressor.decompress(body)
+        return kind, body
+
+    def __init__(self, compression: bool = False):
+        self.compression = compression
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
@@ -0,0 +1,66 @@
+import asyncio
+import os
+import sys
+from typing import Iterable, TextIO
+
+
+class BufferedOutput:
+    """
+    Копит строки и выводит их разом один раз за итерацию цикла
+    событий: пачка сообщений от сервера стоит одной записи и
+    одного `flush`, а не по одному на строку.
+    """
+
+    def write(self, line: str):
+        """Добавляет строку к выводу текущей итерации."""
+        self.write_many((line,))
+
+    def write_many(self, lines: Iterable[str]):
+        """Добавляет строки к выводу текущей итерации."""
+        self.lines.extend(lines)
+        if self.lines and not self.scheduled:
+            self.scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        """Выводит накопленные строки."""
+        self.scheduled = False
+        if not self.lines:
+            return
+        self.lines.append('')
+        self.stream.write('\n'.join(self.lines))
+        self.stream.flush()
+        self.lines.clear()
+
+    def __init__(self, stream: TextIO = None):
+        self.stream = stream or sys.stdout
+        self.lines: list[str] = []
+        self.scheduled = False
+
+
+def open_stdin() -> asyncio.StreamReader:
+    """
+    Возвращает поток строк со стандартного ввода, который
+    читается в цикле событий без потоков-исполнителей. Дескриптор
+    не переводится в неблокирующий режим, чтобы не задеть вывод
+    в тот же терминал: читается он, только когда готов. Обычный
+    файл читается сразу целиком.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    fd = sys.stdin.fileno()
+
+    def read_ready():
+        data = os.read(fd, 64 * 1024)
+        if data:
+            reader.feed_data(data)
+        else:
+            loop.remove_reader(fd)
+            reader.feed_eof()
+
+    try:
+        loop.add_reader(fd, read_ready)
+    except PermissionError:
+        reader.feed_data(sys.stdin.buffer.read())
+        reader.feed_eof()
+    return reader
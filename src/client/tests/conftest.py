@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Модули клиента импортируют друг друга без пакета, как при
+# запуске `main.py` из его каталога.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,27 @@
+import asyncio
+
+from handler import Client
+
+
+async def read_server_lines(chunks: list[bytes], read_size: int = 64 * 1024, max_line_length: int = 64 * 1024):
+    client = Client('localhost', 0)
+    client.read_size = read_size
+    client.max_line_length = max_line_length
+    client.reader = asyncio.StreamReader()
+    results = []
+    for chunk in chunks:
+        client.reader.feed_data(chunk)
+        results.append(await client.get_server_lines())
+    client.reader.feed_eof()
+    results.append(await client.get_server_lines())
+    return results
+
+
+def test_split_lines_are_joined():
+    results = asyncio.run(read_server_lines([b'one\ntw', 'о\r\nтр'.encode()[:-1], 'тр'.encode()[-1:] + 'и\n'.encode()]))
+    assert results == [['one'], ['twо'], ['три'], None]
+
+
+def test_overlong_line_is_skipped():
+    results = asyncio.run(read_server_lines([b'abcdefghij\nok\n', b'abcdefghijklmnop\nend\n'], 8, 4))
+    assert results == [['ok'], ['end'], None]
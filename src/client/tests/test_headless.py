@@ -0,0 +1,49 @@
+import asyncio
+import types
+
+import headless
+from headless import HeadlessClient, get_messages
+from terminal import BufferedOutput
+
+
+def get_schedule(monkeypatch, messages, rate: float, duration: float = None, delays: list[float] = ()):
+    """
+    Возвращает отправленные сообщения и паузы перед ними.
+    Время не идет, пока клиент не спит, кроме `delays` - задержек
+    отправки после каждого сообщения.
+    """
+    now = [100.0]
+    sleeps = []
+
+    async def sleep(delay: float):
+        sleeps.append(round(delay, 6))
+        now[0] += max(delay, 0)
+
+    monkeypatch.setattr(headless, 'asyncio', types.SimpleNamespace(sleep=sleep))
+    monkeypatch.setattr(headless, 'time', types.SimpleNamespace(monotonic=lambda: now[0]))
+    client = HeadlessClient('localhost', 0, 3, messages, BufferedOutput(), rate, duration, linger=0.5)
+    client.open_input()
+    sent = []
+    delays = list(delays)
+    while (message := asyncio.run(client.get_user_input())) is not None:
+        sent.append(message)
+        if delays:
+            now[0] += delays.pop(0)
+    return sent, sleeps
+
+
+def test_messages_are_sent_at_rate(monkeypatch):
+    sent, sleeps = get_schedule(monkeypatch, iter(['a', 'b', 'c']), rate=2, delays=[0.3, 0.6])
+    assert sent == ['a', 'b', 'c']
+    # Задержки не накапливаются: опоздавшее сообщение уходит сразу.
+    assert sleeps == [0, 0.2, -0.1, 0.5]
+
+
+def test_generated_messages_stop_after_duration(monkeypatch):
+    sent, sleeps = get_schedule(monkeypatch, get_messages(None, 3), rate=2, duration=1)
+    assert sent == ['message 1 from 3', 'message 2 from 3']
+    assert sleeps == [0, 0.5, 0.5]
+
+
+def test_script_messages_are_kept_in_order():
+    assert list(get_messages(['hi', '/rooms'], 0)) == ['hi', '/rooms']
@@ -0,0 +1,24 @@
+import asyncio
+import io
+
+from terminal import BufferedOutput
+
+
+async def buffered_writes():
+    stream = io.StringIO()
+    output = BufferedOutput(stream)
+    output.write('one')
+    output.write_many(['two', 'three'])
+    written = stream.getvalue()
+    await asyncio.sleep(0)
+    return written, stream.getvalue(), output.scheduled
+
+
+def test_lines_are_written_once_per_iteration():
+    assert asyncio.run(buffered_writes()) == ('', 'one\ntwo\nthree\n', False)
+
+
+def test_flush_without_lines_writes_nothing():
+    stream = io.StringIO()
+    BufferedOutput(stream).flush()
+    assert stream.getvalue() == ''
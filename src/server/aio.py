@@ -0,0 +1,350 @@
+import asyncio
+import socket
+from typing import Callable
+
+from server.buffers import SlowConsumerPolicy
+from server.connection import Connection
+from server.handlers import Chat, Server
+from server.handoff import Handoff
+from server.metrics import ServerMetrics
+from server.settings import ServerSettings
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+class AsyncConnection(Connection):
+    """Соединение, которым управляет транспорт `asyncio`."""
+
+    __slots__ = ('transport', 'writing_paused')
+
+    def __init__(self, transport: asyncio.Transport, max_line_length: int):
+        peer = transport.get_extra_info('peername')
+        super().__init__(transport.get_extra_info('socket'), max_line_length, peer[0] if peer else '')
+        self.transport = transport
+        # Буфер транспорта выше верхней отметки, новые сообщения
+        # копятся в `write_queue`.
+        self.writing_paused = False
+
+
+class ServerProtocol(asyncio.BufferedProtocol):
+    """
+    Протокол одного соединения. Передаёт события транспорта
+    серверу и читает данные в общий буфер приема сервера.
+    """
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.connection = self.server.connection_made(transport)
+
+    def get_buffer(self, sizehint: int) -> bytearray:
+        return self.server.receive_buffer
+
+    def buffer_updated(self, nbytes: int):
+        self.server.metrics.bytes_received.inc(nbytes)
+        self.connection.last_active = self.server.timers.ticks
+        lines = self.connection.reader.feed_buffer(self.server.receive_buffer, nbytes)
+        if self.server.settings.batch_dispatch:
+            self.server.batch_received(self.connection, lines)
+        else:
+            self.server.lines_received(self.connection, lines)
+
+    def eof_received(self) -> bool:
+        return False
+
+    def connection_lost(self, exc: Exception | None):
+        if self.connection is not None:
+            self.server.close_connection(self.connection.client_socket)
+
+    def pause_writing(self):
+        self.server.pause_writing(self.connection)
+
+    def resume_writing(self):
+        self.server.resume_writing(self.connection)
+
+    def __init__(self, server: 'AsyncServer'):
+        self.server = server
+        self.connection: AsyncConnection | None = None
+
+
+class MetricsProtocol(asyncio.Protocol):
+    """Отвечает на HTTP-запрос к порту метрик и закрывает соединение."""
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+
+    def data_received(self, data: bytes):
+        body = self.metrics.render()
+        self.transport.write(
+            b'HTTP/1.0 200 OK\r\n'
+            b'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+            b'Content-Length: %d\r\n'
+            b'Connection: close\r\n\r\n' % len(body)
+        )
+        self.transport.write(body)
+        self.transport.close()
+
+    def __init__(self, metrics: ServerMetrics):
+        self.metrics = metrics
+        self.transport: asyncio.Transport | None = None
+
+
+class AsyncServer(Server):
+    """
+    Сервер на `asyncio` с теми же обработчиками, что и у
+    `Server`: `request_received`, `new_connection` и
+    `connection_closed`. Если установлен `uvloop`, может
+    работать на его цикле событий.
+    """
+
+    def connection_made(self, transport: asyncio.Transport) -> AsyncConnection | None:
+        """
+        Регистрирует новое соединение и вызывает обработчик. Если
+        соединений уже `max_connections`, отказывает клиенту и
+        возвращает `None`. Соединения, принятые за одну итерацию
+        цикла событий, обрабатываются в `connections_accepted` вместе.
+        """
+        settings = self.settings
+        if len(self.connections) >= self.max_connections:
+            transport.write(self.reject_message)
+            transport.close()
+            self.metrics.connections_rejected.inc()
+            return None
+        transport.set_write_buffer_limits(settings.high_watermark, settings.low_watermark)
+        connection = AsyncConnection(transport, settings.max_line_length)
+        self.connections[connection.client_socket] = connection
+        self.configure_keepalive(connection.client_socket)
+        self.attach_limiters(connection)
+        self.watch_idle(connection)
+        self.metrics.connections_accepted.inc()
+        if not self.accepting:
+            self.accepting = True
+            asyncio.get_running_loop().call_soon(self.finish_accepting)
+        self.call_handler(connection.client_socket, self.new_connection)
+        return connection
+
+    def finish_accepting(self):
+        """Вызывает `connections_accepted` в конце итерации, в которой приняты соединения."""
+        self.accepting = False
+        self.connections_accepted()
+
+    def close_connection(self, client_socket: socket.socket):
+        """Вызывает обработчик разрыва соединения и закрывает его."""
+        self.closing.discard(client_socket)
+        connection = self.connections.pop(client_socket, None)
+        if connection is None:
+            return
+        if not self.draining:
+            self.call_handler(client_socket, self.connection_closed)
+        self.release_connection(connection)
+        connection.transport.abort()
+        self.metrics.connections_closed.inc()
+        if self.draining and not self.connections and not self.stopped.done():
+            self.stopped.set_result(None)
+
+    def schedule_close(self, client_socket: socket.socket):
+        """Закрывает соединение на следующей итерации цикла событий."""
+        if not self.closing:
+            asyncio.get_running_loop().call_soon(self.close_scheduled)
+        super().schedule_close(client_socket)
+
+    def send(self, client_socket: socket.socket, data: bytes | memoryview):
+        """
+        Передаёт данные транспорту. Пока транспорт просит
+        подождать, данные копятся в очереди соединения, размер
+        которой ограничивает политика медленного клиента.
+        """
+        connection = self.connections.get(client_socket)
+        if connection is None or client_socket in self.closing or connection.transport.is_closing():
+            return
+        if self.batching and not connection.writing_paused:
+            connection.write_queue.append(data)
+            self.unflushed[client_socket] = None
+            return
+        if not connection.writing_paused:
+            connection.transport.write(data)
+            self.metrics.bytes_sent.inc(len(data))
+            return
+        queue = connection.write_queue
+        queue.append(data)
+        if self.settings.slow_consumer_policy is SlowConsumerPolicy.DROP_OLDEST:
+            self.metrics.messages_dropped.inc(queue.drop_oldest(self.settings.high_watermark))
+        elif queue.size > self.settings.max_buffer_size:
+            self.schedule_close(client_socket)
+
+    def send_many(self, client_socket: socket.socket, payloads: list[bytes | memoryview]):
+        """Передаёт транспорту несколько сообщений разом."""
+        connection = self.connections.get(client_socket)
+        if connection is None or client_socket in self.closing or connection.transport.is_closing():
+            return
+        if connection.writing_paused or self.batching:
+            for payload in payloads:
+                self.send(client_socket, payload)
+        else:
+            connection.transport.writelines(payloads)
+            self.metrics.bytes_sent.inc(sum(map(len, payloads)))
+
+    def flush(self, client_socket: socket.socket):
+        """Передаёт транспорту данные, накопленные в очереди соединения."""
+        connection = self.connections.get(client_socket)
+        if connection is None or connection.writing_paused or connection.transport.is_closing():
+            return
+        queue = connection.write_queue
+        if queue:
+            connection.transport.writelines(queue.chunks)
+            self.metrics.bytes_sent.inc(queue.size)
+            queue.chunks.clear()
+            queue.size = 0
+
+    def batch_received(self, connection: AsyncConnection, lines: list[str]):
+        """
+        Откладывает строки до конца итерации цикла событий: все
+        транспорты, готовые к чтению, успевают передать данные до
+        вызова `dispatch_batch`.
+        """
+        if not lines:
+            return
+        if not self.batch:
+            asyncio.get_running_loop().call_soon(self.dispatch_batch)
+        self.batch.append((connection, lines))
+
+    def dispatch_batch(self):
+        """
+        Обрабатывает строки, прочитанные за итерацию, и передаёт
+        каждому транспорту накопленное одним `writelines`.
+        """
+        batch, self.batch = self.batch, []
+        self.batching = True
+        try:
+            self.process_batch(batch)
+        finally:
+            self.batching = False
+            self.flush_batch()
+
+    def pause_writing(self, connection: AsyncConnection):
+        """Буфер транспорта превысил верхнюю отметку."""
+        connection.writing_paused = True
+        policy = self.settings.slow_consumer_policy
+        if policy is SlowConsumerPolicy.DISCONNECT:
+            self.schedule_close(connection.client_socket)
+        elif policy is SlowConsumerPolicy.PAUSE:
+            connection.paused = True
+            self.pause_reading(connection)
+
+    def resume_writing(self, connection: AsyncConnection):
+        """Буфер транспорта опустился до нижней отметки."""
+        connection.writing_paused = False
+        self.flush(connection.client_socket)
+        if connection.paused and not connection.writing_paused:
+            connection.paused = False
+            self.resume_reading(connection)
+
+    def pause_reading(self, connection: AsyncConnection):
+        """Перестает читать из транспорта."""
+        connection.transport.pause_reading()
+
+    def resume_reading(self, connection: AsyncConnection):
+        """
+        Возобновляет чтение из транспорта, если его не держит
+        другая причина.
+        """
+        if not connection.paused and not connection.throttled:
+            connection.transport.resume_reading()
+
+    def start_draining(self):
+        """Останавливает цикл событий сразу, если соединений не осталось."""
+        super().start_draining()
+        if not self.connections and not self.stopped.done():
+            self.stopped.set_result(None)
+
+    def stop_accepting(self):
+        """Перестает принимать соединения и запросы метрик."""
+        loop = asyncio.get_running_loop()
+        loop.remove_reader(self.handoff_socket)
+        self.handoff_socket.close()
+        self.handoff_socket = None
+        self.aio_server.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+
+    def drain_connection(self, connection: AsyncConnection):
+        """
+        Перестает читать соединение и закрывает транспорт: он
+        закроется, когда допишет свой буфер.
+        """
+        connection.transport.pause_reading()
+        queue = connection.write_queue
+        if queue:
+            connection.transport.writelines(queue.chunks)
+            queue.chunks.clear()
+            queue.size = 0
+        connection.transport.close()
+
+    def tick(self):
+        """Продвигает колесо таймеров каждые `timer_resolution` секунд."""
+        self.timers.advance()
+        asyncio.get_running_loop().call_later(self.settings.timer_resolution, self.tick)
+
+    def register_for_reading(self, client_socket: socket.socket, handler: Callable):
+        """
+        Следит за чтением из дополнительного сокета, например
+        шины воркеров, в цикле событий `asyncio`.
+        """
+        self.readers[client_socket] = handler
+        if self.aio_server is not None:
+            asyncio.get_running_loop().add_reader(client_socket, handler)
+
+    def close(self):
+        """
+        Освобождает ресурсы сервера. Транспорты закрываются
+        вместе с циклом событий.
+        """
+        self.connections.clear()
+        super().close()
+
+    async def serve(self):
+        """Принимает соединения, пока задачу не отменят."""
+        loop = asyncio.get_running_loop()
+        # Завершается, когда после передачи сокетов новому процессу
+        # закрыты все соединения.
+        self.stopped = loop.create_future()
+        for client_socket, handler in self.readers.items():
+            loop.add_reader(client_socket, handler)
+        if self.handoff_socket is not None:
+            loop.add_reader(self.handoff_socket, self.accept_handoff)
+        self.tick()
+        if self.metrics_socket is not None:
+            self.metrics_server = await loop.create_server(
+                lambda: MetricsProtocol(self.metrics), sock=self.metrics_socket,
+            )
+        self.aio_server = await loop.create_server(
+            lambda: ServerProtocol(self), sock=self.server_socket, backlog=self.settings.listen_backlog,
+        )
+        async with self.aio_server:
+            await self.stopped
+
+    def start_listening(self):
+        """Запускает цикл событий и начинает принимать запросы."""
+        loop_factory = uvloop.new_event_loop if self.use_uvloop else None
+        with asyncio.Runner(loop_factory=loop_factory) as runner:
+            runner.run(self.serve())
+
+    def __init__(self, host: str, port: int, settings: ServerSettings = None, use_uvloop: bool = False,
+                 handoff: Handoff = None):
+        if use_uvloop and uvloop is None:
+            raise RuntimeError("uvloop не установлен.")
+        # Нужны раньше `super().__init__`: в нем регистрируются
+        # дополнительные сокеты.
+        self.aio_server: asyncio.Server | None = None
+        self.readers: dict[socket.socket, Callable] = {}
+        super().__init__(host, port, settings, handoff)
+        self.use_uvloop = use_uvloop
+        self.metrics_server: asyncio.Server | None = None
+        self.stopped: asyncio.Future | None = None
+        # Строки, прочитанные за текущую итерацию цикла событий.
+        self.batch: list[tuple[AsyncConnection, list[str]]] = []
+
+
+class AsyncChat(AsyncServer, Chat):
+    """Чат-сервер на `asyncio`."""
@@ -0,0 +1,215 @@
+import codecs
+import enum
+import os
+import socket
+from collections import deque
+
+
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 16
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+
+class SlowConsumerPolicy(enum.Enum):
+    """
+    Что делать с клиентом, у которого очередь исходящих
+    сообщений превысила верхнюю отметку.
+    """
+
+    DROP_OLDEST = 'drop_oldest'
+    DISCONNECT = 'disconnect'
+    PAUSE = 'pause'
+
+
+class WriteQueue:
+    """
+    Очередь исходящих данных одного соединения. Хранит
+    сообщения целиком и отправляет их неблокирующим сокетом,
+    запоминая, сколько байт первого сообщения уже ушло.
+
+    Одно и то же сообщение может лежать в очередях многих
+    соединений: данные не копируются, а недоотправленный
+    остаток берётся через `memoryview`.
+    """
+
+    def append(self, data: bytes | memoryview):
+        """Добавляет сообщение в конец очереди."""
+        if not data:
+            return
+        self.chunks.append(data)
+        self.size += len(data)
+
+    def send(self, client_socket: socket.socket) -> int:
+        """
+        Отправляет столько данных, сколько примет сокет, и
+        возвращает количество отправленных байт. Несколько
+        сообщений уходят одним вызовом `sendmsg`. Ошибки
+        соединения пробрасываются наверх.
+        """
+        sent_total = 0
+        while self.chunks:
+            buffers = self._get_buffers()
+            try:
+                if len(buffers) == 1:
+                    sent = client_socket.send(buffers[0])
+                else:
+                    sent = client_socket.sendmsg(buffers)
+            except (BlockingIOError, InterruptedError):
+                break
+            sent_total += sent
+            self._consume(sent)
+            if sent < sum(map(len, buffers)):
+                break
+        return sent_total
+
+    def _get_buffers(self) -> list[memoryview | bytes]:
+        """
+        Возвращает буферы для одного системного вызова:
+        неотправленный остаток первого сообщения и следующие
+        за ним сообщения, но не больше `IOV_MAX`.
+        """
+        buffers = [memoryview(self.chunks[0])[self.offset:]]
+        if HAS_SENDMSG:
+            for index in range(1, min(len(self.chunks), IOV_MAX)):
+                buffers.append(self.chunks[index])
+        return buffers
+
+    def _consume(self, sent: int):
+        """Убирает из очереди `sent` отправленных байт."""
+        self.size -= sent
+        while sent:
+            remaining = len(self.chunks[0]) - self.offset
+            if sent < remaining:
+                self.offset += sent
+                return
+            sent -= remaining
+            self.chunks.popleft()
+            self.offset = 0
+
+    def get_data(self) -> bytes:
+        """Возвращает все неотправленные данные одной строкой байт."""
+        if not self.chunks:
+            return b''
+        chunks = iter(self.chunks)
+        return b''.join((memoryview(next(chunks))[self.offset:], *chunks))
+
+    def drop_oldest(self, limit: int) -> int:
+        """
+        Выбрасывает самые старые сообщения, пока размер очереди
+        больше `limit`. Частично отправленное сообщение не
+        трогается, чтобы не порвать поток. Возвращает количество
+        выброшенных сообщений.
+        """
+        dropped = 0
+        keep_head = self.offset > 0
+        while self.size > limit and len(self.chunks) > keep_head:
+            if keep_head:
+                head = self.chunks.popleft()
+                chunk = self.chunks.popleft()
+                self.chunks.appendleft(head)
+            else:
+                chunk = self.chunks.popleft()
+            self.size -= len(chunk)
+            dropped += 1
+        return dropped
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def __bool__(self):
+        return bool(self.chunks)
+
+    def __init__(self):
+        self.chunks: deque[bytes | memoryview] = deque()
+        self.offset = 0
+        self.size = 0
+
+
+class LineReader:
+    """
+    Входной буфер соединения. Читает данные одним вызовом
+    `recv_into` в общий для всех соединений буфер сервера и
+    делит их на строки по `\n`. У соединения остается только
+    незаконченная строка, а многобайтовые символы, разрезанные
+    границей чтения, собирает инкрементальный декодер UTF-8.
+    """
+
+    def read(self, client_socket: socket.socket, buffer: bytearray) -> list[str] | None:
+        """
+        Читает из сокета через `buffer` и возвращает полученные
+        целые строки без символа перевода строки. Если соединение
+        закрыто, возвращает `None`.
+        """
+        received = client_socket.recv_into(buffer)
+        if not received:
+            return None
+        return self.feed_buffer(buffer, received)
+
+    def feed_buffer(self, buffer: bytearray, size: int) -> list[str]:
+        """
+        Обрабатывает `size` байт, записанных кем-то другим в
+        начало `buffer`. После вызова буфер можно переиспользовать.
+        """
+        return self._split(buffer, size)
+
+    def feed(self, data: bytes) -> list[str]:
+        """Обрабатывает уже полученные данные."""
+        return self._split(data, len(data))
+
+    def get_pending(self) -> bytes:
+        """
+        Возвращает начало незаконченной строки, чтобы другой
+        процесс мог дочитать ее через `feed`.
+        """
+        if self.discarding:
+            return b''
+        return ''.join(self.parts).encode('utf-8') + self.decoder.getstate()[0]
+
+    def _split(self, data: bytes | bytearray, size: int) -> list[str]:
+        """Делит первые `size` байт `data` на строки."""
+        view = memoryview(data)
+        lines = []
+        start = 0
+        while start < size:
+            newline = data.find(b'\n', start, size)
+            end = size if newline == -1 else newline
+            self._append(view[start:end], final=newline != -1)
+            if newline == -1:
+                break
+            if not self.discarding:
+                lines.append(''.join(self.parts).removesuffix('\r'))
+            self._reset()
+            start = newline + 1
+        return lines
+
+    def _append(self, chunk: memoryview, final: bool):
+        """Добавляет кусок к текущей строке."""
+        if self.discarding:
+            return
+        self.line_length += len(chunk)
+        if self.line_length > self.max_line_length:
+            self.discarding = True
+            self.dropped_lines += 1
+            self.parts.clear()
+            self.decoder.reset()
+            return
+        self.parts.append(self.decoder.decode(chunk, final))
+
+    def _reset(self):
+        """Начинает новую строку."""
+        self.parts.clear()
+        self.line_length = 0
+        self.discarding = False
+        self.decoder.reset()
+
+    def __init__(self, max_line_length: int = 64 * 1024):
+        self.max_line_length = max_line_length
+        self.decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.parts: list[str] = []
+        self.line_length = 0
+        # Строка длиннее `max_line_length` пропускается до
+        # следующего перевода строки.
+        self.discarding = False
+        self.dropped_lines = 0
@@ -0,0 +1,164 @@
+import enum
+import itertools
+import multiprocessing
+import os
+import signal
+import socket
+import struct
+import tempfile
+
+from server.settings import ServerSettings
+from server.user import Names, User
+
+
+class BusMessage(enum.IntEnum):
+    """Типы сообщений шины между процессами-воркерами."""
+
+    # Готовое к отправке сообщение пользователя для всех в
+    # комнате. Попадает в историю комнаты.
+    CHAT = 1
+    # Уведомление сервера для комнаты, в историю не попадает.
+    NOTICE = 5
+    # Пользователь вошел в комнату или вышел из нее.
+    JOIN = 2
+    LEAVE = 3
+    # Воркер запустился и просит остальных прислать, кто у них
+    # подключен.
+    HELLO = 4
+    # Личное сообщение. Вместо комнаты - имя получателя.
+    DIRECT = 6
+
+
+class Bus:
+    """
+    Шина сообщений между воркерами на одной машине. Каждый
+    воркер слушает свой датаграммный Unix-сокет и рассылает
+    сообщения остальным через `sendto`.
+    """
+
+    header = struct.Struct('!BHB')
+    max_datagram_size = 256 * 1024
+
+    def publish(self, kind: BusMessage, room: str = '', payload: bytes | memoryview = b''):
+        """Отправляет сообщение всем остальным воркерам."""
+        datagram = self.pack(kind, room, payload)
+        for path in self.peer_paths:
+            self.send_datagram(datagram, path)
+
+    def send(self, worker_id: int, kind: BusMessage, room: str = '', payload: bytes | memoryview = b''):
+        """Отправляет сообщение одному воркеру `worker_id`."""
+        self.send_datagram(self.pack(kind, room, payload), self.get_path(self.directory, worker_id))
+
+    def send_datagram(self, datagram: bytes, path: str):
+        """Отправляет датаграмму, а если не вышло, считает ее потерянной."""
+        try:
+            self.socket.sendto(datagram, path)
+        except (BlockingIOError, FileNotFoundError, ConnectionRefusedError, OSError):
+            self.dropped += 1
+
+    def pack(self, kind: BusMessage, room: str, payload: bytes | memoryview) -> bytes:
+        """Возвращает датаграмму с заголовком."""
+        room_name = room.encode('utf-8')
+        return self.header.pack(kind, self.worker_id, len(room_name)) + room_name + payload
+
+    def receive(self) -> list[tuple[BusMessage, int, str, memoryview]]:
+        """
+        Забирает все пришедшие сообщения. Возвращает список
+        `(тип, номер воркера, комната, данные)`.
+        """
+        messages = []
+        while True:
+            try:
+                datagram = self.socket.recv(self.max_datagram_size)
+            except (BlockingIOError, InterruptedError):
+                break
+            if len(datagram) < self.header.size:
+                continue
+            kind, worker_id, room_length = self.header.unpack_from(datagram)
+            payload_start = self.header.size + room_length
+            room = str(datagram[self.header.size:payload_start], 'utf-8')
+            messages.append((BusMessage(kind), worker_id, room, memoryview(datagram)[payload_start:]))
+        return messages
+
+    def close(self):
+        """Закрывает сокет шины и удаляет его файл."""
+        self.socket.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def get_path(directory: str, worker_id: int) -> str:
+        """Возвращает путь к сокету воркера."""
+        return os.path.join(directory, 'worker-%d.sock' % worker_id)
+
+    def __init__(self, directory: str, worker_id: int, workers: int):
+        self.worker_id = worker_id
+        self.directory = directory
+        self.path = self.get_path(directory, worker_id)
+        self.peer_paths = [
+            self.get_path(directory, peer_id) for peer_id in range(workers) if peer_id != worker_id
+        ]
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.max_datagram_size * 4)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.max_datagram_size * 4)
+        self.socket.bind(self.path)
+        self.socket.setblocking(False)
+        self.dropped = 0
+
+
+def run_worker(server_class: type, host: str, port: int, settings: ServerSettings,
+               directory: str, worker_id: int, workers: int):
+    """Запускает один воркер и подключает его к шине."""
+    User.names_generator = Names(worker_id, workers)
+    User.id_generator = itertools.count(worker_id + 1, workers)
+    if settings.log_directory:
+        settings.log_directory = os.path.join(settings.log_directory, 'worker-%d' % worker_id)
+    if settings.metrics_port is not None:
+        settings.metrics_port += worker_id
+    server = server_class(host, port, settings)
+    bus = Bus(directory, worker_id, workers)
+    server.attach_bus(bus)
+    try:
+        server.start_listening()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        bus.close()
+
+
+def run_workers(server_class: type, host: str, port: int, settings: ServerSettings, workers: int):
+    """
+    Запускает `workers` процессов, каждый из которых слушает
+    один и тот же порт с `SO_REUSEPORT`. Ядро распределяет
+    новые соединения между ними, а рассылки и список
+    пользователей в чате общие благодаря `Bus`.
+    """
+    settings.reuse_port = True
+    with tempfile.TemporaryDirectory(prefix='socket-chat-') as directory:
+        processes = [
+            multiprocessing.Process(
+                target=run_worker,
+                args=(server_class, host, port, settings, directory, worker_id, workers),
+                daemon=True,
+            )
+            for worker_id in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        signal.signal(signal.SIGTERM, lambda *_: stop_workers(processes))
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            stop_workers(processes)
+
+
+def stop_workers(processes: list[multiprocessing.Process]):
+    """Останавливает воркеры и ждёт их завершения."""
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
@@ -0,0 +1,32 @@
+import socket
+
+from server.buffers import LineReader, WriteQueue
+from server.ratelimit import RateLimiter
+from server.timers import Timer
+
+
+class Connection:
+    """Состояние соединения с клиентом на стороне сервера."""
+
+    __slots__ = (
+        'client_socket', 'write_queue', 'reader', 'paused', 'address', 'limiters', 'throttled', 'pending',
+        'last_active', 'idle_timer',
+    )
+
+    def __init__(self, client_socket: socket.socket, max_line_length: int, address: str = ''):
+        self.client_socket = client_socket
+        self.write_queue = WriteQueue()
+        self.reader = LineReader(max_line_length)
+        # Чтение приостановлено из-за переполненной очереди записи.
+        self.paused = False
+        self.address = address
+        # Ограничения частоты соединения и его IP-адреса.
+        self.limiters: tuple[RateLimiter, ...] = ()
+        # Чтение приостановлено из-за ограничения частоты, а
+        # прочитанные строки ждут в `pending`.
+        self.throttled = False
+        self.pending: list[str] = []
+        # Тик колеса таймеров, на котором от клиента пришли
+        # последние данные, и таймер проверки простоя.
+        self.last_active = 0
+        self.idle_timer: Timer | None = None
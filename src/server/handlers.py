@@ -1,8 +1,28 @@
+import base64
+import errno
+import itertools
+import os
+import resource
 import socket
 import selectors
+import time
 from typing import Callable
 
-from server.user import User
+from server.buffers import SlowConsumerPolicy, WriteQueue
+from server.cluster import Bus, BusMessage
+from server.connection import Connection
+from server.handoff import Handoff, get_handoff_socket, send_handoff
+from server.metrics import ServerMetrics
+from server.middleware import Pipeline, load_stage
+from server.protocol import (
+    Deflater, FrameReader, FrameType, PresenceEvent, encode_chat, encode_frame, encode_presence, encode_text,
+)
+from server.ratelimit import RateLimitAction, RateLimiter, TokenBucket
+from server.rooms import Room
+from server.settings import ServerSettings
+from server.storage import MessageLog
+from server.timers import Timer, TimerWheel
+from server.user import Presence, User, UserRegistry
 
 
 class Server:
@@ -11,6 +31,13 @@ class Server:
     входящие сообщения.
     """
 
+    heartbeat_message = b'/ping\n'
+    reject_message = b'Server is full, try again later.\n'
+    # Дескрипторы, которые нужны серверу помимо соединений:
+    # слушающие сокеты, селектор, журнал, шина.
+    reserved_fds = 32
+    receive_buffer_size = 16 * 1024
+
     def request_received(self, *args, **kwargs):
         """Обрабатывает запрос от клиента."""
         pass
@@ -23,6 +50,13 @@ class Server:
         """Обработчик, если соединение было разорвано."""
         pass
 
+    def connections_accepted(self):
+        """
+        Обработчик, что вызывается после пачки новых подключений,
+        для которых уже вызван `new_connection`.
+        """
+        pass
+
     def get_handler_args(self, client_socket: socket.socket) -> list:
         """
         Возвращает список позиционных аргументов, что будут
@@ -37,33 +71,420 @@ class Server:
         """
         return {}
 
-    def accept_connection(self) -> socket.socket:
+    def accept_connections(self):
+        """
+        Принимает ожидающие соединения пачкой, но не больше
+        `accept_batch` за раз, чтобы не задерживать остальные
+        события. Если кончились дескрипторы, перестает принимать
+        соединения на секунду: иначе слушающий сокет будит цикл
+        без конца.
+        """
+        self.accepting = True
+        try:
+            for _ in range(self.settings.accept_batch):
+                try:
+                    self.accept_connection()
+                except (BlockingIOError, InterruptedError):
+                    break
+                except ConnectionAbortedError:
+                    continue
+                except OSError as error:
+                    if error.errno not in (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM):
+                        raise
+                    self.pause_accepting()
+                    break
+        finally:
+            self.accepting = False
+        self.connections_accepted()
+
+    def pause_accepting(self, delay: float = 1.0):
+        """Перестает принимать соединения на `delay` секунд."""
+        self.selector.unregister(self.server_socket)
+        self.call_later(delay, self.resume_accepting)
+
+    def resume_accepting(self):
+        """Снова принимает соединения, если сокеты не переданы новому процессу."""
+        if not self.draining:
+            self.register_for_reading(self.server_socket, self.accept_connections)
+
+    def accept_connection(self) -> socket.socket | None:
         """
         Принимает соединение от клиента и возвращает его
-        сокет.
+        сокет. Сверх `max_connections` соединений клиент
+        получает `reject_message`, и возвращается `None`.
         """
-        client_socket, _ = self.server_socket.accept()
+        client_socket, address = self.server_socket.accept()
+        if len(self.connections) >= self.max_connections:
+            self.reject_connection(client_socket)
+            return None
+        client_socket.setblocking(False)
+        # Очередь записи сама собирает сообщения в пакеты, а Nagle
+        # только задержал бы их до подтверждения предыдущих.
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.configure_keepalive(client_socket)
+        connection = self.connections[client_socket] = Connection(
+            client_socket, self.settings.max_line_length, address[0],
+        )
+        self.attach_limiters(connection)
+        self.watch_idle(connection)
+        self.metrics.connections_accepted.inc()
         self.register_for_reading(client_socket, lambda: self.invoke_handler(client_socket))
         self.call_handler(client_socket, self.new_connection)
         return client_socket
 
+    def reject_connection(self, client_socket: socket.socket):
+        """Отправляет клиенту `reject_message`, если получится сразу, и закрывает соединение."""
+        client_socket.setblocking(False)
+        try:
+            client_socket.send(self.reject_message)
+        except OSError:
+            pass
+        client_socket.close()
+        self.metrics.connections_rejected.inc()
+
     def invoke_handler(self, client_socket: socket.socket):
         """
-        Устанавливает открыто ли соединение и в зависимости
-        от этого вызывает соответсвующий обработчик.
+        Читает данные клиента и вызывает обработчик запроса для
+        каждой полученной строки. Если соединение было закрыто,
+        вызывает соответсвующий обработчик.
+        """
+        connection = self.connections[client_socket]
+        lines = self.receive(connection)
+        if lines:
+            self.lines_received(connection, lines)
+
+    def receive(self, connection: Connection) -> list[str]:
+        """
+        Читает данные клиента и возвращает полученные строки. Если
+        соединение было закрыто, закрывает его.
+        """
+        client_socket = connection.client_socket
+        reader = connection.reader
+        try:
+            received = client_socket.recv_into(self.receive_buffer)
+        except (BlockingIOError, InterruptedError):
+            return []
+        except OSError:
+            received = 0
+        if not received:
+            self.close_connection(client_socket)
+            return []
+        self.metrics.bytes_received.inc(received)
+        connection.last_active = self.timers.ticks
+        return reader.feed_buffer(self.receive_buffer, received)
+
+    def lines_received(self, connection: Connection, lines: list[str]):
+        """
+        Вызывает обработчик запроса для каждой строки, которую
+        пропускают ограничения частоты. Остальные строки
+        выбрасываются, откладываются или приводят к отключению
+        клиента по `rate_limit_action`.
+        """
+        client_socket = connection.client_socket
+        if connection.throttled:
+            connection.pending.extend(lines)
+            return
+        for index, line in enumerate(lines):
+            if client_socket in self.closing or client_socket not in self.connections:
+                break
+            if connection.limiters:
+                delay = self.check_rate(connection, line)
+                if delay:
+                    self.metrics.rate_limited.inc()
+                    action = self.settings.rate_limit_action
+                    if action is RateLimitAction.DROP:
+                        continue
+                    if action is RateLimitAction.DISCONNECT:
+                        self.schedule_close(client_socket)
+                    else:
+                        connection.pending.extend(lines[index:])
+                        self.throttle(connection, delay)
+                    break
+            self.call_handler(client_socket, self.request_received, line)
+
+    @staticmethod
+    def check_rate(connection: Connection, line: str) -> float:
+        """
+        Возвращает, сколько секунд клиенту ждать до приема строки
+        `line`, или 0, если она принята и учтена в ограничениях.
+        """
+        now = time.monotonic()
+        size = len(line) + 1
+        limiters = connection.limiters
+        delay = max(limiter.wait_time(size, now) for limiter in limiters)
+        if not delay:
+            for limiter in limiters:
+                limiter.take(size)
+        return delay
+
+    def throttle(self, connection: Connection, delay: float):
+        """Приостанавливает чтение клиента на `delay` секунд."""
+        connection.throttled = True
+        self.pause_reading(connection)
+        self.call_later(delay, lambda: self.release_throttled(connection))
+
+    def release_throttled(self, connection: Connection):
+        """
+        Обрабатывает отложенные строки клиента и возобновляет
+        чтение, если ограничение снова не сработало.
+        """
+        if connection.client_socket not in self.connections:
+            return
+        lines, connection.pending = connection.pending, []
+        connection.throttled = False
+        self.lines_received(connection, lines)
+        if not connection.throttled and connection.client_socket in self.connections:
+            self.resume_reading(connection)
+
+    def pause_reading(self, connection: Connection):
+        """Перестает читать из соединения."""
+        self.update_events(connection)
+
+    def resume_reading(self, connection: Connection):
+        """Возобновляет чтение из соединения."""
+        self.update_events(connection)
+
+    def attach_limiters(self, connection: Connection):
+        """
+        Создает ограничения частоты соединения и подключает его к
+        общему ограничению его IP-адреса, если они заданы.
+        """
+        settings = self.settings
+        now = time.monotonic()
+        limiters = []
+        if settings.message_rate or settings.byte_rate:
+            limiters.append(RateLimiter(
+                self.get_bucket(settings.message_rate, settings.message_burst, now),
+                self.get_bucket(settings.byte_rate, settings.byte_burst, now),
+            ))
+        if settings.address_message_rate or settings.address_byte_rate:
+            limiter = self.address_limiters.get(connection.address)
+            if limiter is None:
+                limiter = self.address_limiters[connection.address] = RateLimiter(
+                    self.get_bucket(settings.address_message_rate, settings.address_message_burst, now),
+                    self.get_bucket(settings.address_byte_rate, settings.address_byte_burst, now),
+                )
+            limiter.connections += 1
+            limiters.append(limiter)
+        connection.limiters = tuple(limiters)
+
+    def release_connection(self, connection: Connection):
+        """Освобождает ограничения и таймеры закрытого соединения."""
+        self.detach_limiters(connection)
+        if connection.idle_timer is not None:
+            self.timers.cancel(connection.idle_timer)
+
+    def detach_limiters(self, connection: Connection):
+        """Отключает соединение от ограничения его IP-адреса."""
+        limiter = self.address_limiters.get(connection.address)
+        if limiter is not None and limiter in connection.limiters:
+            limiter.connections -= 1
+            if not limiter.connections:
+                del self.address_limiters[connection.address]
+
+    @staticmethod
+    def get_bucket(rate: float | None, burst: int, now: float) -> TokenBucket | None:
+        """Возвращает корзину токенов или `None`, если ограничения нет."""
+        return TokenBucket(rate, burst, now) if rate else None
+
+    def call_later(self, delay: float, callback: Callable) -> Timer:
+        """
+        Вызывает `callback` через `delay` секунд с точностью до
+        шага колеса таймеров.
+        """
+        return self.timers.schedule(delay, callback)
+
+    def watch_idle(self, connection: Connection):
+        """Ставит таймер проверки простоя, если она включена."""
+        settings = self.settings
+        delays = [delay for delay in (settings.idle_timeout, settings.heartbeat_interval) if delay]
+        if delays:
+            connection.last_active = self.timers.ticks
+            connection.idle_timer = self.call_later(min(delays), lambda: self.check_idle(connection))
+
+    def check_idle(self, connection: Connection):
         """
-        if not client_socket.recv(4096, socket.MSG_PEEK):
+        Закрывает соединение, простаивающее дольше `idle_timeout`,
+        и шлет `/ping` простаивающему дольше `heartbeat_interval`.
+        Таймер не переставляется на каждое сообщение: он
+        срабатывает по первоначальному сроку и, если клиент с тех
+        пор что-то присылал, переносится на остаток.
+        """
+        if connection.client_socket not in self.connections:
+            return
+        settings = self.settings
+        idle = (self.timers.ticks - connection.last_active) * self.timers.resolution
+        delays = []
+        if settings.idle_timeout:
+            if idle >= settings.idle_timeout:
+                self.schedule_close(connection.client_socket)
+                return
+            delays.append(settings.idle_timeout - idle)
+        if settings.heartbeat_interval:
+            if idle >= settings.heartbeat_interval:
+                self.send_heartbeat(connection)
+                delays.append(settings.heartbeat_interval)
+            else:
+                delays.append(settings.heartbeat_interval - idle)
+        self.timers.reschedule(connection.idle_timer, min(delays))
+
+    def send_heartbeat(self, connection: Connection):
+        """Отправляет клиенту `/ping`."""
+        self.send(connection.client_socket, self.heartbeat_message)
+
+    def configure_keepalive(self, client_socket: socket.socket):
+        """Включает TCP keepalive на сокете клиента, если он задан."""
+        settings = self.settings
+        if not settings.tcp_keepalive:
+            return
+        client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for option, value in (
+            ('TCP_KEEPIDLE', settings.keepalive_idle),
+            ('TCP_KEEPINTVL', settings.keepalive_interval),
+            ('TCP_KEEPCNT', settings.keepalive_count),
+        ):
+            if hasattr(socket, option):
+                client_socket.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+    def close_connection(self, client_socket: socket.socket):
+        """
+        Вызывает обработчик разрыва соединения, убирает сокет
+        со слежения и закрывает его.
+        """
+        self.closing.discard(client_socket)
+        if client_socket.fileno() == -1:
+            return
+        if not self.draining:
             self.call_handler(client_socket, self.connection_closed)
-            self.unregister_from_reading(client_socket)
-            self.close_socket(client_socket)
+        self.unregister_from_reading(client_socket)
+        connection = self.connections.pop(client_socket, None)
+        if connection is not None:
+            self.release_connection(connection)
+        self.close_socket(client_socket)
+        self.metrics.connections_closed.inc()
+
+    def schedule_close(self, client_socket: socket.socket):
+        """
+        Помечает соединение на закрытие. Сокет закрывается после
+        обработки текущего события, чтобы не менять коллекции
+        пользователей во время рассылки.
+        """
+        self.closing.add(client_socket)
+
+    def close_scheduled(self):
+        """Закрывает все соединения, помеченные на закрытие."""
+        while self.closing:
+            self.close_connection(next(iter(self.closing)))
+
+    def send(self, client_socket: socket.socket, data: bytes | memoryview):
+        """
+        Ставит данные в очередь на отправку. Если очередь была
+        пуста, пробует отправить их сразу, остаток уйдёт, когда
+        сокет станет доступен для записи.
+        """
+        connection = self.connections.get(client_socket)
+        if connection is None or client_socket in self.closing:
+            return
+        if self.batching:
+            connection.write_queue.append(data)
+            self.unflushed[client_socket] = None
+            return
+        was_empty = not connection.write_queue
+        connection.write_queue.append(data)
+        if was_empty:
+            self.flush(client_socket)
         else:
-            self.call_handler(client_socket, self.request_received)
+            self.apply_watermarks(connection)
+
+    def send_many(self, client_socket: socket.socket, payloads: list[bytes | memoryview]):
+        """
+        Ставит в очередь несколько сообщений и отправляет их
+        одним системным вызовом.
+        """
+        connection = self.connections.get(client_socket)
+        if connection is None or client_socket in self.closing:
+            return
+        for payload in payloads:
+            connection.write_queue.append(payload)
+        if self.batching:
+            self.unflushed[client_socket] = None
+        else:
+            self.flush(client_socket)
+
+    def flush_batch(self):
+        """Отправляет все, что накопилось в очередях за итерацию."""
+        for client_socket in self.unflushed:
+            self.flush(client_socket)
+        self.unflushed.clear()
+
+    def flush(self, client_socket: socket.socket):
+        """Отправляет накопленные в очереди данные."""
+        connection = self.connections.get(client_socket)
+        if connection is None or client_socket in self.closing:
+            return
+        try:
+            self.metrics.bytes_sent.inc(connection.write_queue.send(client_socket))
+        except OSError:
+            self.schedule_close(client_socket)
+            return
+        self.apply_watermarks(connection)
 
-    def call_handler(self, client_socket: socket.socket, handler: Callable):
-        """Вызывает обработчик."""
+    def apply_watermarks(self, connection: Connection):
+        """
+        Применяет политику медленного клиента, если очередь
+        переполнена, и обновляет события, за которыми следит
+        селектор.
+        """
+        settings = self.settings
+        client_socket = connection.client_socket
+        queue = connection.write_queue
+        if queue.size > settings.high_watermark:
+            policy = settings.slow_consumer_policy
+            if policy is SlowConsumerPolicy.DROP_OLDEST:
+                self.metrics.messages_dropped.inc(queue.drop_oldest(settings.high_watermark))
+            elif policy is SlowConsumerPolicy.DISCONNECT:
+                self.schedule_close(client_socket)
+                return
+            elif queue.size > settings.max_buffer_size:
+                self.schedule_close(client_socket)
+                return
+            else:
+                connection.paused = True
+        elif connection.paused and queue.size <= settings.low_watermark:
+            connection.paused = False
+        self.update_events(connection)
+
+    def update_events(self, connection: Connection):
+        """
+        Следит за чтением, если клиент не приостановлен, и за
+        записью, если у него есть неотправленные данные. Сокет,
+        за которым следить не нужно, убирается из селектора.
+        """
+        client_socket = connection.client_socket
+        key = self.selector.get_map().get(client_socket)
+        events = 0
+        if not connection.paused and not connection.throttled and not self.draining:
+            events |= selectors.EVENT_READ
+        if connection.write_queue:
+            events |= selectors.EVENT_WRITE
+        if key is None:
+            if events:
+                self.selector.register(client_socket, events, lambda: self.invoke_handler(client_socket))
+        elif not events:
+            self.selector.unregister(client_socket)
+        elif events != key.events:
+            self.selector.modify(client_socket, events, key.data)
+
+    def call_handler(self, client_socket: socket.socket, handler: Callable, *extra_args):
+        """
+        Вызывает обработчик. `extra_args` передаются после
+        аргументов из `get_handler_args`.
+        """
+        started = time.perf_counter()
         args = self.get_handler_args(client_socket)
         kwargs = self.get_handler_kwargs(client_socket)
-        handler(*args, **kwargs)
+        handler(*args, *extra_args, **kwargs)
+        self.metrics.handler_duration.observe(time.perf_counter() - started)
 
     def register_for_reading(self, client_socket: socket.socket, handler: Callable):
         """Регистрирует сокет на слежение."""
@@ -73,92 +494,879 @@ class Server:
         """Убирает сокет со слежения."""
         if client_socket is self.server_socket:
             raise ValueError("Нельзя перестать следить за серверным сокетом.")
-        self.selector.unregister(client_socket)
+        if client_socket in self.selector.get_map():
+            self.selector.unregister(client_socket)
 
     @staticmethod
     def close_socket(client_socket: socket.socket):
         """Закрывает соединение с сокетом."""
         client_socket.close()
 
+    def accept_scrape(self):
+        """Принимает соединение на порт метрик."""
+        scrape_socket, _ = self.metrics_socket.accept()
+        scrape_socket.setblocking(False)
+        self.scrapes[scrape_socket] = WriteQueue()
+        self.selector.register(scrape_socket, selectors.EVENT_READ, lambda: self.scrape_received(scrape_socket))
+
+    def scrape_received(self, scrape_socket: socket.socket):
+        """
+        Отвечает на HTTP-запрос к порту метрик, не разбирая его:
+        по любому пути отдаются все метрики.
+        """
+        try:
+            request = scrape_socket.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            request = b''
+        if not request:
+            self.close_scrape(scrape_socket)
+            return
+        body = self.metrics.render()
+        queue = self.scrapes[scrape_socket]
+        queue.append(
+            b'HTTP/1.0 200 OK\r\n'
+            b'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+            b'Content-Length: %d\r\n'
+            b'Connection: close\r\n\r\n' % len(body)
+        )
+        queue.append(body)
+        self.selector.modify(scrape_socket, selectors.EVENT_WRITE, lambda: self.write_scrape(scrape_socket))
+        self.write_scrape(scrape_socket)
+
+    def write_scrape(self, scrape_socket: socket.socket):
+        """Отправляет ответ с метриками и закрывает соединение."""
+        queue = self.scrapes.get(scrape_socket)
+        if queue is None:
+            return
+        try:
+            queue.send(scrape_socket)
+        except OSError:
+            queue.chunks.clear()
+        if not queue:
+            self.close_scrape(scrape_socket)
+
+    def close_scrape(self, scrape_socket: socket.socket):
+        """Закрывает соединение с портом метрик."""
+        self.scrapes.pop(scrape_socket, None)
+        self.selector.unregister(scrape_socket)
+        scrape_socket.close()
+
+    def accept_handoff(self):
+        """
+        Новый процесс подключился к `handoff_path`: передает ему
+        слушающие сокеты, а с `handoff_clients` - и соединения
+        клиентов. После подтверждения перестает принимать
+        соединения и дописывает очереди оставшихся клиентов. Если
+        передача не удалась, продолжает работать как раньше.
+        """
+        channel, _ = self.handoff_socket.accept()
+        with channel:
+            channel.settimeout(self.settings.drain_timeout)
+            clients = []
+            if self.settings.handoff_clients:
+                clients = [
+                    (client_socket, self.get_connection_state(connection))
+                    for client_socket, connection in self.connections.items()
+                    if client_socket not in self.closing
+                ]
+            try:
+                send_handoff(channel, self.server_socket, self.metrics_socket, self.get_handoff_state(), clients)
+            except OSError:
+                return
+        for client_socket, _ in clients:
+            self.forget_connection(client_socket)
+        self.start_draining()
+
+    def get_handoff_state(self) -> dict:
+        """Возвращает состояние сервера для нового процесса."""
+        return {}
+
+    def get_connection_state(self, connection: Connection) -> dict:
+        """
+        Возвращает состояние соединения для нового процесса:
+        неотправленные данные и начало недочитанной строки.
+        """
+        return {
+            'address': connection.address,
+            'output': base64.b64encode(connection.write_queue.get_data()).decode('ascii'),
+            'input': base64.b64encode(connection.reader.get_pending()).decode('ascii'),
+        }
+
+    def forget_connection(self, client_socket: socket.socket):
+        """
+        Забывает соединение, переданное другому процессу, без
+        вызова обработчиков. Закрывается только свой дескриптор
+        сокета, соединение остается открытым.
+        """
+        self.unregister_from_reading(client_socket)
+        self.unflushed.pop(client_socket, None)
+        connection = self.connections.pop(client_socket, None)
+        if connection is not None:
+            self.release_connection(connection)
+        client_socket.close()
+
+    def restore_handoff(self, handoff: Handoff):
+        """Принимает состояние и соединения, переданные старым процессом."""
+        self.restore_state(handoff.state)
+        for client_socket, state in handoff.clients:
+            client_socket.setblocking(False)
+            connection = self.connections[client_socket] = Connection(
+                client_socket, self.settings.max_line_length, state['address'],
+            )
+            self.restore_connection(connection, state)
+            self.attach_limiters(connection)
+            self.watch_idle(connection)
+            self.register_for_reading(
+                client_socket, lambda client_socket=client_socket: self.invoke_handler(client_socket),
+            )
+            self.send(client_socket, base64.b64decode(state['output']))
+
+    def restore_state(self, state: dict):
+        """Восстанавливает состояние сервера из `get_handoff_state`."""
+        pass
+
+    def restore_connection(self, connection: Connection, state: dict):
+        """Восстанавливает состояние соединения из `get_connection_state`."""
+        connection.reader.feed(base64.b64decode(state['input']))
+
+    def start_draining(self):
+        """
+        Перестает принимать соединения и читать клиентов. Каждое
+        соединение закрывается, как только его очередь опустеет,
+        а через `drain_timeout` секунд закрываются все оставшиеся.
+        """
+        self.draining = True
+        self.stop_accepting()
+        for connection in list(self.connections.values()):
+            self.drain_connection(connection)
+        self.call_later(self.settings.drain_timeout, self.abort_drain)
+
+    def stop_accepting(self):
+        """
+        Закрывает свои дескрипторы слушающих сокетов: их уже
+        слушает новый процесс.
+        """
+        for sock in filter(None, (self.server_socket, self.metrics_socket, self.handoff_socket)):
+            if sock in self.selector.get_map():
+                self.selector.unregister(sock)
+            sock.close()
+        self.handoff_socket = None
+
+    def drain_connection(self, connection: Connection):
+        """Перестает читать соединение, пока дописывается его очередь."""
+        self.update_events(connection)
+
+    def abort_drain(self):
+        """Закрывает соединения, которые не успели получить свои данные."""
+        for client_socket in list(self.connections):
+            self.schedule_close(client_socket)
+
+    def close_drained(self):
+        """Закрывает соединения, очереди которых опустели."""
+        for connection in list(self.connections.values()):
+            if not connection.write_queue:
+                self.close_connection(connection.client_socket)
+
     def start_listening(self):
-        """Начинает принимать запросы и обрабатывать их."""
-        self.server_socket.listen()
-        self.register_for_reading(self.server_socket, self.accept_connection)
+        """
+        Начинает принимать запросы и обрабатывать их. Возвращается,
+        когда после передачи сокетов новому процессу закрыты все
+        соединения.
+        """
+        self.server_socket.listen(self.settings.listen_backlog)
+        self.server_socket.setblocking(False)
+        self.register_for_reading(self.server_socket, self.accept_connections)
+        if self.metrics_socket is not None:
+            self.register_for_reading(self.metrics_socket, self.accept_scrape)
+        if self.handoff_socket is not None:
+            self.register_for_reading(self.handoff_socket, self.accept_handoff)
+        loop_iteration = self.metrics.loop_iteration
         while True:
-            for reg_socket, event in self.selector.select():
-                reg_socket.data()
+            self.timers.advance()
+            self.close_scheduled()
+            if self.draining:
+                self.close_drained()
+                if not self.connections:
+                    return
+            events = self.selector.select(self.timers.get_timeout())
+            started = time.perf_counter()
+            if self.settings.batch_dispatch:
+                self.handle_batch(events)
+            else:
+                for reg_socket, event in events:
+                    if event & selectors.EVENT_WRITE:
+                        if reg_socket.fileobj in self.scrapes:
+                            reg_socket.data()
+                            continue
+                        self.flush(reg_socket.fileobj)
+                    if event & selectors.EVENT_READ and reg_socket.fileobj not in self.closing:
+                        reg_socket.data()
+                    self.close_scheduled()
+            loop_iteration.observe(time.perf_counter() - started)
+
+    def handle_batch(self, events: list[tuple[selectors.SelectorKey, int]]):
+        """
+        Обрабатывает события одной итерации пакетом: сначала
+        читает все готовые сокеты, затем вызывает обработчики
+        прочитанных строк. Отправки за это время только копятся в
+        очередях, и каждому получателю все накопленное уходит
+        одним вызовом `sendmsg`. Если обработчик бросит
+        исключение, накопленное все равно отправляется.
+        """
+        self.batching = True
+        try:
+            batch = []
+            for reg_socket, event in events:
+                client_socket = reg_socket.fileobj
+                if event & selectors.EVENT_WRITE:
+                    if client_socket in self.scrapes:
+                        reg_socket.data()
+                        continue
+                    self.flush(client_socket)
+                if event & selectors.EVENT_READ and client_socket not in self.closing:
+                    connection = self.connections.get(client_socket)
+                    if connection is None:
+                        reg_socket.data()
+                        continue
+                    lines = self.receive(connection)
+                    if lines:
+                        batch.append((connection, lines))
+            self.process_batch(batch)
+        finally:
+            self.batching = False
+            self.flush_batch()
+        self.close_scheduled()
+
+    def process_batch(self, batch: list[tuple[Connection, list[str]]]):
+        """
+        Вызывает обработчики строк, прочитанных за итерацию.
+        После каждых `batch_max_lines` строк накопленное
+        отправляется, не дожидаясь конца пакета.
+        """
+        handled = 0
+        for connection, lines in batch:
+            self.lines_received(connection, lines)
+            handled += len(lines)
+            if handled >= self.settings.batch_max_lines:
+                self.metrics.batch_lines.observe(handled)
+                handled = 0
+                self.flush_batch()
+        if handled:
+            self.metrics.batch_lines.observe(handled)
+
+    def close(self):
+        """
+        Закрывает все соединения без вызова обработчиков и
+        освобождает ресурсы сервера.
+        """
+        for client_socket in self.connections:
+            self.close_socket(client_socket)
+        self.connections.clear()
+        for scrape_socket in self.scrapes:
+            scrape_socket.close()
+        self.scrapes.clear()
+        self.selector.close()
+        self.server_socket.close()
+        if self.metrics_socket is not None:
+            self.metrics_socket.close()
+        if self.handoff_socket is not None:
+            self.handoff_socket.close()
+            os.unlink(self.settings.handoff_path)
+
+    def get_max_connections(self) -> int:
+        """
+        Возвращает `max_connections` из настроек или столько,
+        сколько позволяет предел открытых файлов.
+        """
+        if self.settings.max_connections is not None:
+            return self.settings.max_connections
+        soft_limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft_limit == resource.RLIM_INFINITY:
+            return 1 << 30
+        return max(soft_limit - self.reserved_fds, 1)
 
     @staticmethod
-    def get_server_socket(host: str, port: int) -> socket.socket:
-        """Возвращает сокет сервера."""
+    def get_server_socket(host: str, port: int, reuse_port: bool = False) -> socket.socket:
+        """
+        Возвращает сокет сервера. С `reuse_port` один порт могут
+        слушать несколько процессов.
+        """
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         sock.bind((host, port))
         return sock
 
-    def __init__(self, host: str, port: int):
-        self.server_socket = self.get_server_socket(host, port)
+    def __init__(self, host: str, port: int, settings: ServerSettings = None, handoff: Handoff = None):
+        self.settings = settings or ServerSettings()
+        # При горячем перезапуске сокеты достаются от старого
+        # процесса, а его соединения - через `restore_handoff`.
+        if handoff is not None:
+            self.server_socket = handoff.server_socket
+        else:
+            self.server_socket = self.get_server_socket(host, port, self.settings.reuse_port)
         self.selector = selectors.DefaultSelector()
+        self.connections: dict[socket.socket, Connection] = {}
+        self.closing: set[socket.socket] = set()
+        # Буфер приема, общий для всех соединений: прочитанное
+        # сразу делится на строки, и у соединения остается только
+        # незаконченная строка.
+        self.receive_buffer = bytearray(self.receive_buffer_size)
+        self.metrics = ServerMetrics(self)
+        # Порт метрик в текстовом формате Prometheus и ответы,
+        # которые на нем еще не дописаны.
+        self.metrics_socket: socket.socket | None = None
+        if handoff is not None and handoff.metrics_socket is not None:
+            self.metrics_socket = handoff.metrics_socket
+        elif self.settings.metrics_port is not None:
+            self.metrics_socket = self.get_server_socket(self.settings.metrics_host, self.settings.metrics_port)
+            self.metrics_socket.listen()
+        self.scrapes: dict[socket.socket, WriteQueue] = {}
+        # Общие ограничения частоты по IP-адресам.
+        self.address_limiters: dict[str, RateLimiter] = {}
+        self.timers = TimerWheel(self.settings.timer_resolution)
+        # В пакетном режиме отправки копятся в очередях, а сокеты
+        # с неотправленными данными ждут в `unflushed`.
+        self.batching = False
+        self.unflushed: dict[socket.socket, None] = {}
+        # Сокет для передачи соединений следующему процессу.
+        # После передачи сервер только дописывает очереди.
+        self.handoff_socket: socket.socket | None = None
+        if self.settings.handoff_path:
+            self.handoff_socket = get_handoff_socket(self.settings.handoff_path)
+        self.draining = False
+        self.max_connections = self.get_max_connections()
+        # Идет прием пачки соединений: `connections_accepted` еще
+        # не вызван.
+        self.accepting = False
 
 
 class Chat(Server):
-    """Чат-сервер, позволяющий общаться пользователям."""
+    """
+    Чат-сервер, позволяющий общаться пользователям. Каждый
+    пользователь находится в одной комнате, и его сообщения
+    получают только ее участники.
+    """
+
+    reject_message = b'=== Server ===\nServer is full, try again later.\n==============\n'
+    max_listed_joins = 20
 
-    def request_received(self, user: User):
+    def request_received(self, user: User, request: str):
         """
         Обработчик. Принимает сообщение и отправляет его всем
-        остальным.
+        остальным в комнате. Строки, начинающиеся с `/`,
+        считаются командами. Если заданы стадии обработки,
+        сообщение сначала проходит `pipeline`, а команды ждут в
+        той же очереди, чтобы не обогнать сообщения перед ними.
+        Команда это или нет, решается по исходной строке: текст
+        после стадий командой не становится.
         """
-        request = self.get_user_request(user)
-        message = self.format_message(user, request)
-        self.send_to_users_except(user, message)
+        if self.pipeline is None:
+            if request.startswith('/'):
+                self.command_received(user, request)
+            else:
+                self.message_received(user, request)
+            return
+        prefix, text = self.split_message_text(request)
+        if text is None:
+            self.pipeline.submit(
+                user.client_socket, request, lambda request: self.command_received(user, request), transform=False,
+            )
+        elif prefix:
+            self.pipeline.submit(user.client_socket, text, lambda text: self.command_received(user, prefix + text))
+        else:
+            self.pipeline.submit(user.client_socket, text, lambda text: self.message_received(user, text))
+
+    @staticmethod
+    def split_message_text(request: str) -> tuple[str, str | None]:
+        """
+        Делит строку на начало, которое не меняется, и текст
+        сообщения для стадий обработки. У `/msg` начало - команда с
+        получателями. У остальных команд текста нет.
+        """
+        if not request.startswith('/'):
+            return '', request
+        if request.startswith('/msg '):
+            names, _, text = request[5:].lstrip().partition(' ')
+            if names and text.strip():
+                return '/msg %s ' % names, text
+        return request, None
+
+    def message_received(self, user: User, text: str):
+        """Рассылает сообщение пользователя его комнате, даже если оно начинается с `/`."""
+        payload = memoryview(self.encode_message(user, text))
+        self.broadcast(
+            payload, user.room.name, user, remember=True, sender=user.username,
+            frame=lambda: encode_chat(user.user_id, payload[len(user.prefix):-1]),
+        )
 
     def new_connection(self, user: User):
         """
-        Обработчик. Уведомляет остальных пользователей о новом
-        подключении.
+        Обработчик. Уведомляет остальных пользователей комнаты
+        о новом подключении. Подключения одной пачки копятся в
+        `joined` до `connections_accepted`.
         """
-        message = self.format_message(user, "Has connected!")
-        self.send_to_users_except(user, self.get_server_mark(message))
-        self.send_to(user, self.get_users_in_chat_message([user]))
+        self.joined[user.client_socket] = user
+        if not self.accepting:
+            self.connections_accepted()
+
+    def connections_accepted(self):
+        """
+        Обработчик. Уведомляет комнаты о подключениях пачки одним
+        сообщением на комнату, а новым пользователям присылает
+        историю и список тех, кто в комнате.
+        """
+        joined, self.joined = self.joined, {}
+        rooms: dict[str, list[User]] = {}
+        for user in joined.values():
+            rooms.setdefault(user.room.name, []).append(user)
+        for room_name, users in rooms.items():
+            self.announce_joins(room_name, users)
+        for user in joined.values():
+            self.send_history(user)
+            self.send_to(user, self.get_users_in_chat_message(user))
+
+    def announce_joins(self, room_name: str, users: list[User]):
+        """
+        Отправляет остальным в комнате одно уведомление о всех
+        подключившихся `users`. В длинном списке перечисляются
+        только первые `max_listed_joins` имен.
+        """
+        if len(users) == 1:
+            message = self.format_message(users[0], "Has connected!")
+        else:
+            names = ', '.join(user.username for user in users[:self.max_listed_joins])
+            if len(users) > self.max_listed_joins:
+                names += ' and %d more' % (len(users) - self.max_listed_joins)
+            message = names + " have connected!"
+        frame = b''.join(self.get_presence_frame(user, PresenceEvent.JOIN) for user in users)
+        payload = memoryview(self.format_message_before_send(self.get_server_mark(message)))
+        self.broadcast(payload, room_name, exclude=users, frame=frame)
 
     def connection_closed(self, user: User):
         """
         Обработчик. Уведомляет других клиентов, что пользователь
-        вышел из чата (соединение было разорвано).
+        вышел из чата (соединение было разорвано). О тех, чье
+        подключение еще не объявлено, никто не уведомляется.
         """
-        message = self.format_message(user, "Has disconnected!")
-        self.send_to_users_except(user, self.get_server_mark(message))
+        if self.joined.pop(user.client_socket, None) is None:
+            message = self.format_message(user, "Has disconnected!")
+            self.send_to_users_except(
+                user, self.get_server_mark(message), self.get_presence_frame(user, PresenceEvent.LEAVE),
+            )
+        if self.pipeline is not None:
+            self.pipeline.forget(user.client_socket)
+        self.leave_room(user)
         self.registered_users.pop(user.client_socket)
-        del user
+        user.release()
+
+    def command_received(self, user: User, request: str):
+        """Выполняет команду пользователя вида `/name argument`."""
+        name, _, argument = request[1:].partition(' ')
+        command = self.commands.get(name)
+        if command is None:
+            self.send_notice(user, "Unknown command /%s." % name)
+        else:
+            command(user, argument.strip())
+
+    def msg_command(self, user: User, argument: str):
+        """
+        Команда `/msg name[,name...] text`: личное сообщение.
+        Получатели ищутся по имени, в том числе на других
+        воркерах, и сообщение отправляется только им, а не всей
+        комнате. О неизвестных именах сообщается отправителю.
+        """
+        names, _, text = argument.partition(' ')
+        text = text.strip()
+        if not names or not text:
+            self.send_notice(user, "Usage: /msg <name>[,<name>...] <text>")
+            return
+        message = self.format_message(user, "(private) " + text)
+        unknown = []
+        for name in dict.fromkeys(filter(None, names.split(','))):
+            recipient = self.registered_users.by_name.get(name)
+            if recipient is not None:
+                self.send_to(recipient, message)
+            elif name in self.remote_users:
+                self.bus.send(self.remote_users[name], BusMessage.DIRECT, name, message.encode('utf-8'))
+            else:
+                unknown.append(name)
+        if unknown:
+            self.send_notice(user, "Unknown user: %s." % ', '.join(unknown))
+
+    def join_command(self, user: User, room_name: str):
+        """Команда `/join room`: переходит в другую комнату."""
+        if not Room.is_valid_name(room_name):
+            self.send_notice(user, "Usage: /join <room>")
+        elif room_name == user.room.name:
+            self.send_notice(user, "You are already in %s." % room_name)
+        else:
+            self.move_to_room(user, room_name)
+
+    def leave_command(self, user: User, argument: str):
+        """Команда `/leave`: возвращается в комнату по умолчанию."""
+        if user.room.name == self.settings.default_room:
+            self.send_notice(user, "You are in the default room.")
+        else:
+            self.move_to_room(user, self.settings.default_room)
+
+    def rooms_command(self, user: User, argument: str):
+        """Команда `/rooms`: присылает список комнат."""
+        rooms = {name: len(room) for name, room in self.rooms.items()}
+        for name, presence in self.remote_rooms.items():
+            rooms[name] = rooms.get(name, 0) + len(presence)
+        rooms_list = ", ".join("%s (%d)" % room for room in rooms.items() if room[1])
+        self.send_notice(user, "Rooms: " + rooms_list)
+
+    def ping_command(self, user: User, argument: str):
+        """Команда `/ping`: проверка связи, сервер отвечает `/pong`."""
+        if user.binary:
+            self.send_frame(user, encode_frame(FrameType.PONG))
+        else:
+            self.send(user.client_socket, b'/pong\n')
+
+    def pong_command(self, user: User, argument: str):
+        """Команда `/pong`: ответ клиента на `/ping` сервера."""
+        pass
+
+    def binary_command(self, user: User, argument: str):
+        """
+        Команда `/binary [zlib]`: переводит соединение на двоичный
+        протокол из `server.protocol`, по желанию со сжатием.
+        Ответ `/binary` или `/binary zlib` - последняя текстовая
+        строка, после нее сервер шлет только кадры. Клиент должен
+        дождаться ответа, прежде чем слать кадры сам.
+        """
+        if argument not in ('', 'zlib'):
+            self.send_notice(user, "Usage: /binary [zlib]")
+            return
+        if user.binary:
+            self.send_notice(user, "Binary mode is already on.")
+            return
+        self.send(user.client_socket, ('/binary %s' % argument).strip().encode('utf-8') + b'\n')
+        self.connections[user.client_socket].reader = FrameReader(self.settings.max_line_length)
+        user.binary = True
+        user.compressed = argument == 'zlib'
+        self.send_presence(user)
+
+    def move_to_room(self, user: User, room_name: str):
+        """
+        Переводит пользователя в комнату `room_name` и уведомляет
+        об этом обе комнаты.
+        """
+        message = self.format_message(user, "Has left the room.")
+        self.send_to_users_except(
+            user, self.get_server_mark(message), self.get_presence_frame(user, PresenceEvent.LEAVE),
+        )
+        self.leave_room(user)
+        self.join_room(user, room_name)
+        message = self.format_message(user, "Has joined the room!")
+        self.send_to_users_except(
+            user, self.get_server_mark(message), self.get_presence_frame(user, PresenceEvent.JOIN),
+        )
+        self.send_history(user)
+        if user.binary:
+            self.send_notice(user, "Room %s." % room_name)
+            self.send_presence(user)
+        else:
+            self.send_notice(user, "Room %s. %s" % (room_name, self.get_users_in_chat_message(user)))
+
+    def join_room(self, user: User, room_name: str):
+        """Добавляет пользователя в комнату, создавая ее при надобности."""
+        room = self.rooms.get(room_name)
+        if room is None:
+            room = self.rooms[room_name] = self.create_room(room_name)
+        room.add(user)
+        user.room = room
+        if self.bus:
+            self.bus.publish(BusMessage.JOIN, room_name, user.username.encode('utf-8'))
+
+    def leave_room(self, user: User):
+        """Убирает пользователя из его комнаты. Пустые комнаты удаляются."""
+        room = user.room
+        room.pop(user.client_socket)
+        user.room = None
+        if not room and room.name != self.settings.default_room:
+            del self.rooms[room.name]
+        if self.bus:
+            self.bus.publish(BusMessage.LEAVE, room.name, user.username.encode('utf-8'))
+
+    def create_room(self, room_name: str) -> Room:
+        """
+        Создает комнату с историей по настройкам сервера. Если
+        включен журнал сообщений, история берется из него.
+        """
+        room = Room(room_name, self.settings.history_messages, self.settings.history_bytes)
+        if self.message_log:
+            for record in self.message_log.read_last(self.settings.history_messages, room_name):
+                room.history.append(record.payload)
+        return room
+
+    def send_history(self, user: User):
+        """
+        Присылает пользователю последние сообщения его комнаты
+        одной пачкой. Сообщения не кодируются и не копируются
+        заново: в очередь попадают те же буферы.
+        """
+        history = user.room.history.get_last(self.settings.history_replay)
+        if not history:
+            return
+        if user.binary:
+            history = [self.compress_for(user, encode_frame(FrameType.TEXT, payload)) for payload in history]
+        self.send_many(user.client_socket, history)
+
+    def send_presence(self, user: User):
+        """
+        Присылает клиенту в двоичном режиме кадры `PRESENCE` обо
+        всех в его комнате, чтобы он знал имена по номерам.
+        Пользователи других воркеров приходят с номером 0.
+        """
+        frames = [
+            self.compress_for(user, self.get_presence_frame(member, PresenceEvent.JOIN))
+            for member in user.room.values()
+        ]
+        remote_presence = self.remote_rooms.get(user.room.name)
+        if remote_presence:
+            frames.extend(
+                self.compress_for(user, encode_presence(PresenceEvent.JOIN, 0, name))
+                for name in remote_presence
+            )
+        self.send_many(user.client_socket, frames)
+
+    def attach_bus(self, bus: Bus):
+        """
+        Подключает чат к шине воркеров: рассылки и списки
+        пользователей комнат становятся общими для всех процессов.
+        """
+        self.bus = bus
+        self.register_for_reading(bus.socket, self.bus_received)
+        bus.publish(BusMessage.HELLO)
+
+    def bus_received(self):
+        """Обрабатывает сообщения от других воркеров."""
+        for kind, worker_id, room_name, payload in self.bus.receive():
+            if kind is BusMessage.CHAT:
+                self.deliver(payload, room_name, remember=True)
+            elif kind is BusMessage.NOTICE:
+                self.deliver(payload, room_name)
+            elif kind is BusMessage.DIRECT:
+                recipient = self.registered_users.by_name.get(room_name)
+                if recipient is not None:
+                    self.send_to(recipient, str(payload, 'utf-8'))
+            elif kind is BusMessage.JOIN:
+                name = str(payload, 'utf-8')
+                self.remote_users[name] = worker_id
+                self.remote_rooms.setdefault(room_name, Presence()).add(name)
+            elif kind is BusMessage.LEAVE:
+                name = str(payload, 'utf-8')
+                self.remote_users.pop(name, None)
+                presence = self.remote_rooms.get(room_name)
+                if presence is not None:
+                    presence.discard(name)
+                    if not presence:
+                        del self.remote_rooms[room_name]
+            elif kind is BusMessage.HELLO:
+                for user in self.registered_users.values():
+                    self.bus.send(worker_id, BusMessage.JOIN, user.room.name, user.username.encode('utf-8'))
+
+    def get_handoff_state(self) -> dict:
+        """
+        Возвращает историю комнат и следующий номер пользователя.
+        Журнал сообщений дописывается на диск: дальше его ведет
+        новый процесс.
+        """
+        if self.message_log:
+            self.message_log.flush()
+        rooms = {}
+        for name, room in self.rooms.items():
+            history = room.history.get_last(len(room.history))
+            rooms[name] = [base64.b64encode(payload).decode('ascii') for payload in history]
+        return {'next_user_id': next(User.id_generator), 'rooms': rooms}
+
+    def get_connection_state(self, connection: Connection) -> dict:
+        """Добавляет к состоянию соединения пользователя и его комнату."""
+        state = super().get_connection_state(connection)
+        user = self.registered_users[connection.client_socket]
+        state.update(
+            user_id=user.user_id, username=user.username, room=user.room.name,
+            binary=user.binary, compressed=user.compressed,
+        )
+        return state
+
+    def forget_connection(self, client_socket: socket.socket):
+        """Убирает пользователя переданного соединения, никого не уведомляя."""
+        user = self.registered_users.pop(client_socket, None)
+        if user is not None:
+            user.room.pop(client_socket)
+        super().forget_connection(client_socket)
+
+    def restore_state(self, state: dict):
+        """
+        Продолжает нумерацию пользователей старого процесса и
+        восстанавливает историю комнат, если ее не загрузил журнал.
+        """
+        User.id_generator = itertools.count(state['next_user_id'])
+        if self.message_log:
+            return
+        for name, history in state['rooms'].items():
+            room = self.rooms.get(name)
+            if room is None:
+                room = self.rooms[name] = self.create_room(name)
+            for payload in history:
+                room.history.append(base64.b64decode(payload))
+
+    def restore_connection(self, connection: Connection, state: dict):
+        """Возвращает пользователя с прежними именем и номером в его комнату."""
+        user = User(connection.client_socket, state['username'], state['user_id'])
+        user.binary = state['binary']
+        user.compressed = state['compressed']
+        if user.binary:
+            connection.reader = FrameReader(self.settings.max_line_length)
+        self.registered_users[connection.client_socket] = user
+        self.join_room(user, state['room'])
+        super().restore_connection(connection, state)
+
+    def start_draining(self):
+        """
+        Закрывает журнал сообщений и предупреждает клиентов,
+        которые не были переданы новому процессу.
+        """
+        if self.message_log:
+            self.message_log.close()
+            self.message_log = None
+        for user in self.registered_users.values():
+            self.send_notice(user, "Server is restarting, please reconnect.")
+        super().start_draining()
 
     def get_handler_args(self, client_socket: socket.socket) -> list:
         """Возвращает список с объектом `User`."""
         if client_socket not in self.registered_users:
-            self.registered_users[client_socket] = User(client_socket)
+            user = self.registered_users[client_socket] = User(client_socket)
+            self.join_room(user, self.settings.default_room)
         return [self.registered_users[client_socket]]
 
-    def send_to_users_except(self, user: User, message: str):
+    def send_to_users_except(self, user: User, message: str, frame: bytes = None):
+        """
+        Отправляет всем пользователям комнаты `user` сообщение за
+        исключением самого `user`. Сообщение кодируется один раз,
+        и все очереди получателей ссылаются на один и тот же буфер.
+        Клиенты в двоичном режиме получают кадр `frame`.
+        """
+        self.broadcast(memoryview(self.format_message_before_send(message)), user.room.name, user, frame=frame)
+
+    def broadcast(self, payload: memoryview, room_name: str, exclude: User | list[User] = None,
+                  remember: bool = False, sender: str = '', frame: bytes | Callable[[], bytes] = None):
+        """
+        Отправляет готовое сообщение всем пользователям комнаты,
+        кроме `exclude` (одного или списка), в том числе
+        подключенным к другим воркерам.
+        С `remember` сообщение попадает в историю комнаты.
         """
-        Отправляет всем пользователям сообщение за исключением
-        `user`.
+        self.deliver(payload, room_name, exclude, remember, sender, frame)
+        if self.bus:
+            self.bus.publish(BusMessage.CHAT if remember else BusMessage.NOTICE, room_name, payload)
+
+    def deliver(self, payload: memoryview, room_name: str, exclude: User | list[User] = None,
+                remember: bool = False, sender: str = '', frame: bytes | Callable[[], bytes] = None):
         """
-        for user_socket in self.registered_users:
-            if user_socket != user.client_socket:
-                user_socket.send(self.format_message_before_send(message))
+        Отправляет готовое сообщение пользователям комнаты на этом
+        воркере. С `remember` сообщение попадает в историю комнаты
+        и в журнал сообщений.
+
+        Клиенты в двоичном режиме получают кадр `frame` или, если
+        его нет, строку в кадре `TEXT`. Вместо кадра можно передать
+        функцию, которая его соберет. Кадр собирается и сжимается
+        один раз на всю рассылку и только если в комнате есть
+        клиенты в двоичном режиме.
+        """
+        if remember and self.message_log:
+            self.message_log.append(room_name, sender, payload)
+        room = self.rooms.get(room_name)
+        if room is None:
+            return
+        if remember:
+            room.history.append(payload)
+        if isinstance(exclude, list):
+            excluded = {user.client_socket for user in exclude if user.client_socket in room}
+        else:
+            excluded = {exclude.client_socket} if exclude and exclude.client_socket in room else set()
+        self.metrics.messages_broadcast.inc()
+        self.metrics.fanout.observe(len(room) - len(excluded))
+        compressed_frame = None
+        for user_socket, user in room.items():
+            if user_socket in excluded:
+                continue
+            if not user.binary:
+                self.send(user_socket, payload)
+                continue
+            if frame is None:
+                frame = encode_frame(FrameType.TEXT, payload)
+            elif callable(frame):
+                frame = frame()
+            if user.compressed:
+                if compressed_frame is None:
+                    compressed_frame = self.deflater.compress(frame)
+                self.send(user_socket, compressed_frame)
+            else:
+                self.send(user_socket, frame)
 
     def send_to(self, user: User, message: str):
         """Отправляет сообщение только одному пользователю `user`."""
-        user.client_socket.send(self.format_message_before_send(message))
-
-    def get_users_in_chat_message(self, to_exclude: list = None) -> str:
-        """Возвращает специальное сообщение о пользователях в чате."""
-        users_list = self.users_in_chat
-        if to_exclude:
-            users_list = [user for user in users_list if user not in to_exclude]
-        users_in_chat = users_list
+        if user.binary:
+            self.send_frame(user, encode_text(FrameType.SYSTEM, message.rstrip('\n')))
+        else:
+            self.send(user.client_socket, self.format_message_before_send(message))
+
+    def send_notice(self, user: User, message: str):
+        """
+        Отправляет пользователю сообщение сервера: в текстовом
+        режиме с оформлением `get_server_mark`, в двоичном - кадром
+        `SYSTEM` без него.
+        """
+        if user.binary:
+            self.send_frame(user, encode_text(FrameType.SYSTEM, message))
+        else:
+            self.send_to(user, self.get_server_mark(message))
+
+    def send_frame(self, user: User, frame: bytes):
+        """Отправляет кадр пользователю в двоичном режиме."""
+        self.send(user.client_socket, self.compress_for(user, frame))
+
+    def compress_for(self, user: User, frame: bytes) -> bytes:
+        """Сжимает кадр, если пользователь включил сжатие."""
+        return self.deflater.compress(frame) if user.compressed else frame
+
+    def send_heartbeat(self, connection: Connection):
+        """Отправляет `/ping` клиенту, в двоичном режиме - кадром `PING`."""
+        user = self.registered_users.get(connection.client_socket)
+        if user is not None and user.binary:
+            self.send_frame(user, encode_frame(FrameType.PING))
+        else:
+            super().send_heartbeat(connection)
+
+    @staticmethod
+    def get_presence_frame(user: User, event: PresenceEvent) -> bytes:
+        """Возвращает кадр `PRESENCE` о пользователе."""
+        return encode_presence(event, user.user_id, user.username)
+
+    def get_users_in_chat_message(self, exclude: User = None, room_name: str = None) -> str:
+        """
+        Возвращает специальное сообщение о пользователях в
+        комнате без пользователя `exclude`. По умолчанию берется
+        комната `exclude` или комната по умолчанию.
+        """
+        if room_name is None:
+            room_name = exclude.room.name if exclude else self.settings.default_room
+        room = self.rooms.get(room_name)
+        remote_presence = self.remote_rooms.get(room_name)
+        local_names = room.presence.get_text(exclude.username if exclude else None) if room else ''
+        remote_names = remote_presence.get_text() if remote_presence else ''
+        users_in_chat = ", ".join(filter(None, (local_names, remote_names)))
         if users_in_chat:
-            return ", ".join(map(str, users_in_chat)) + " are in the chat."
+            return users_in_chat + " are in the chat."
         else:
             return "None is here."
 
@@ -172,16 +1380,7 @@ class Chat(Server):
     @property
     def users_in_chat(self) -> list[User]:
         """Возвращает список всех пользователей чата."""
-        return [user for user in self.registered_users.values()]
-
-    @staticmethod
-    def get_user_request(user: User) -> str:
-        """
-        Читает сообщение отправленное пользователем,
-        и возвращает его в виде строки.
-        """
-        request = user.client_socket.recv(4096)
-        return request.decode('utf-8')
+        return list(self.registered_users.values())
 
     @staticmethod
     def format_message(user: User, message: str) -> str:
@@ -189,11 +1388,63 @@ class Chat(Server):
         formatted_message = "[%s] %s" % (user.formatted_user_addr, message)
         return formatted_message
 
+    @staticmethod
+    def encode_message(user: User, message: str) -> bytes:
+        """
+        Возвращает сообщение пользователя в том виде, в котором
+        его получат остальные: то же, что `format_message` и
+        `format_message_before_send`, но с заранее закодированным
+        префиксом пользователя.
+        """
+        return user.prefix + message.encode('utf-8') + b'\n'
+
     @staticmethod
     def get_server_mark(message: str):
         """Помечает сообщение, как отправленное сервером."""
         return "=== Server ===\n" + message + "\n==============\n"
 
-    def __init__(self, host: str, port: int):
-        super().__init__(host, port)
-        self.registered_users: dict[socket.socket, User] = {}
+    def close(self):
+        """Закрывает соединения и дописывает журнал сообщений."""
+        super().close()
+        if self.message_log:
+            self.message_log.close()
+        if self.pipeline is not None:
+            self.pipeline.close()
+
+    def __init__(self, host: str, port: int, settings: ServerSettings = None, handoff: Handoff = None):
+        super().__init__(host, port, settings, handoff)
+        self.message_log: MessageLog | None = None
+        if self.settings.log_directory:
+            self.message_log = MessageLog(
+                self.settings.log_directory, self.settings.log_segment_bytes, self.settings.log_fsync_interval,
+                room_records=self.settings.history_messages,
+            )
+        self.registered_users = UserRegistry()
+        self.rooms: dict[str, Room] = {self.settings.default_room: self.create_room(self.settings.default_room)}
+        self.commands: dict[str, Callable[[User, str], None]] = {
+            'msg': self.msg_command,
+            'join': self.join_command,
+            'leave': self.leave_command,
+            'rooms': self.rooms_command,
+            'ping': self.ping_command,
+            'pong': self.pong_command,
+            'binary': self.binary_command,
+        }
+        self.bus: Bus | None = None
+        # Общий для всех соединений со сжатием: кадры сжимаются
+        # независимо друг от друга.
+        self.deflater = Deflater()
+        # Стадии обработки сообщений перед рассылкой.
+        self.pipeline: Pipeline | None = None
+        if self.settings.middleware:
+            self.pipeline = Pipeline(
+                [load_stage(path) for path in self.settings.middleware], self.metrics,
+                self.settings.middleware_threads, self.settings.middleware_processes,
+            )
+            self.register_for_reading(self.pipeline.wakeup_socket, self.pipeline.results_ready)
+        # Подключения, о которых комната еще не уведомлена.
+        self.joined: dict[socket.socket, User] = {}
+        # Пользователи других воркеров: имя -> номер воркера.
+        self.remote_users: dict[str, int] = {}
+        # Пользователи других воркеров по комнатам.
+        self.remote_rooms: dict[str, Presence] = {}
@@ -0,0 +1,116 @@
+import json
+import os
+import socket
+import struct
+
+# Длина тела сообщения. Дескрипторы приходят вместе с ним.
+MESSAGE_HEADER = struct.Struct('!I')
+# Сколько дескрипторов передается одним сообщением: ядро Linux
+# принимает не больше 253 (`SCM_MAX_FD`).
+MAX_FDS = 250
+# Ответ нового процесса: все получено, старый может уходить.
+ACKNOWLEDGEMENT = b'\x01'
+
+
+class Handoff:
+    """
+    Что новый процесс получил от старого при горячем
+    перезапуске: слушающие сокеты, состояние сервера и сокеты
+    клиентов с состоянием каждого соединения.
+    """
+
+    def __init__(self, server_socket: socket.socket, metrics_socket: socket.socket | None,
+                 state: dict, clients: list[tuple[socket.socket, dict]]):
+        self.server_socket = server_socket
+        self.metrics_socket = metrics_socket
+        self.state = state
+        self.clients = clients
+
+
+def send_message(channel: socket.socket, data, sockets: list[socket.socket]):
+    """
+    Отправляет сообщение в JSON и передает дескрипторы `sockets`
+    через `SCM_RIGHTS`.
+    """
+    body = json.dumps(data).encode('utf-8')
+    socket.send_fds(channel, [MESSAGE_HEADER.pack(len(body))], [sock.fileno() for sock in sockets])
+    channel.sendall(body)
+
+
+def receive_message(channel: socket.socket) -> tuple:
+    """Принимает сообщение от `send_message` и возвращает данные и сокеты."""
+    header, fds, _, _ = socket.recv_fds(channel, MESSAGE_HEADER.size, MAX_FDS)
+    sockets = [socket.socket(fileno=fd) for fd in fds]
+    if len(header) != MESSAGE_HEADER.size:
+        raise ConnectionError("Старый процесс прервал передачу.")
+    (length,) = MESSAGE_HEADER.unpack(header)
+    body = bytearray()
+    while len(body) < length:
+        chunk = channel.recv(length - len(body))
+        if not chunk:
+            raise ConnectionError("Старый процесс прервал передачу.")
+        body += chunk
+    return json.loads(body), sockets
+
+
+def send_handoff(channel: socket.socket, server_socket: socket.socket, metrics_socket: socket.socket | None,
+                 state: dict, clients: list[tuple[socket.socket, dict]]):
+    """
+    Передает новому процессу слушающие сокеты, состояние сервера
+    и клиентов пачками по `MAX_FDS`. Возвращается, когда новый
+    процесс подтвердил, что принял все. Если он не ответил,
+    бросает `OSError`, и старый процесс продолжает работу.
+    """
+    sockets = [server_socket] if metrics_socket is None else [server_socket, metrics_socket]
+    send_message(channel, {'state': state, 'clients': len(clients)}, sockets)
+    for start in range(0, len(clients), MAX_FDS):
+        batch = clients[start:start + MAX_FDS]
+        send_message(channel, [record for _, record in batch], [client_socket for client_socket, _ in batch])
+    if channel.recv(1) != ACKNOWLEDGEMENT:
+        raise ConnectionError("Новый процесс не подтвердил передачу.")
+
+
+def receive_handoff(path: str) -> Handoff | None:
+    """
+    Подключается к работающему серверу через `path` и забирает
+    у него сокеты. Возвращает `None`, если сервера там нет.
+    """
+    channel = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        channel.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        channel.close()
+        return None
+    with channel:
+        data, sockets = receive_message(channel)
+        clients = []
+        try:
+            while len(clients) < data['clients']:
+                records, client_sockets = receive_message(channel)
+                if len(records) != len(client_sockets):
+                    raise ConnectionError("Часть дескрипторов не передана, проверьте лимит открытых файлов.")
+                clients.extend(zip(client_sockets, records))
+        except BaseException:
+            for sock in sockets:
+                sock.close()
+            for client_socket, _ in clients:
+                client_socket.close()
+            raise
+        channel.sendall(ACKNOWLEDGEMENT)
+    return Handoff(sockets[0], sockets[1] if len(sockets) > 1 else None, data['state'], clients)
+
+
+def get_handoff_socket(path: str) -> socket.socket:
+    """
+    Возвращает Unix-сокет, через который следующий процесс
+    заберет сокеты этого. Старый файл сокета удаляется.
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen()
+    sock.setblocking(False)
+    return sock
@@ -0,0 +1,43 @@
+class MessageHistory:
+    """
+    Кольцевой буфер последних сообщений комнаты. Хранит уже
+    закодированные сообщения и ограничен как количеством
+    сообщений, так и их общим размером: при переполнении
+    вытесняются самые старые.
+    """
+
+    def append(self, payload: bytes | memoryview):
+        """Добавляет сообщение в историю."""
+        size = len(payload)
+        if size > self.max_bytes or not self.slots:
+            return
+        while self.count == len(self.slots) or self.size + size > self.max_bytes:
+            self._evict()
+        self.slots[(self.start + self.count) % len(self.slots)] = payload
+        self.count += 1
+        self.size += size
+
+    def get_last(self, count: int) -> list[bytes | memoryview]:
+        """Возвращает до `count` последних сообщений от старых к новым."""
+        count = min(count, self.count)
+        capacity = len(self.slots)
+        first = self.start + self.count - count
+        return [self.slots[index % capacity] for index in range(first, first + count)]
+
+    def _evict(self):
+        """Вытесняет самое старое сообщение."""
+        payload = self.slots[self.start]
+        self.slots[self.start] = None
+        self.start = (self.start + 1) % len(self.slots)
+        self.count -= 1
+        self.size -= len(payload)
+
+    def __len__(self):
+        return self.count
+
+    def __init__(self, max_messages: int, max_bytes: int):
+        self.slots: list[bytes | memoryview | None] = [None] * max_messages
+        self.max_bytes = max_bytes
+        self.start = 0
+        self.count = 0
+        self.size = 0
@@ -1,10 +1,158 @@
+import argparse
+import functools
+import signal
+
+from server.aio import AsyncChat
+from server.buffers import SlowConsumerPolicy
+from server.cluster import run_workers
 from server.handlers import Chat
+from server.handoff import receive_handoff
+from server.middleware import StageMode, load_stage
+from server.ratelimit import RateLimitAction
+from server.settings import ServerSettings
+
+
+def get_arguments() -> argparse.Namespace:
+    """Разбирает аргументы командной строки."""
+    defaults = ServerSettings()
+    parser = argparse.ArgumentParser(description="Чат-сервер на сокетах.")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--engine', choices=['selectors', 'asyncio'], default='selectors')
+    parser.add_argument('--uvloop', action='store_true', help="Цикл событий uvloop для asyncio.")
+    parser.add_argument('--workers', type=int, default=1, help="Количество процессов-воркеров.")
+    parser.add_argument('--listen-backlog', type=int, default=defaults.listen_backlog)
+    parser.add_argument('--accept-batch', type=int, default=defaults.accept_batch)
+    parser.add_argument('--max-connections', type=int, help="По умолчанию - по пределу открытых файлов.")
+    parser.add_argument('--high-watermark', type=int, default=defaults.high_watermark)
+    parser.add_argument('--low-watermark', type=int, default=defaults.low_watermark)
+    parser.add_argument('--max-buffer-size', type=int, default=defaults.max_buffer_size)
+    parser.add_argument(
+        '--slow-consumer-policy',
+        choices=[policy.value for policy in SlowConsumerPolicy],
+        default=defaults.slow_consumer_policy.value,
+    )
+    parser.add_argument('--max-line-length', type=int, default=defaults.max_line_length)
+    parser.add_argument('--history-messages', type=int, default=defaults.history_messages)
+    parser.add_argument('--history-bytes', type=int, default=defaults.history_bytes)
+    parser.add_argument('--history-replay', type=int, default=defaults.history_replay)
+    parser.add_argument('--log-directory', help="Каталог журнала сообщений.")
+    parser.add_argument('--log-fsync-interval', type=float, default=defaults.log_fsync_interval)
+    parser.add_argument('--message-rate', type=float, help="Сообщений в секунду от одного клиента.")
+    parser.add_argument('--message-burst', type=int, default=defaults.message_burst)
+    parser.add_argument('--byte-rate', type=float, help="Байт в секунду от одного клиента.")
+    parser.add_argument('--byte-burst', type=int, default=defaults.byte_burst)
+    parser.add_argument('--address-message-rate', type=float, help="Сообщений в секунду с одного IP-адреса.")
+    parser.add_argument('--address-message-burst', type=int, default=defaults.address_message_burst)
+    parser.add_argument('--address-byte-rate', type=float, help="Байт в секунду с одного IP-адреса.")
+    parser.add_argument('--address-byte-burst', type=int, default=defaults.address_byte_burst)
+    parser.add_argument(
+        '--rate-limit-action',
+        choices=[action.value for action in RateLimitAction],
+        default=defaults.rate_limit_action.value,
+    )
+    parser.add_argument('--idle-timeout', type=float, help="Отключать клиента после стольких секунд простоя.")
+    parser.add_argument('--heartbeat-interval', type=float, help="Слать /ping после стольких секунд простоя.")
+    parser.add_argument('--tcp-keepalive', action='store_true')
+    parser.add_argument('--keepalive-idle', type=int, default=defaults.keepalive_idle)
+    parser.add_argument('--keepalive-interval', type=int, default=defaults.keepalive_interval)
+    parser.add_argument('--keepalive-count', type=int, default=defaults.keepalive_count)
+    parser.add_argument('--metrics-host', default=defaults.metrics_host)
+    parser.add_argument('--metrics-port', type=int, help="Порт метрик в формате Prometheus.")
+    parser.add_argument('--batch-dispatch', action='store_true', help="Рассылать накопленное раз за итерацию.")
+    parser.add_argument('--batch-max-lines', type=int, default=defaults.batch_max_lines)
+    parser.add_argument(
+        '--handoff-path',
+        help="Unix-сокет горячего перезапуска: новый процесс забирает сокеты у запущенного с тем же путем.",
+    )
+    parser.add_argument('--handoff-clients', action='store_true', help="Передавать и соединения клиентов.")
+    parser.add_argument('--drain-timeout', type=float, default=defaults.drain_timeout)
+    parser.add_argument(
+        '--middleware', action='append', default=[],
+        help="Стадия обработки сообщений `модуль:функция`. Можно указать несколько, по порядку.",
+    )
+    parser.add_argument('--middleware-threads', type=int, default=defaults.middleware_threads)
+    parser.add_argument('--middleware-processes', type=int, help="По умолчанию - по числу ядер.")
+    arguments = parser.parse_args()
+    if arguments.handoff_path and arguments.workers > 1:
+        parser.error("--handoff-path работает только с одним процессом.")
+    if arguments.handoff_clients and arguments.engine == 'asyncio':
+        parser.error("--handoff-clients поддерживается только движком selectors.")
+    if arguments.workers > 1 and any(
+        getattr(load_stage(path), 'stage_mode', None) is StageMode.PROCESS for path in arguments.middleware
+    ):
+        parser.error("Стадии в пуле процессов не работают с --workers: воркеры не могут заводить свои процессы.")
+    return arguments
+
+
+def get_settings(arguments: argparse.Namespace) -> ServerSettings:
+    """Собирает настройки сервера из аргументов командной строки."""
+    return ServerSettings(
+        listen_backlog=arguments.listen_backlog,
+        accept_batch=arguments.accept_batch,
+        max_connections=arguments.max_connections,
+        high_watermark=arguments.high_watermark,
+        low_watermark=arguments.low_watermark,
+        max_buffer_size=arguments.max_buffer_size,
+        slow_consumer_policy=SlowConsumerPolicy(arguments.slow_consumer_policy),
+        max_line_length=arguments.max_line_length,
+        history_messages=arguments.history_messages,
+        history_bytes=arguments.history_bytes,
+        history_replay=arguments.history_replay,
+        log_directory=arguments.log_directory,
+        log_fsync_interval=arguments.log_fsync_interval,
+        message_rate=arguments.message_rate,
+        message_burst=arguments.message_burst,
+        byte_rate=arguments.byte_rate,
+        byte_burst=arguments.byte_burst,
+        address_message_rate=arguments.address_message_rate,
+        address_message_burst=arguments.address_message_burst,
+        address_byte_rate=arguments.address_byte_rate,
+        address_byte_burst=arguments.address_byte_burst,
+        rate_limit_action=RateLimitAction(arguments.rate_limit_action),
+        idle_timeout=arguments.idle_timeout,
+        heartbeat_interval=arguments.heartbeat_interval,
+        tcp_keepalive=arguments.tcp_keepalive,
+        keepalive_idle=arguments.keepalive_idle,
+        keepalive_interval=arguments.keepalive_interval,
+        keepalive_count=arguments.keepalive_count,
+        metrics_host=arguments.metrics_host,
+        metrics_port=arguments.metrics_port,
+        batch_dispatch=arguments.batch_dispatch,
+        batch_max_lines=arguments.batch_max_lines,
+        handoff_path=arguments.handoff_path,
+        handoff_clients=arguments.handoff_clients,
+        drain_timeout=arguments.drain_timeout,
+        middleware=tuple(arguments.middleware),
+        middleware_threads=arguments.middleware_threads,
+        middleware_processes=arguments.middleware_processes,
+    )
 
 
 def main():
     """Запускает сервер."""
-    server = Chat('localhost', 5555)
-    server.start_listening()
+    arguments = get_arguments()
+    settings = get_settings(arguments)
+    if arguments.engine == 'asyncio':
+        server_class = functools.partial(AsyncChat, use_uvloop=arguments.uvloop)
+    else:
+        server_class = Chat
+    if arguments.workers > 1:
+        run_workers(server_class, arguments.host, arguments.port, settings, arguments.workers)
+    else:
+        handoff = receive_handoff(settings.handoff_path) if settings.handoff_path else None
+        server = server_class(arguments.host, arguments.port, settings, handoff=handoff)
+        if handoff is not None:
+            server.restore_handoff(handoff)
+        # По `SIGTERM` сервер закрывается так же, как по Ctrl+C:
+        # останавливаются и пулы стадий обработки сообщений.
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            server.start_listening()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
 
 
 if __name__ == '__main__':
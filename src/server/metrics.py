@@ -0,0 +1,180 @@
+import bisect
+from typing import Callable
+
+# Границы корзин гистограмм длительности в секундах: от 10
+# микросекунд до секунды.
+DURATION_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+)
+# Границы корзин количества получателей одной рассылки.
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Counter:
+    """Счетчик, который только растет."""
+
+    __slots__ = ('name', 'description', 'value')
+
+    kind = 'counter'
+
+    def inc(self, amount: int | float = 1):
+        """Увеличивает счетчик на `amount`."""
+        self.value += amount
+
+    def render(self) -> list[str]:
+        """Возвращает строки значения в текстовом формате Prometheus."""
+        return ['%s %s' % (self.name, self.value)]
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.value = 0
+
+
+class Gauge:
+    """
+    Текущее значение, которое вычисляет `function` в момент
+    запроса метрик, поэтому на горячем пути ничего не стоит.
+    """
+
+    __slots__ = ('name', 'description', 'function')
+
+    kind = 'gauge'
+
+    def render(self) -> list[str]:
+        """Возвращает строки значения в текстовом формате Prometheus."""
+        return ['%s %s' % (self.name, self.function())]
+
+    def __init__(self, name: str, description: str, function: Callable[[], int | float]):
+        self.name = name
+        self.description = description
+        self.function = function
+
+
+class Histogram:
+    """
+    Гистограмма с заранее заданными корзинами. Список счетчиков
+    выделяется один раз, а запись значения - это двоичный поиск
+    корзины и три сложения.
+    """
+
+    __slots__ = ('name', 'description', 'bounds', 'counts', 'sum', 'count')
+
+    kind = 'histogram'
+
+    def observe(self, value: int | float):
+        """Записывает значение."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self) -> list[str]:
+        """
+        Возвращает строки значения в текстовом формате Prometheus.
+        Корзины там накопительные, а здесь хранятся раздельно.
+        """
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append('%s_bucket{le="%s"} %d' % (self.name, bound, cumulative))
+        lines.append('%s_bucket{le="+Inf"} %d' % (self.name, self.count))
+        lines.append('%s_sum %s' % (self.name, self.sum))
+        lines.append('%s_count %d' % (self.name, self.count))
+        return lines
+
+    def __init__(self, name: str, description: str, bounds: tuple[float, ...]):
+        self.name = name
+        self.description = description
+        self.bounds = bounds
+        # Последняя корзина - для значений больше всех границ.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+
+class Metrics:
+    """Набор метрик, который отдается в текстовом формате Prometheus."""
+
+    def counter(self, name: str, description: str) -> Counter:
+        """Создает и регистрирует счетчик."""
+        return self.register(Counter(name, description))
+
+    def gauge(self, name: str, description: str, function: Callable[[], int | float]) -> Gauge:
+        """Создает и регистрирует вычисляемое значение."""
+        return self.register(Gauge(name, description, function))
+
+    def histogram(self, name: str, description: str, bounds: tuple[float, ...]) -> Histogram:
+        """Создает и регистрирует гистограмму."""
+        return self.register(Histogram(name, description, bounds))
+
+    def register(self, metric):
+        """Добавляет метрику в набор."""
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> bytes:
+        """Возвращает все метрики в текстовом формате Prometheus."""
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.description))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            lines.extend(metric.render())
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+    def __init__(self):
+        self.metrics: list[Counter | Gauge | Histogram] = []
+
+
+class ServerMetrics(Metrics):
+    """Метрики сервера, которые пишутся на горячем пути."""
+
+    def __init__(self, server):
+        super().__init__()
+        self.connections_accepted = self.counter(
+            'chat_connections_accepted_total', "Accepted client connections.",
+        )
+        self.connections_rejected = self.counter(
+            'chat_connections_rejected_total', "Connections rejected over the connection limit.",
+        )
+        self.connections_closed = self.counter(
+            'chat_connections_closed_total', "Closed client connections.",
+        )
+        self.bytes_received = self.counter('chat_bytes_received_total', "Bytes read from clients.")
+        self.bytes_sent = self.counter('chat_bytes_sent_total', "Bytes written to clients.")
+        self.messages_broadcast = self.counter(
+            'chat_messages_broadcast_total', "Messages delivered to a room on this worker.",
+        )
+        self.messages_dropped = self.counter(
+            'chat_messages_dropped_total', "Messages dropped from the queues of slow consumers.",
+        )
+        self.rate_limited = self.counter(
+            'chat_rate_limited_total', "Lines that exceeded a rate limit.",
+        )
+        self.fanout = self.histogram(
+            'chat_broadcast_fanout', "Recipients of a single broadcast.", FANOUT_BUCKETS,
+        )
+        self.loop_iteration = self.histogram(
+            'chat_loop_iteration_seconds',
+            "Time spent handling the events of one select() call (selectors engine).", DURATION_BUCKETS,
+        )
+        self.batch_lines = self.histogram(
+            'chat_batch_lines', "Lines handled in one batch (batch dispatch mode).", FANOUT_BUCKETS,
+        )
+        self.handler_duration = self.histogram(
+            'chat_handler_seconds', "Time spent in a single handler call.", DURATION_BUCKETS,
+        )
+        self.gauge('chat_connections', "Open client connections.", lambda: len(server.connections))
+        self.gauge(
+            'chat_write_queue_bytes', "Bytes waiting in the write queues of all connections.",
+            lambda: sum(connection.write_queue.size for connection in server.connections.values()),
+        )
+        self.gauge(
+            'chat_write_queue_messages', "Messages waiting in the write queues of all connections.",
+            lambda: sum(len(connection.write_queue) for connection in server.connections.values()),
+        )
+        self.gauge(
+            'chat_write_queue_max_bytes', "Largest write queue of a single connection.",
+            lambda: max((connection.write_queue.size for connection in server.connections.values()), default=0),
+        )
@@ -0,0 +1,293 @@
+import collections
+import concurrent.futures
+import enum
+import importlib
+import multiprocessing
+import socket
+import time
+from typing import Callable, Hashable
+
+from server.metrics import DURATION_BUCKETS, Metrics
+
+
+class StageMode(enum.Enum):
+    """Где выполняется стадия обработки сообщений."""
+
+    # В цикле событий, сразу.
+    INLINE = 'inline'
+    # В пуле потоков: для функций, что ждут ввода-вывода или
+    # отпускают GIL.
+    THREAD = 'thread'
+    # В пуле процессов: для тяжелых вычислений на Python.
+    # Функция должна импортироваться по имени модуля.
+    PROCESS = 'process'
+
+
+def stage(mode: StageMode = StageMode.INLINE, cache_size: int = 0) -> Callable:
+    """
+    Декоратор стадии: функция принимает текст сообщения и
+    возвращает новый текст или `None`, если сообщение не нужно
+    отправлять. С `cache_size` последние результаты запоминаются
+    по тексту, и повторы не вычисляются заново. Функция остается
+    той же, поэтому годится и для пула процессов.
+    """
+    def mark(function: Callable[[str], str | None]) -> Callable[[str], str | None]:
+        function.stage_mode = mode
+        function.cache_size = cache_size
+        return function
+    return mark
+
+
+class LRUCache(collections.OrderedDict):
+    """Словарь, который помнит не больше `size` последних ключей."""
+
+    missing = object()
+
+    def get(self, key: Hashable, default=missing):
+        """Возвращает значение и отмечает ключ как недавний."""
+        if key not in self:
+            return default
+        self.move_to_end(key)
+        return self[key]
+
+    def put(self, key: Hashable, value):
+        """Запоминает значение, вытесняя самый давний ключ."""
+        self[key] = value
+        self.move_to_end(key)
+        if len(self) > self.size:
+            self.popitem(last=False)
+
+    def __init__(self, size: int):
+        super().__init__()
+        self.size = size
+
+
+class Stage:
+    """Стадия конвейера с кэшем, гистограммой времени выполнения и счетчиком ошибок."""
+
+    def __init__(self, function: Callable[[str], str | None], metrics: Metrics):
+        self.function = function
+        self.name = function.__name__
+        self.mode: StageMode = getattr(function, 'stage_mode', StageMode.INLINE)
+        cache_size = getattr(function, 'cache_size', 0)
+        self.cache = LRUCache(cache_size) if cache_size else None
+        # Для вынесенных стадий время считается вместе с ожиданием
+        # в очереди пула.
+        self.duration = metrics.histogram(
+            'chat_middleware_%s_seconds' % self.name,
+            "Time a message spends in the %s middleware stage." % self.name, DURATION_BUCKETS,
+        )
+        self.errors = metrics.counter(
+            'chat_middleware_%s_errors_total' % self.name,
+            "Messages dropped because the %s middleware stage failed." % self.name,
+        )
+
+
+class Job:
+    """Сообщение, которое проходит стадии конвейера."""
+
+    __slots__ = ('text', 'stage', 'transform', 'done', 'started')
+
+    def __init__(self, text: str, transform: bool, done: Callable[[str], None]):
+        self.text: str | None = text
+        # Номер следующей стадии.
+        self.stage = 0
+        # Команды проходят очередь отправителя, но не стадии.
+        self.transform = transform
+        self.done = done
+        self.started = 0.0
+
+
+class Pipeline:
+    """
+    Конвейер стадий между приемом сообщения и его рассылкой.
+    Вынесенные в пулы стадии не задерживают цикл событий: пулы
+    складывают результаты в `finished` и будят цикл байтом в
+    `wakeup_socket`, а продолжает обработку `results_ready`.
+
+    У каждого отправителя своя очередь, и в работе только первое
+    ее сообщение, поэтому сообщения одного отправителя выходят в
+    том порядке, в котором пришли. Сообщения разных отправителей
+    обрабатываются параллельно.
+    """
+
+    def submit(self, key: Hashable, text: str, done: Callable[[str], None], transform: bool = True):
+        """
+        Ставит сообщение отправителя `key` в конвейер. Когда все
+        стадии пройдены, вызывается `done` с итоговым текстом. Если
+        `transform` ложно, сообщение только ждет своей очереди.
+        """
+        queue = self.queues.get(key)
+        if queue is not None:
+            queue.append(Job(text, transform, done))
+            return
+        self.queues[key] = collections.deque([Job(text, transform, done)])
+        self.advance(key)
+
+    def forget(self, key: Hashable):
+        """Выбрасывает сообщения отправителя, например, отключившегося."""
+        queue = self.queues.pop(key, None)
+        if queue is not None:
+            queue.clear()
+
+    def advance(self, key: Hashable):
+        """Проводит сообщения отправителя по стадиям, пока не придется ждать пул."""
+        queue = self.queues.get(key)
+        while queue:
+            job = queue[0]
+            if not self.run(key, job):
+                return
+            queue.popleft()
+            if job.text is not None:
+                job.done(job.text)
+        if queue is not None and self.queues.get(key) is queue:
+            del self.queues[key]
+
+    def run(self, key: Hashable, job: Job) -> bool:
+        """
+        Выполняет стадии сообщения до первой, которую нужно ждать.
+        Возвращает `True`, если стадий больше не осталось.
+        """
+        while job.transform and job.text is not None and job.stage < len(self.stages):
+            current = self.stages[job.stage]
+            if current.cache is not None:
+                result = current.cache.get(job.text)
+                if result is not LRUCache.missing:
+                    self.cache_hits.inc()
+                    job.text = result
+                    job.stage += 1
+                    continue
+            if current.mode is StageMode.INLINE:
+                started = time.perf_counter()
+                try:
+                    result = current.function(job.text)
+                except Exception:
+                    current.errors.inc()
+                    result = None
+                else:
+                    self.remember(current, job.text, result)
+                current.duration.observe(time.perf_counter() - started)
+                job.text = result
+                job.stage += 1
+                continue
+            job.started = time.perf_counter()
+            try:
+                future = self.get_executor(current.mode).submit(current.function, job.text)
+            except Exception:
+                # Пул сломан, например, после падения процесса пула.
+                # Сообщение выбрасывается, а следующее получит новый пул.
+                self.discard_executor(current.mode)
+                current.errors.inc()
+                job.text = None
+                continue
+            future.add_done_callback(lambda future: self.completed(key, job, future))
+            return False
+        return True
+
+    def completed(self, key: Hashable, job: Job, future: concurrent.futures.Future):
+        """Вызывается в потоке пула: передает результат циклу событий."""
+        self.finished.append((key, job, future))
+        try:
+            self.wakeup_writer.send(b'\0')
+        except (BlockingIOError, OSError):
+            # Буфер полон - цикл и так разбудят.
+            pass
+
+    def results_ready(self):
+        """
+        Обработчик `wakeup_socket`: принимает результаты пулов и
+        продолжает сообщения, которые их ждали. Результаты
+        сообщений забытых отправителей выбрасываются.
+        """
+        try:
+            while self.wakeup_socket.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while self.finished:
+            key, job, future = self.finished.popleft()
+            current = self.stages[job.stage]
+            current.duration.observe(time.perf_counter() - job.started)
+            try:
+                result = future.result()
+            except BaseException:
+                current.errors.inc()
+                result = None
+            else:
+                self.remember(current, job.text, result)
+            job.text = result
+            job.stage += 1
+            queue = self.queues.get(key)
+            if queue and queue[0] is job:
+                self.advance(key)
+
+    @staticmethod
+    def remember(current: Stage, text: str, result: str | None):
+        """Запоминает результат стадии, если у нее есть кэш."""
+        if current.cache is not None:
+            current.cache.put(text, result)
+
+    def get_executor(self, mode: StageMode) -> concurrent.futures.Executor:
+        """Возвращает пул для стадии, создавая его при первом обращении."""
+        if mode is StageMode.THREAD:
+            if self.thread_pool is None:
+                self.thread_pool = concurrent.futures.ThreadPoolExecutor(self.threads, 'middleware')
+            return self.thread_pool
+        if self.process_pool is None:
+            # Процессы пула запускаются из чистого процесса
+            # `forkserver`, а не копией сервера: иначе они держали
+            # бы слушающий сокет и сокеты клиентов, в том числе
+            # после завершения сервера.
+            self.process_pool = concurrent.futures.ProcessPoolExecutor(
+                self.processes, mp_context=multiprocessing.get_context('forkserver'),
+            )
+        return self.process_pool
+
+    def discard_executor(self, mode: StageMode):
+        """Останавливает пул стадий `mode`, чтобы при следующем обращении создать новый."""
+        if mode is StageMode.THREAD:
+            pool, self.thread_pool = self.thread_pool, None
+        else:
+            pool, self.process_pool = self.process_pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        """Останавливает пулы, не дожидаясь сообщений в работе."""
+        for pool in (self.thread_pool, self.process_pool):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self.wakeup_socket.close()
+        self.wakeup_writer.close()
+
+    def __init__(self, stages: list[Callable[[str], str | None]], metrics: Metrics,
+                 threads: int = 4, processes: int = None):
+        # По имени стадии называются ее метрики, поэтому имена
+        # не должны повторяться.
+        names = collections.Counter(function.__name__ for function in stages)
+        repeated = [name for name, count in names.items() if count > 1]
+        if repeated:
+            raise ValueError("Имена стадий повторяются: %s" % ', '.join(repeated))
+        self.stages = [Stage(function, metrics) for function in stages]
+        self.threads = threads
+        self.processes = processes
+        self.thread_pool: concurrent.futures.ThreadPoolExecutor | None = None
+        self.process_pool: concurrent.futures.ProcessPoolExecutor | None = None
+        # Очереди сообщений по отправителям.
+        self.queues: dict[Hashable, collections.deque[Job]] = {}
+        # Результаты пулов, которые еще не забрал цикл событий.
+        self.finished: collections.deque[tuple[Hashable, Job, concurrent.futures.Future]] = collections.deque()
+        self.wakeup_socket, self.wakeup_writer = socket.socketpair()
+        self.wakeup_socket.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+        self.cache_hits = metrics.counter(
+            'chat_middleware_cache_hits_total', "Middleware stage results taken from the cache.",
+        )
+
+
+def load_stage(path: str) -> Callable[[str], str | None]:
+    """Возвращает функцию стадии по пути вида `модуль:функция`."""
+    module_name, _, function_name = path.partition(':')
+    if not function_name:
+        raise ValueError("Стадия задается как `модуль:функция`: %s" % path)
+    return getattr(importlib.import_module(module_name), function_name)
@@ -0,0 +1,211 @@
+import enum
+import socket
+import struct
+import zlib
+
+# Заголовок кадра: тип и длина тела. Старший бит типа означает,
+# что тело сжато.
+FRAME_HEADER = struct.Struct('!BI')
+COMPRESSED = 0x80
+# Начало тела кадра `CHAT` от сервера: номер отправителя.
+CHAT_HEADER = struct.Struct('!I')
+# Начало тела кадра `PRESENCE`: событие и номер пользователя.
+PRESENCE_HEADER = struct.Struct('!BI')
+# Тела короче этого не сжимаются: выигрыша почти нет.
+COMPRESS_THRESHOLD = 256
+
+
+class FrameType(enum.IntEnum):
+    """Типы кадров двоичного протокола."""
+
+    # Сообщение пользователя. От клиента - текст или команда, от
+    # сервера - номер отправителя и текст.
+    CHAT = 1
+    # Пользователь с номером и именем вошел в комнату или вышел.
+    PRESENCE = 2
+    # Сообщение сервера без оформления.
+    SYSTEM = 3
+    # Строка текстового протокола как есть, например сообщение
+    # с другого воркера или из истории.
+    TEXT = 4
+    PING = 5
+    PONG = 6
+
+
+class PresenceEvent(enum.IntEnum):
+    """События кадра `PRESENCE`."""
+
+    JOIN = 1
+    LEAVE = 2
+
+
+def encode_frame(kind: FrameType, *parts: bytes | memoryview) -> bytes:
+    """Собирает кадр из частей тела."""
+    length = sum(map(len, parts))
+    return b''.join((FRAME_HEADER.pack(kind, length), *parts))
+
+
+def encode_chat(sender_id: int, text: bytes | memoryview) -> bytes:
+    """Возвращает кадр `CHAT` от сервера."""
+    return encode_frame(FrameType.CHAT, CHAT_HEADER.pack(sender_id), text)
+
+
+def encode_presence(event: PresenceEvent, user_id: int, name: str) -> bytes:
+    """Возвращает кадр `PRESENCE`."""
+    return encode_frame(FrameType.PRESENCE, PRESENCE_HEADER.pack(event, user_id), name.encode('utf-8'))
+
+
+def encode_text(kind: FrameType, text: str) -> bytes:
+    """Возвращает кадр `SYSTEM` или `TEXT` с текстом `text`."""
+    return encode_frame(kind, text.encode('utf-8'))
+
+
+class Deflater:
+    """
+    Сжимает кадры в raw deflate. После каждого кадра делается
+    `Z_FULL_FLUSH`: словарь сбрасывается, и кадр распаковывается
+    независимо от предыдущих. Поэтому кадр рассылки сжимается один
+    раз на всех получателей, а выброшенный из очереди медленного
+    клиента кадр не ломает поток распаковки.
+    """
+
+    def compress(self, frames: bytes) -> bytes:
+        """
+        Возвращает сжатые кадры. `frames` может содержать несколько
+        кадров подряд: каждый сжимается отдельно, короткие остаются
+        как есть.
+        """
+        _, length = FRAME_HEADER.unpack_from(frames)
+        if FRAME_HEADER.size + length == len(frames):
+            return self.compress_frame(frames)
+        view = memoryview(frames)
+        parts = []
+        offset = 0
+        while offset < len(view):
+            _, length = FRAME_HEADER.unpack_from(view, offset)
+            end = offset + FRAME_HEADER.size + length
+            parts.append(self.compress_frame(view[offset:end]))
+            offset = end
+        return b''.join(parts)
+
+    def compress_frame(self, frame: bytes | memoryview) -> bytes:
+        """Возвращает сжатый кадр или тот же кадр, если он короткий."""
+        if len(frame) - FRAME_HEADER.size < COMPRESS_THRESHOLD:
+            return frame
+        kind, _ = FRAME_HEADER.unpack_from(frame)
+        body = self.compressor.compress(memoryview(frame)[FRAME_HEADER.size:])
+        body += self.compressor.flush(zlib.Z_FULL_FLUSH)
+        return FRAME_HEADER.pack(kind | COMPRESSED, len(body)) + body
+
+    def __init__(self, level: int = 6):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+
+class FrameDecoder:
+    """
+    Делит поток байт на кадры и распаковывает сжатые. Кадры, тело
+    которых длиннее `max_length` байт до или после распаковки,
+    пропускаются.
+    """
+
+    def feed(self, data: bytes | memoryview) -> list[tuple[int, bytes]]:
+        """Принимает данные и возвращает целые кадры `(тип, тело)`."""
+        self.data += data
+        frames = []
+        start = 0
+        while True:
+            if self.skip:
+                skipped = min(self.skip, len(self.data) - start)
+                self.skip -= skipped
+                start += skipped
+                if self.skip:
+                    break
+            if len(self.data) - start < FRAME_HEADER.size:
+                break
+            kind, length = FRAME_HEADER.unpack_from(self.data, start)
+            if length > self.max_length:
+                self.dropped_frames += 1
+                self.skip = length
+                start += FRAME_HEADER.size
+                continue
+            end = start + FRAME_HEADER.size + length
+            if end > len(self.data):
+                break
+            body = bytes(self.data[start + FRAME_HEADER.size:end])
+            start = end
+            if kind & COMPRESSED:
+                kind &= ~COMPRESSED
+                body = self._decompress(body)
+                if body is None:
+                    continue
+            frames.append((kind, body))
+        del self.data[:start]
+        return frames
+
+    def _decompress(self, body: bytes) -> bytes | None:
+        """Распаковывает тело кадра или возвращает `None`, если оно слишком длинное или испорчено."""
+        try:
+            data = self.decompressor.decompress(body, self.max_length + 1)
+        except zlib.error:
+            data = None
+        if data is None or len(data) > self.max_length or self.decompressor.unconsumed_tail:
+            # Кадры сжимаются независимо, так что после брошенного
+            # кадра достаточно начать распаковку заново.
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            self.dropped_frames += 1
+            return None
+        return data
+
+    def __init__(self, max_length: int = 64 * 1024):
+        self.max_length = max_length
+        self.data = bytearray()
+        self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        # Сколько байт пропускаемого кадра еще не пришло.
+        self.skip = 0
+        self.dropped_frames = 0
+
+
+class FrameReader:
+    """
+    Входной буфер соединения в двоичном режиме с тем же
+    интерфейсом, что и `LineReader`. Кадры клиента превращаются в
+    строки запросов: `CHAT` - в строки своего текста, `PING` и
+    `PONG` - в команды `/ping` и `/pong`. Текст делится на строки
+    так же, как в `LineReader`, иначе перевод строки внутри кадра
+    дал бы текстовым клиентам строку от чужого имени.
+    """
+
+    def read(self, client_socket: socket.socket, buffer: bytearray) -> list[str] | None:
+        """Читает из сокета через `buffer` и возвращает запросы или `None`, если соединение закрыто."""
+        received = client_socket.recv_into(buffer)
+        if not received:
+            return None
+        return self.feed_buffer(buffer, received)
+
+    def feed_buffer(self, buffer: bytearray, size: int) -> list[str]:
+        """Обрабатывает `size` байт, записанных в начало `buffer`."""
+        return self.feed(memoryview(buffer)[:size])
+
+    def feed(self, data: bytes | memoryview) -> list[str]:
+        """Обрабатывает уже полученные данные."""
+        requests = []
+        for kind, body in self.decoder.feed(data):
+            if kind == FrameType.CHAT:
+                text = body.decode('utf-8', 'replace').removesuffix('\n')
+                requests.extend(line.removesuffix('\r') for line in text.split('\n'))
+            elif kind == FrameType.PING:
+                requests.append('/ping')
+            elif kind == FrameType.PONG:
+                requests.append('/pong')
+        return requests
+
+    def get_pending(self) -> bytes:
+        """Возвращает начало незаконченного кадра."""
+        return bytes(self.decoder.data)
+
+    @property
+    def dropped_lines(self) -> int:
+        return self.decoder.dropped_frames
+
+    def __init__(self, max_line_length: int = 64 * 1024):
+        self.decoder = FrameDecoder(max_line_length)
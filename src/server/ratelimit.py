@@ -0,0 +1,79 @@
+import enum
+
+
+class RateLimitAction(enum.Enum):
+    """Что делать со строкой клиента, превысившего ограничение."""
+
+    # Строка выбрасывается.
+    DROP = 'drop'
+    # Чтение приостанавливается, пока не накопятся токены, а
+    # строка обрабатывается позже.
+    DELAY = 'delay'
+    DISCONNECT = 'disconnect'
+
+
+class TokenBucket:
+    """
+    Корзина токенов: `rate` токенов в секунду, но не больше
+    `capacity`. Таймеров нет: токены досчитываются лениво при
+    каждом обращении по прошедшему времени.
+    """
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """
+        Возвращает, сколько секунд ждать, пока в корзине будет
+        `amount` токенов, или 0, если они уже есть. Запрос больше
+        `capacity` ждет полную корзину.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        """Забирает токены, проверенные `wait_time`."""
+        self.tokens -= min(amount, self.capacity)
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+
+class RateLimiter:
+    """
+    Ограничения соединения или IP-адреса: корзина сообщений и
+    корзина байт, любая из которых может отсутствовать.
+    """
+
+    __slots__ = ('messages', 'bytes', 'connections')
+
+    def wait_time(self, size: int, now: float) -> float:
+        """
+        Возвращает, сколько секунд ждать, пока можно будет
+        принять сообщение размером `size`, или 0.
+        """
+        wait = 0.0
+        if self.messages is not None:
+            wait = self.messages.wait_time(1, now)
+        if self.bytes is not None:
+            wait = max(wait, self.bytes.wait_time(size, now))
+        return wait
+
+    def take(self, size: int):
+        """Учитывает принятое сообщение размером `size`."""
+        if self.messages is not None:
+            self.messages.take(1)
+        if self.bytes is not None:
+            self.bytes.take(size)
+
+    def __init__(self, messages: TokenBucket | None, bytes_: TokenBucket | None):
+        self.messages = messages
+        self.bytes = bytes_
+        # Сколько соединений делят ограничение IP-адреса.
+        self.connections = 0
@@ -0,0 +1,26 @@
+import re
+
+from server.history import MessageHistory
+from server.user import UserRegistry
+
+
+class Room(UserRegistry):
+    """
+    Комната чата со своим списком подписчиков и историей
+    последних сообщений.
+    """
+
+    name_pattern = re.compile(r'[\w-]{1,32}')
+
+    @classmethod
+    def is_valid_name(cls, name: str) -> bool:
+        """Проверяет, может ли комната так называться."""
+        return cls.name_pattern.fullmatch(name) is not None
+
+    def __repr__(self):
+        return self.name
+
+    def __init__(self, name: str, history_messages: int = 50, history_bytes: int = 64 * 1024):
+        super().__init__()
+        self.name = name
+        self.history = MessageHistory(history_messages, history_bytes)
@@ -0,0 +1,104 @@
+import socket
+from dataclasses import dataclass
+
+from server.buffers import SlowConsumerPolicy
+from server.ratelimit import RateLimitAction
+
+
+@dataclass
+class ServerSettings:
+    """Настройки сервера."""
+
+    # Длина очереди соединений, которые ядро уже установило, но
+    # сервер еще не принял. Ядро урезает ее до `net.core.somaxconn`.
+    listen_backlog: int = socket.SOMAXCONN
+    # Сколько соединений принимать из очереди за одно событие.
+    accept_batch: int = 128
+    # Сверх `max_connections` соединений новые клиенты получают
+    # отказ. `None` - сколько позволяет предел открытых файлов.
+    max_connections: int | None = None
+
+    # Если в очереди на отправку больше `high_watermark` байт,
+    # к клиенту применяется `slow_consumer_policy`.
+    high_watermark: int = 64 * 1024
+    # Чтение приостановленного клиента возобновляется, когда
+    # очередь опустилась до `low_watermark` байт.
+    low_watermark: int = 16 * 1024
+    # Жёсткий предел очереди для политики `PAUSE`, после
+    # которого клиент отключается.
+    max_buffer_size: int = 1024 * 1024
+    slow_consumer_policy: SlowConsumerPolicy = SlowConsumerPolicy.DROP_OLDEST
+    # Строки длиннее `max_line_length` байт отбрасываются.
+    max_line_length: int = 64 * 1024
+    # Комната, в которую попадают все подключившиеся.
+    default_room: str = 'general'
+    # История комнаты: сколько сообщений и байт хранить и
+    # сколько последних сообщений присылать вошедшему.
+    history_messages: int = 50
+    history_bytes: int = 64 * 1024
+    history_replay: int = 20
+    # Каталог журнала сообщений. Если не задан, сообщения не
+    # сохраняются между перезапусками.
+    log_directory: str | None = None
+    log_fsync_interval: float = 0.05
+    log_segment_bytes: int = 64 * 1024 * 1024
+    # Слушать порт с `SO_REUSEPORT`, чтобы его делили воркеры.
+    reuse_port: bool = False
+    # Ограничения частоты строк от клиента: сообщений и байт в
+    # секунду на соединение и на IP-адрес. `*_burst` - сколько
+    # можно отправить разом. `None` - без ограничения. Размер
+    # строки считается в символах вместе с переводом строки.
+    message_rate: float | None = None
+    message_burst: int = 20
+    byte_rate: float | None = None
+    byte_burst: int = 64 * 1024
+    address_message_rate: float | None = None
+    address_message_burst: int = 100
+    address_byte_rate: float | None = None
+    address_byte_burst: int = 256 * 1024
+    rate_limit_action: RateLimitAction = RateLimitAction.DROP
+    # Через сколько секунд без данных от клиента его соединение
+    # закрывается, и через сколько ему отправляется `/ping`,
+    # на который клиент отвечает `/pong`. `None` - никогда.
+    idle_timeout: float | None = None
+    heartbeat_interval: float | None = None
+    # TCP keepalive для соединений клиентов: через сколько секунд
+    # простоя ядро начинает проверки, как часто и сколько раз.
+    tcp_keepalive: bool = False
+    keepalive_idle: int = 60
+    keepalive_interval: int = 10
+    keepalive_count: int = 5
+    # Шаг колеса таймеров в секундах.
+    timer_resolution: float = 0.1
+    # Порт, на котором метрики отдаются в текстовом формате
+    # Prometheus. Если не задан, метрики только собираются.
+    metrics_host: str = 'localhost'
+    metrics_port: int | None = None
+    # Пакетная обработка: за итерацию цикла событий сначала
+    # читаются все готовые сокеты, затем обрабатываются строки, а
+    # все, что накопилось для получателя, уходит ему одним вызовом.
+    # Накопленное отправляется и раньше, после каждых
+    # `batch_max_lines` строк, чтобы ограничить задержку.
+    batch_dispatch: bool = False
+    batch_max_lines: int = 1024
+    # Unix-сокет для горячего перезапуска: новый процесс забирает
+    # через него у работающего слушающий сокет, а с
+    # `handoff_clients` - и соединения клиентов вместе с их
+    # состоянием. Старый процесс дописывает очереди оставшихся
+    # клиентов и завершается, но ждет не дольше `drain_timeout`.
+    handoff_path: str | None = None
+    handoff_clients: bool = False
+    drain_timeout: float = 10.0
+    # Стадии обработки сообщений перед рассылкой, функции вида
+    # `модуль:функция`, см. `server.middleware`. Вынесенные
+    # стадии выполняются в пуле из `middleware_threads` потоков
+    # или `middleware_processes` процессов (`None` - по числу ядер).
+    middleware: tuple[str, ...] = ()
+    middleware_threads: int = 4
+    middleware_processes: int | None = None
+
+    def __post_init__(self):
+        if not 0 <= self.low_watermark <= self.high_watermark <= self.max_buffer_size:
+            raise ValueError(
+                "Должно выполняться low_watermark <= high_watermark <= max_buffer_size."
+            )
@@ -0,0 +1,378 @@
+import bisect
+import collections
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Iterator, NamedTuple
+
+# Заголовок записи: длина тела, crc32 тела, время, длина
+# названия комнаты и длина имени отправителя. За ним идут
+# комната, отправитель и само сообщение.
+RECORD_HEADER = struct.Struct('!IIdHH')
+# Элемент разреженного индекса: номер записи и её смещение в
+# файле сегмента.
+INDEX_ENTRY = struct.Struct('!QQ')
+
+
+class Record(NamedTuple):
+    """Запись журнала сообщений."""
+
+    number: int
+    timestamp: float
+    room: str
+    sender: str
+    payload: bytes
+
+
+class Segment:
+    """
+    Файл журнала с записями, начиная с записи `base`, и
+    разреженный индекс к нему.
+    """
+
+    def find_offset(self, number: int) -> tuple[int, int]:
+        """
+        Возвращает ближайшую к записи `number` проиндексированную
+        запись не после неё в виде `(номер, смещение)`.
+        """
+        position = bisect.bisect_right(self.index_numbers, number) - 1
+        if position < 0:
+            return self.base, 0
+        return self.index_numbers[position], self.index_offsets[position]
+
+    def add_index_entry(self, number: int, offset: int):
+        """Добавляет элемент индекса в память."""
+        self.index_numbers.append(number)
+        self.index_offsets.append(offset)
+
+    @property
+    def log_path(self) -> str:
+        return os.path.join(self.directory, '%020d.log' % self.base)
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.directory, '%020d.idx' % self.base)
+
+    def __init__(self, directory: str, base: int):
+        self.directory = directory
+        self.base = base
+        # Количество записей и размер уже записанной части.
+        self.count = 0
+        self.size = 0
+        self.index_numbers: list[int] = []
+        self.index_offsets: list[int] = []
+
+
+class MessageLog:
+    """
+    Журнал сообщений из сегментов, в которые записи только
+    дописываются. Запись идет в отдельном потоке: цикл событий
+    лишь кладет готовые байты в очередь, а поток раз в
+    `fsync_interval` секунд записывает накопившееся пачкой и
+    делает один `fsync` на всю пачку.
+
+    Чтение идет через `mmap`. Каждая `index_interval`-я запись
+    попадает в разреженный индекс, поэтому найти запись по номеру
+    можно, не читая сегмент с начала, а при запуске проверяется
+    только хвост последнего сегмента.
+
+    Номера последних `room_records` записей каждой комнаты
+    хранятся в памяти, чтобы история комнаты читалась без
+    просмотра журнала. При открытии они собираются по последним
+    `room_scan` записям. Комнат запоминается не больше `max_rooms`,
+    давно не писавшие вытесняются.
+    """
+
+    def append(self, room: str, sender: str, payload: bytes | memoryview, timestamp: float = None) -> int:
+        """
+        Ставит запись в очередь на запись и возвращает её номер.
+        Не обращается к диску.
+        """
+        room_name = room.encode('utf-8')
+        sender_name = sender.encode('utf-8')
+        body = b''.join((room_name, sender_name, payload))
+        header = RECORD_HEADER.pack(
+            len(body), zlib.crc32(body), time.time() if timestamp is None else timestamp,
+            len(room_name), len(sender_name),
+        )
+        with self.lock:
+            number = self.next_number
+            self.next_number += 1
+            self.pending.append(header + body)
+            self._index_room(room, number)
+        return number
+
+    def read_last(self, count: int, room: str = None) -> list[Record]:
+        """
+        Возвращает до `count` последних записей, по желанию только
+        комнаты `room`, от старых к новым. Записи комнаты берутся по
+        номерам из памяти, журнал не просматривается.
+        """
+        if not count:
+            return []
+        with self.lock:
+            end = self.written_number
+            if room is not None:
+                numbers = [number for number in self.room_numbers.get(room, ()) if number < end]
+        if room is not None:
+            return self.read_numbers(numbers[-count:])
+        records: list[Record] = []
+        while end > 0 and len(records) < count:
+            start = max(0, end - count + len(records))
+            records[:0] = self.read_range(start, end)
+            end = start
+        return records[-count:]
+
+    def read_numbers(self, numbers: list[int]) -> list[Record]:
+        """
+        Возвращает записи с возрастающими номерами `numbers`.
+        Близкие записи читаются за один проход.
+        """
+        wanted = set(numbers)
+        records = []
+        start = 0
+        while start < len(numbers):
+            end = start + 1
+            while end < len(numbers) and numbers[end] - numbers[end - 1] <= self.index_interval:
+                end += 1
+            records.extend(
+                record for record in self.read_range(numbers[start], numbers[end - 1] + 1)
+                if record.number in wanted
+            )
+            start = end
+        return records
+
+    def _index_room(self, room: str, number: int):
+        """Запоминает номер записи комнаты. Вызывается под `lock`."""
+        numbers = self.room_numbers.get(room)
+        if numbers is None:
+            numbers = self.room_numbers[room] = collections.deque(maxlen=self.room_records)
+            if len(self.room_numbers) > self.max_rooms:
+                self.room_numbers.popitem(last=False)
+        else:
+            self.room_numbers.move_to_end(room)
+        numbers.append(number)
+
+    def _index_rooms(self, room_scan: int):
+        """Собирает номера записей комнат по последним `room_scan` записям."""
+        for record in self.read_range(max(0, self.written_number - room_scan), self.written_number):
+            self._index_room(record.room, record.number)
+
+    def read_range(self, start: int, end: int) -> Iterator[Record]:
+        """Возвращает записи с номерами от `start` до `end`."""
+        with self.lock:
+            end = min(end, self.written_number)
+            segments = list(self.segments)
+            sizes = [segment.size for segment in segments]
+        bases = [segment.base for segment in segments]
+        position = max(0, bisect.bisect_right(bases, start) - 1)
+        number = start
+        while number < end and position < len(segments):
+            segment = segments[position]
+            yield from self._read_segment(segment, sizes[position], number, end)
+            position += 1
+            if position < len(segments):
+                number = max(number, segments[position].base)
+
+    def _read_segment(self, segment: Segment, size: int, start: int, end: int) -> Iterator[Record]:
+        """Читает записи сегмента с номерами от `start` до `end`."""
+        if not size:
+            return
+        number, offset = segment.find_offset(start)
+        with open(segment.log_path, 'rb') as file, \
+                mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ) as data:
+            while number < end and offset < size:
+                record, offset = self._parse(data, offset, number)
+                if record is None:
+                    return
+                if number >= start:
+                    yield record
+                number += 1
+
+    @staticmethod
+    def _parse(data, offset: int, number: int) -> tuple[Record | None, int]:
+        """
+        Разбирает запись по смещению `offset`. Возвращает запись и
+        смещение следующей или `None`, если запись оборвана или
+        повреждена.
+        """
+        if offset + RECORD_HEADER.size > len(data):
+            return None, offset
+        length, checksum, timestamp, room_length, sender_length = RECORD_HEADER.unpack_from(data, offset)
+        body_start = offset + RECORD_HEADER.size
+        body_end = body_start + length
+        if body_end > len(data) or room_length + sender_length > length:
+            return None, offset
+        body = data[body_start:body_end]
+        if zlib.crc32(body) != checksum:
+            return None, offset
+        sender_end = room_length + sender_length
+        record = Record(
+            number, timestamp, str(body[:room_length], 'utf-8'),
+            str(body[room_length:sender_end], 'utf-8'), body[sender_end:],
+        )
+        return record, body_end
+
+    def flush(self):
+        """Записывает и синхронизирует с диском всё из очереди."""
+        with self.write_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+            if not pending:
+                return
+            for record in pending:
+                self._write(record)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.index_file.flush()
+            with self.lock:
+                self.written_number += len(pending)
+                self.segments[-1].size = self.file.tell()
+
+    def _write(self, record: bytes):
+        """Дописывает запись в текущий сегмент, начиная новый при надобности."""
+        segment = self.segments[-1]
+        if segment.count and self.file.tell() + len(record) > self.segment_bytes:
+            self._roll()
+            segment = self.segments[-1]
+        number = segment.base + segment.count
+        if segment.count % self.index_interval == 0:
+            offset = self.file.tell()
+            self.index_file.write(INDEX_ENTRY.pack(number, offset))
+            with self.lock:
+                segment.add_index_entry(number, offset)
+        self.file.write(record)
+        segment.count += 1
+
+    def _roll(self):
+        """Закрывает текущий сегмент и начинает новый."""
+        segment = self.segments[-1]
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.index_file.flush()
+        os.fsync(self.index_file.fileno())
+        with self.lock:
+            segment.size = self.file.tell()
+            self.segments.append(Segment(self.directory, segment.base + segment.count))
+        self._open_active()
+
+    def _open_active(self):
+        """Открывает файлы последнего сегмента на дозапись."""
+        if self.file is not None:
+            self.file.close()
+            self.index_file.close()
+        segment = self.segments[-1]
+        self.file = open(segment.log_path, 'ab')
+        self.index_file = open(segment.index_path, 'ab')
+
+    def _recover(self):
+        """
+        Находит сегменты на диске. Закрытые сегменты берутся по
+        индексу, а последний дочитывается от последнего элемента
+        индекса, и оборванная запись в его конце отрезается.
+        """
+        bases = sorted(
+            int(name[:-4]) for name in os.listdir(self.directory) if name.endswith('.log')
+        )
+        self.segments = [Segment(self.directory, base) for base in bases or [0]]
+        for segment, next_segment in zip(self.segments, self.segments[1:]):
+            self._load_index(segment)
+            segment.count = next_segment.base - segment.base
+            segment.size = os.path.getsize(segment.log_path)
+        active = self.segments[-1]
+        self._load_index(active)
+        self._scan_tail(active)
+        self.next_number = self.written_number = active.base + active.count
+
+    def _load_index(self, segment: Segment):
+        """Читает разреженный индекс сегмента."""
+        if not os.path.exists(segment.index_path):
+            return
+        with open(segment.index_path, 'rb') as file:
+            data = file.read()
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        for number, offset in INDEX_ENTRY.iter_unpack(data[:usable]):
+            segment.add_index_entry(number, offset)
+
+    def _scan_tail(self, segment: Segment):
+        """
+        Дочитывает последний сегмент от последнего элемента
+        индекса, отрезает оборванную запись в конце и дописывает
+        индекс.
+        """
+        if not os.path.exists(segment.log_path):
+            open(segment.log_path, 'wb').close()
+        file_size = os.path.getsize(segment.log_path)
+        number, offset = segment.find_offset(2 ** 63)
+        if offset > file_size:
+            number, offset = segment.base, 0
+        if file_size:
+            with open(segment.log_path, 'rb') as file, \
+                    mmap.mmap(file.fileno(), file_size, access=mmap.ACCESS_READ) as data:
+                while True:
+                    record, next_offset = self._parse(data, offset, number)
+                    if record is None:
+                        break
+                    if (number - segment.base) % self.index_interval == 0 and \
+                            (not segment.index_numbers or number > segment.index_numbers[-1]):
+                        segment.add_index_entry(number, offset)
+                    number, offset = number + 1, next_offset
+        if offset < file_size:
+            os.truncate(segment.log_path, offset)
+        # Элементы индекса для записей, которых нет, остались от
+        # незавершенной записи. Их заново добавит `_write`.
+        while segment.index_numbers and segment.index_numbers[-1] >= number:
+            segment.index_numbers.pop()
+            segment.index_offsets.pop()
+        with open(segment.index_path, 'wb') as file:
+            file.write(b''.join(
+                INDEX_ENTRY.pack(*entry) for entry in zip(segment.index_numbers, segment.index_offsets)
+            ))
+        segment.count = number - segment.base
+        segment.size = offset
+
+    def _run(self):
+        """Поток записи: сбрасывает очередь на диск каждые `fsync_interval` секунд."""
+        while not self.stopped.wait(self.fsync_interval):
+            self.flush()
+        self.flush()
+
+    def close(self):
+        """Дописывает очередь и закрывает журнал."""
+        self.stopped.set()
+        self.writer.join()
+        self.file.close()
+        self.index_file.close()
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024,
+                 fsync_interval: float = 0.05, index_interval: int = 64,
+                 room_records: int = 64, room_scan: int = 100_000, max_rooms: int = 10_000):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.index_interval = index_interval
+        # `lock` защищает очередь и сведения о сегментах, которые
+        # читает цикл событий, `write_lock` - сами файлы.
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.pending: list[bytes] = []
+        self.segments: list[Segment] = []
+        self.next_number = 0
+        self.written_number = 0
+        # Номера последних записей по комнатам, давно не писавшие
+        # комнаты в начале.
+        self.room_records = room_records
+        self.max_rooms = max_rooms
+        self.room_numbers: collections.OrderedDict[str, collections.deque[int]] = collections.OrderedDict()
+        self._recover()
+        self._index_rooms(room_scan)
+        self.file = None
+        self.index_file = None
+        self._open_active()
+        self.stopped = threading.Event()
+        self.writer = threading.Thread(target=self._run, name='message-log', daemon=True)
+        self.writer.start()
@@ -3,7 +3,7 @@ import socket
 import pytest
 
 from server.handlers import Server, Chat
-from server.user import Names
+from server.user import Names, User
 
 
 @pytest.fixture
@@ -24,3 +24,46 @@ def client_socket():
 @pytest.fixture
 def name_class():
     return Names()
+
+
+@pytest.fixture
+def chat_client(chat_server):
+    """
+    Возвращает функцию, которая подключает клиента к
+    `chat_server` и возвращает пару из сокета клиента и
+    пользователя на сервере.
+    """
+    chat_server.server_socket.listen()
+    sockets = []
+
+    def connect():
+        client = socket.create_connection(chat_server.server_socket.getsockname())
+        client.settimeout(1)
+        sockets.append(client)
+        connection = chat_server.accept_connection()
+        return client, chat_server.registered_users[connection]
+
+    yield connect
+    for client in sockets:
+        client.close()
+    chat_server.server_socket.close()
+
+
+def read_lines(client: socket.socket) -> list[str]:
+    """Читает все, что сервер успел отправить клиенту."""
+    data = b''
+    client.setblocking(False)
+    try:
+        while chunk := client.recv(65536):
+            data += chunk
+    except BlockingIOError:
+        pass
+    finally:
+        client.settimeout(1)
+    return data.decode().splitlines()
+
+
+def send_line(chat_server: Chat, client: socket.socket, user: User, line: str):
+    """Отправляет строку от клиента и дает серверу ее обработать."""
+    client.sendall(line.encode() + b'\n')
+    chat_server.invoke_handler(user.client_socket)
@@ -0,0 +1,124 @@
+import asyncio
+import contextlib
+
+from server.aio import AsyncChat, AsyncServer
+from server.buffers import SlowConsumerPolicy
+from server.settings import ServerSettings
+
+CHUNK = b'x' * 1023 + b'\n'
+
+
+async def read_line(reader: asyncio.StreamReader) -> str:
+    return (await asyncio.wait_for(reader.readline(), 1)).decode()
+
+
+async def chat_session():
+    chat = AsyncChat('localhost', 0)
+    address = chat.server_socket.getsockname()
+    serving = asyncio.create_task(chat.serve())
+    await asyncio.sleep(0)
+
+    first_reader, first_writer = await asyncio.open_connection(*address)
+    assert await read_line(first_reader) == 'None is here.\n'
+    second_reader, second_writer = await asyncio.open_connection(*address)
+    assert await read_line(second_reader) == '%s are in the chat.\n' % chat.users_in_chat[0]
+    assert await read_line(first_reader) == '=== Server ===\n'
+    assert (await read_line(first_reader)).endswith('Has connected!\n')
+    assert await read_line(first_reader) == '==============\n'
+
+    second_writer.write('hello\nworld\n'.encode())
+    assert (await read_line(first_reader)).endswith('] hello\n')
+    assert (await read_line(first_reader)).endswith('] world\n')
+
+    second_writer.close()
+    await read_line(first_reader)
+    assert (await read_line(first_reader)).endswith('Has disconnected!\n')
+    assert len(chat.registered_users) == 1
+
+    first_writer.close()
+    serving.cancel()
+
+
+def test_async_chat_broadcast():
+    asyncio.run(chat_session())
+
+
+@contextlib.asynccontextmanager
+async def slow_consumer(policy: SlowConsumerPolicy):
+    """
+    Подключает клиента, который ничего не читает, и шлет ему
+    данные, пока транспорт не попросит подождать. Возвращает
+    сервер, соединение на нем и поток клиента.
+    """
+    settings = ServerSettings(
+        high_watermark=4096, low_watermark=1024, max_buffer_size=64 * 1024, slow_consumer_policy=policy,
+    )
+    server = AsyncServer('localhost', 0, settings)
+    serving = asyncio.create_task(server.serve())
+    await asyncio.sleep(0)
+    reader, writer = await asyncio.open_connection(*server.server_socket.getsockname())
+    while not server.connections:
+        await asyncio.sleep(0.01)
+    connection, = server.connections.values()
+    for _ in range(100000):
+        if connection.writing_paused:
+            break
+        server.send(connection.client_socket, CHUNK)
+    assert connection.writing_paused
+    try:
+        yield server, connection, reader
+    finally:
+        writer.close()
+        serving.cancel()
+
+
+async def drop_oldest_session():
+    async with slow_consumer(SlowConsumerPolicy.DROP_OLDEST) as (server, connection, _):
+        for _ in range(100):
+            server.send(connection.client_socket, CHUNK)
+        assert connection.write_queue.size <= server.settings.high_watermark
+        assert server.metrics.messages_dropped.value >= 96
+        await asyncio.sleep(0)
+        assert connection.client_socket in server.connections
+
+
+async def disconnect_session():
+    async with slow_consumer(SlowConsumerPolicy.DISCONNECT) as (server, _, _):
+        await asyncio.sleep(0)
+        assert not server.connections
+
+
+async def pause_session():
+    async with slow_consumer(SlowConsumerPolicy.PAUSE) as (server, connection, reader):
+        assert not connection.transport.is_reading()
+        server.send(connection.client_socket, CHUNK)
+        assert connection.write_queue.size == len(CHUNK)
+
+        while connection.writing_paused:
+            await asyncio.wait_for(reader.read(64 * 1024), 1)
+        assert not connection.write_queue
+        assert connection.transport.is_reading()
+
+
+async def pause_overflow_session():
+    async with slow_consumer(SlowConsumerPolicy.PAUSE) as (server, connection, _):
+        while connection.write_queue.size <= server.settings.max_buffer_size:
+            server.send(connection.client_socket, CHUNK)
+        await asyncio.sleep(0)
+        assert not server.connections
+
+
+def test_slow_consumer_loses_oldest_messages():
+    asyncio.run(drop_oldest_session())
+
+
+def test_slow_consumer_is_disconnected():
+    asyncio.run(disconnect_session())
+
+
+def test_slow_consumer_is_paused_until_it_reads():
+    asyncio.run(pause_session())
+
+
+def test_paused_consumer_is_disconnected_past_max_buffer_size():
+    asyncio.run(pause_overflow_session())
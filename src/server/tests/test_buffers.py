@@ -0,0 +1,142 @@
+import socket
+
+import pytest
+
+from server.buffers import LineReader, SlowConsumerPolicy, WriteQueue
+from server.handlers import Server
+from server.settings import ServerSettings
+
+
+@pytest.fixture
+def socket_pair():
+    first, second = socket.socketpair()
+    first.setblocking(False)
+    yield first, second
+    first.close()
+    second.close()
+
+
+def test_write_queue_sends_everything(socket_pair):
+    sender, receiver = socket_pair
+    queue = WriteQueue()
+    queue.append(b'first\n')
+    queue.append(b'second\n')
+    assert queue.size == 13
+    assert queue.send(sender) == 13
+    assert not queue
+    assert queue.size == 0
+    assert receiver.recv(64) == b'first\nsecond\n'
+
+
+def test_write_queue_keeps_partially_sent_message(socket_pair):
+    sender, receiver = socket_pair
+    sender.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    queue = WriteQueue()
+    payload = b'x' * (1024 * 1024)
+    queue.append(payload)
+    sent = queue.send(sender)
+    assert 0 < sent < len(payload)
+    assert queue.offset == sent
+    assert queue.size == len(payload) - sent
+
+    queue.append(b'tail')
+    queue.drop_oldest(0)
+    assert len(queue) == 1
+    assert queue.offset == sent
+
+    received = b''
+    while queue:
+        received += receiver.recv(1024 * 1024)
+        queue.send(sender)
+    while len(received) < len(payload):
+        received += receiver.recv(1024 * 1024)
+    assert received == payload
+
+
+def test_write_queue_drop_oldest():
+    queue = WriteQueue()
+    for i in range(10):
+        queue.append(b'%d' % i)
+    assert queue.drop_oldest(3) == 7
+    assert list(queue.chunks) == [b'7', b'8', b'9']
+    assert queue.size == 3
+
+
+@pytest.mark.parametrize(
+    'policy, closed, paused',
+    [
+        (SlowConsumerPolicy.DROP_OLDEST, False, False),
+        (SlowConsumerPolicy.DISCONNECT, True, False),
+        (SlowConsumerPolicy.PAUSE, False, True),
+    ]
+)
+def test_slow_consumer_policy(policy, closed, paused):
+    settings = ServerSettings(
+        high_watermark=1024, low_watermark=512,
+        max_buffer_size=1024 * 1024 * 1024, slow_consumer_policy=policy,
+    )
+    server = Server('localhost', 5153, settings)
+    with server.server_socket as server_socket:
+        server_socket.listen()
+        client_socket = socket.create_connection(server_socket.getsockname())
+        client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        connection = server.accept_connection()
+        connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        for _ in range(1024):
+            server.send(connection, b'x' * 1023 + b'\n')
+        assert (connection in server.closing) is closed
+        assert server.connections[connection].paused is paused
+        if policy is SlowConsumerPolicy.DROP_OLDEST:
+            assert server.connections[connection].write_queue.size <= settings.high_watermark + 1024
+        server.close_scheduled()
+        assert (connection.fileno() == -1) is closed
+        client_socket.close()
+
+
+def test_write_queue_shares_payload_between_queues(socket_pair):
+    sender, receiver = socket_pair
+    payload = memoryview(b'shared\n')
+    queues = [WriteQueue(), WriteQueue()]
+    for queue in queues:
+        queue.append(payload)
+        queue.append(payload)
+        assert queue.chunks[0] is payload
+    for queue in queues:
+        queue.send(sender)
+    assert receiver.recv(64) == b'shared\n' * 4
+
+
+def test_line_reader_keeps_partial_lines():
+    reader = LineReader()
+    assert reader.feed(b'first\nsec') == ['first']
+    assert reader.feed(b'ond\r\nthird\n\n') == ['second', 'third', '']
+
+
+def test_line_reader_decodes_split_characters():
+    reader = LineReader()
+    data = 'привет\n'.encode('utf-8')
+    lines = []
+    for i in range(len(data)):
+        lines += reader.feed(data[i:i + 1])
+    assert lines == ['привет']
+
+
+def test_line_reader_drops_long_lines():
+    reader = LineReader(max_line_length=8)
+    assert reader.feed(b'x' * 6) == []
+    assert reader.feed(b'x' * 6 + b'\nshort\n') == ['short']
+    assert reader.dropped_lines == 1
+
+
+def test_line_reader_reads_from_socket(socket_pair):
+    sender, receiver = socket_pair
+    reader, other = LineReader(), LineReader()
+    buffer = bytearray(16)
+    sender.send(b'one\ntwo\nthr')
+    assert reader.read(receiver, buffer) == ['one', 'two']
+    # Буфер общий: чужие данные не портят незаконченную строку.
+    assert other.feed_buffer(buffer, buffer.find(b'\n') + 1) == ['one']
+    sender.send(b'ee\n')
+    assert reader.read(receiver, buffer) == ['three']
+    sender.close()
+    assert reader.read(receiver, buffer) is None
@@ -0,0 +1,90 @@
+import socket
+from types import SimpleNamespace
+
+import pytest
+
+from server.cluster import Bus, BusMessage
+from server.handlers import Chat
+
+
+@pytest.fixture
+def buses(tmp_path):
+    buses = [Bus(str(tmp_path), worker_id, 2) for worker_id in range(2)]
+    yield buses
+    for bus in buses:
+        bus.close()
+
+
+def test_bus_delivers_to_other_workers(buses):
+    first, second = buses
+    first.publish(BusMessage.CHAT, 'general', b'hello\n')
+    assert first.receive() == []
+    [(kind, worker_id, room, payload)] = second.receive()
+    assert kind is BusMessage.CHAT
+    assert worker_id == 0
+    assert room == 'general'
+    assert bytes(payload) == b'hello\n'
+
+
+def test_bus_ignores_missing_workers(tmp_path):
+    bus = Bus(str(tmp_path), 0, 3)
+    bus.publish(BusMessage.HELLO)
+    assert bus.dropped == 2
+    bus.close()
+
+
+def test_presence_is_shared_between_workers(buses):
+    chats = [Chat('localhost', 0), Chat('localhost', 0)]
+    for chat, bus in zip(chats, buses):
+        chat.attach_bus(bus)
+    first, second = chats
+    second.bus_received()
+
+    first.bus.publish(BusMessage.JOIN, 'general', 'Alice'.encode())
+    first.bus.publish(BusMessage.JOIN, 'python', 'Bob'.encode())
+    second.bus_received()
+    assert second.remote_users == {'Alice': 0, 'Bob': 0}
+    assert second.get_users_in_chat_message() == 'Alice are in the chat.'
+    assert second.get_users_in_chat_message(room_name='python') == 'Bob are in the chat.'
+
+    first.bus.publish(BusMessage.LEAVE, 'general', 'Alice'.encode())
+    second.bus_received()
+    assert second.get_users_in_chat_message() == 'None is here.'
+
+
+def test_private_message_is_routed_to_recipient_worker(buses):
+    chats = [Chat('localhost', 0), Chat('localhost', 0)]
+    for chat, bus in zip(chats, buses):
+        chat.attach_bus(bus)
+    first, second = chats
+    first.remote_users['Bob'] = 1
+    sent = []
+    second.send_to = lambda user, message: sent.append((user, message))
+    second.registered_users.by_name['Bob'] = bob = SimpleNamespace(username='Bob')
+    second.bus_received()
+
+    first.msg_command(SimpleNamespace(formatted_user_addr='Alice'), 'Bob hello')
+    second.bus_received()
+    assert sent == [(bob, '[Alice] (private) hello')]
+
+
+def test_hello_is_answered_only_to_new_worker(tmp_path):
+    buses = [Bus(str(tmp_path), worker_id, 3) for worker_id in range(3)]
+    chat = Chat('localhost', 0)
+    chat.attach_bus(buses[0])
+    chat.server_socket.listen()
+    client = socket.create_connection(chat.server_socket.getsockname())
+    user = chat.registered_users[chat.accept_connection()]
+    for bus in buses[1:]:
+        bus.receive()
+
+    buses[1].publish(BusMessage.HELLO)
+    chat.bus_received()
+    assert [(kind, room, bytes(payload)) for kind, _, room, payload in buses[1].receive()] == [
+        (BusMessage.JOIN, 'general', user.username.encode()),
+    ]
+    assert [kind for kind, *_ in buses[2].receive()] == [BusMessage.HELLO]
+    client.close()
+    chat.close()
+    for bus in buses:
+        bus.close()
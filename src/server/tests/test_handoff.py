@@ -0,0 +1,54 @@
+import select
+import socket
+import threading
+
+from server.handlers import Chat
+from server.handoff import receive_handoff
+from server.settings import ServerSettings
+from server.tests.conftest import read_lines
+
+
+def test_clients_are_handed_to_new_process(tmp_path):
+    settings = ServerSettings(handoff_path=str(tmp_path / 'handoff.sock'), handoff_clients=True)
+    old_server = Chat('localhost', 0, settings)
+    old_server.server_socket.listen()
+    address = old_server.server_socket.getsockname()
+    first, second = socket.create_connection(address), socket.create_connection(address)
+    first_user = old_server.registered_users[old_server.accept_connection()]
+    second_user = old_server.registered_users[old_server.accept_connection()]
+    first.sendall(b'hello\n')
+    old_server.invoke_handler(first_user.client_socket)
+    first.sendall(b'unfinished ')
+    old_server.invoke_handler(first_user.client_socket)
+    read_lines(first)
+    read_lines(second)
+
+    handoffs = []
+    receiver = threading.Thread(target=lambda: handoffs.append(receive_handoff(settings.handoff_path)))
+    receiver.start()
+    select.select([old_server.handoff_socket], [], [], 1)
+    old_server.accept_handoff()
+    receiver.join()
+    assert old_server.draining and not old_server.connections
+    assert old_server.server_socket.fileno() == -1
+
+    new_server = Chat('localhost', 0, settings, handoff=handoffs[0])
+    new_server.restore_handoff(handoffs[0])
+    assert new_server.server_socket.getsockname() == address
+    users = {user.username: user for user in new_server.registered_users.values()}
+    assert users.keys() == {first_user.username, second_user.username}
+    assert users[first_user.username].user_id == first_user.user_id
+    assert [bytes(payload) for payload in new_server.rooms['general'].history.get_last(10)] == [
+        first_user.prefix + b'hello\n',
+    ]
+
+    first.sendall(b'message\n')
+    new_server.invoke_handler(users[first_user.username].client_socket)
+    assert read_lines(second) == ['[%s] unfinished message' % first_user.formatted_user_addr]
+
+    third = socket.create_connection(address)
+    assert new_server.registered_users[new_server.accept_connection()].user_id > second_user.user_id
+    for client in (first, second, third):
+        client.close()
+    old_server.close()
+    new_server.close()
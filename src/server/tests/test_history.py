@@ -0,0 +1,27 @@
+from server.history import MessageHistory
+
+
+def test_history_keeps_last_messages():
+    history = MessageHistory(3, 1024)
+    for i in range(5):
+        history.append(b'%d\n' % i)
+    assert history.get_last(10) == [b'2\n', b'3\n', b'4\n']
+    assert history.get_last(2) == [b'3\n', b'4\n']
+    assert history.size == 6
+
+
+def test_history_is_limited_by_size():
+    history = MessageHistory(10, 10)
+    history.append(b'x' * 4)
+    history.append(b'y' * 4)
+    history.append(b'z' * 4)
+    assert history.get_last(10) == [b'y' * 4, b'z' * 4]
+    history.append(b'w' * 11)
+    assert len(history) == 2
+
+
+def test_history_does_not_copy_messages():
+    history = MessageHistory(2, 1024)
+    payload = memoryview(b'shared\n')
+    history.append(payload)
+    assert history.get_last(1)[0] is payload
@@ -0,0 +1,67 @@
+import socket
+
+from server.handlers import Chat
+from server.metrics import Histogram, Metrics
+from server.settings import ServerSettings
+from server.tests.conftest import read_lines
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('latency', "Latency.", (1, 5, 10))
+    for value in (0.5, 1, 3, 7, 20):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1, 1]
+    assert histogram.render() == [
+        'latency_bucket{le="1"} 2',
+        'latency_bucket{le="5"} 3',
+        'latency_bucket{le="10"} 4',
+        'latency_bucket{le="+Inf"} 5',
+        'latency_sum 31.5',
+        'latency_count 5',
+    ]
+
+
+def test_metrics_render():
+    metrics = Metrics()
+    counter = metrics.counter('requests_total', "Requests.")
+    metrics.gauge('queue', "Queue.", lambda: 7)
+    counter.inc()
+    counter.inc(2)
+    assert metrics.render() == (
+        b'# HELP requests_total Requests.\n# TYPE requests_total counter\nrequests_total 3\n'
+        b'# HELP queue Queue.\n# TYPE queue gauge\nqueue 7\n'
+    )
+
+
+def test_chat_records_metrics(chat_server, chat_client):
+    first_client, _ = chat_client()
+    second_client, second_user = chat_client()
+    second_client.sendall(b'hello\n')
+    chat_server.invoke_handler(second_user.client_socket)
+    assert read_lines(first_client)[-1].endswith('] hello')
+    metrics = chat_server.metrics
+    assert metrics.connections_accepted.value == 2
+    assert metrics.bytes_received.value == 6
+    assert metrics.bytes_sent.value > 0
+    assert metrics.fanout.count == metrics.messages_broadcast.value
+    assert metrics.handler_duration.count == 3
+
+
+def test_metrics_endpoint():
+    chat = Chat('localhost', 0, ServerSettings(metrics_port=0))
+    client = socket.create_connection(chat.metrics_socket.getsockname())
+    client.settimeout(1)
+    client.sendall(b'GET /metrics HTTP/1.0\r\n\r\n')
+    chat.accept_scrape()
+    scrape_socket = next(iter(chat.scrapes))
+    chat.selector.select(1)
+    chat.scrape_received(scrape_socket)
+    response = b''
+    while chunk := client.recv(65536):
+        response += chunk
+    client.close()
+    chat.close()
+    assert response.startswith(b'HTTP/1.0 200 OK\r\n')
+    assert b'chat_connections_accepted_total 0\n' in response
+    assert b'# TYPE chat_handler_seconds histogram\n' in response
+    assert not chat.scrapes
@@ -0,0 +1,134 @@
+import select
+import socket
+import threading
+import time
+
+import pytest
+
+from server.handlers import Chat
+from server.metrics import Metrics
+from server.middleware import Pipeline, StageMode, stage
+from server.settings import ServerSettings
+from server.tests.conftest import read_lines, send_line
+
+calls = []
+release = threading.Event()
+
+
+@stage(StageMode.THREAD)
+def slow_first(text: str) -> str:
+    if text == 'first':
+        release.wait(1)
+    return text
+
+
+@stage(cache_size=2)
+def shout(text: str) -> str:
+    calls.append(text)
+    return text.upper()
+
+
+def drop_spam(text: str) -> str | None:
+    return None if 'spam' in text else text
+
+
+@stage(StageMode.PROCESS)
+def reverse(text: str) -> str:
+    return text[::-1]
+
+
+def flip(text: str) -> str:
+    return text[::-1]
+
+
+def wait_for(pipeline: Pipeline, condition):
+    deadline = time.monotonic() + 2
+    while not condition() and time.monotonic() < deadline:
+        select.select([pipeline.wakeup_socket], [], [], 0.1)
+        pipeline.results_ready()
+
+
+def test_sender_order_is_kept_across_offloaded_stages():
+    pipeline = Pipeline([slow_first, shout], Metrics())
+    results = []
+    release.clear()
+    pipeline.submit('alice', 'first', results.append)
+    pipeline.submit('alice', '/join python', results.append, transform=False)
+    pipeline.submit('bob', 'other', results.append)
+    wait_for(pipeline, lambda: results)
+    assert results == ['OTHER']
+
+    release.set()
+    wait_for(pipeline, lambda: len(results) == 3)
+    assert results == ['OTHER', 'FIRST', '/join python']
+    assert not pipeline.queues
+    assert pipeline.stages[0].duration.count == 2
+    pipeline.close()
+
+
+def test_cached_and_dropped_messages():
+    metrics = Metrics()
+    pipeline = Pipeline([drop_spam, shout], metrics)
+    results = []
+    calls.clear()
+    for text in ('hi', 'hi', 'spam', 'hi'):
+        pipeline.submit('alice', text, results.append)
+    assert results == ['HI', 'HI', 'HI']
+    assert calls == ['hi']
+    assert pipeline.cache_hits.value == 2
+    pipeline.close()
+
+
+def test_broken_pool_drops_message_and_is_replaced():
+    pipeline = Pipeline([slow_first], Metrics())
+    pipeline.get_executor(StageMode.THREAD).shutdown()
+    results = []
+    pipeline.submit('alice', 'lost', results.append)
+    assert results == [] and not pipeline.queues
+    assert pipeline.stages[0].errors.value == 1
+    assert pipeline.thread_pool is None
+
+    pipeline.submit('alice', 'delivered', results.append)
+    wait_for(pipeline, lambda: results)
+    assert results == ['delivered']
+    pipeline.close()
+
+
+def test_stage_names_must_be_unique():
+    with pytest.raises(ValueError, match='shout'):
+        Pipeline([shout, drop_spam, shout], Metrics())
+
+
+def test_chat_broadcasts_processed_messages():
+    chat_server = Chat('localhost', 0, ServerSettings(middleware=('server.tests.test_middleware:reverse',)))
+    chat_server.server_socket.listen()
+    address = chat_server.server_socket.getsockname()
+    users = []
+    for _ in range(2):
+        client = socket.create_connection(address)
+        client.settimeout(1)
+        users.append((client, chat_server.registered_users[chat_server.accept_connection()]))
+    (first, alice), (second, bob) = users
+    read_lines(second)
+
+    send_line(chat_server, first, alice, 'hello')
+    wait_for(chat_server.pipeline, lambda: chat_server.pipeline.stages[0].duration.count)
+    assert read_lines(second) == ['[%s] olleh' % alice.formatted_user_addr]
+
+    send_line(chat_server, first, alice, '/msg %s secret' % bob.username)
+    wait_for(chat_server.pipeline, lambda: chat_server.pipeline.stages[0].duration.count == 2)
+    assert read_lines(second) == ['[%s] (private) terces' % alice.formatted_user_addr]
+    for client, _ in users:
+        client.close()
+    chat_server.close()
+
+
+def test_stage_output_is_never_a_command(chat_server, chat_client):
+    chat_server.pipeline = Pipeline([flip], Metrics())
+    (first, alice), (second, _) = chat_client(), chat_client()
+    read_lines(second)
+
+    send_line(chat_server, first, alice, 'nohtyp nioj/')
+    assert alice.room.name == 'general'
+    assert read_lines(second) == ['[%s] /join python' % alice.formatted_user_addr]
+    chat_server.pipeline.close()
@@ -1,3 +1,6 @@
+from server.user import Names
+
+
 def test_get_name_return_first_name(name_class):
     for _ in range(5):
         name = name_class.get_name()
@@ -18,3 +21,42 @@ def test_name_deletion(name_class):
     assert name in name_class._registered_names
     name_class.delete_name(name)
     assert name not in name_class._registered_names
+
+
+def test_names_beyond_pool_get_suffix(name_class):
+    pool_size = len(name_class._pool)
+    names_list = {name_class.get_name() for _ in range(pool_size + 50)}
+    assert len(names_list) == pool_size + 50
+    suffixed = names_list - set(name_class._pool)
+    assert len(suffixed) == 50
+    assert all(name[-1].isdigit() for name in suffixed)
+
+
+def test_deleted_name_is_reused(name_class):
+    names_list = [name_class.get_name() for _ in range(len(name_class._pool))]
+    name_class.delete_name(names_list[0])
+    assert name_class.get_name() == names_list[0]
+
+
+def test_name_reservation(name_class):
+    name = name_class._free_names[-1]
+    assert name_class.reserve_name(name)
+    assert not name_class.reserve_name(name)
+    assert name_class.get_name() != name
+
+
+def test_shards_do_not_share_names():
+    first, second = Names(0, 2), Names(1, 2)
+    first_names = {first.get_name() for _ in range(len(first._pool) + 10)}
+    second_names = {second.get_name() for _ in range(len(second._pool) + 10)}
+    assert not first_names & second_names
+
+
+def test_reserved_suffixed_names_are_skipped():
+    names = Names()
+    reserved = {'%s1' % name for name in names._pool}
+    for name in reserved:
+        assert names.reserve_name(name)
+    issued = [names.get_name() for _ in range(len(names._pool) + 1)]
+    assert issued[-1] not in reserved
+    assert len(set(issued)) == len(issued)
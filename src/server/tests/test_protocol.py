@@ -0,0 +1,97 @@
+from server.protocol import (
+    CHAT_HEADER, FRAME_HEADER, Deflater, FrameDecoder, FrameReader, FrameType, PresenceEvent,
+    encode_chat, encode_frame, encode_presence, encode_text,
+)
+from server.tests.conftest import read_lines
+
+
+def test_frames_split_across_reads():
+    data = encode_chat(7, b'hello') + encode_presence(PresenceEvent.JOIN, 7, 'Ann') + encode_frame(FrameType.PING)
+    decoder = FrameDecoder()
+    frames = []
+    for index in range(len(data)):
+        frames += decoder.feed(data[index:index + 1])
+    assert frames == [
+        (FrameType.CHAT, CHAT_HEADER.pack(7) + b'hello'),
+        (FrameType.PRESENCE, b'\x01\x00\x00\x00\x07Ann'),
+        (FrameType.PING, b''),
+    ]
+
+
+def test_long_frames_are_dropped():
+    decoder = FrameDecoder(max_length=10)
+    data = encode_text(FrameType.SYSTEM, 'x' * 100) + encode_text(FrameType.SYSTEM, 'ok')
+    assert decoder.feed(data[:50]) == []
+    assert decoder.feed(data[50:]) == [(FrameType.SYSTEM, b'ok')]
+    assert decoder.dropped_frames == 1
+
+
+def test_compressed_frames_decode_independently():
+    deflater = Deflater()
+    frames = [encode_text(FrameType.TEXT, ('message %d ' % index) * 100) for index in range(5)]
+    compressed = [deflater.compress(frame) for frame in frames]
+    assert all(len(packed) < len(frame) for packed, frame in zip(compressed, frames))
+    # Клиент может получить только часть кадров общего потока.
+    decoder = FrameDecoder()
+    received = decoder.feed(compressed[1] + compressed[3] + compressed[4])
+    assert [body for _, body in received] == [frames[index][FRAME_HEADER.size:] for index in (1, 3, 4)]
+
+
+def test_frame_reader_returns_requests():
+    reader = FrameReader()
+    data = encode_text(FrameType.CHAT, 'hi') + encode_frame(FrameType.PONG) + encode_text(FrameType.CHAT, '/rooms')
+    buffer = bytearray(data) + bytes(16)
+    assert reader.feed_buffer(buffer, len(data)) == ['hi', '/pong', '/rooms']
+
+
+def test_chat_binary_mode(chat_server, chat_client):
+    binary_client, binary_user = chat_client()
+    text_client, text_user = chat_client()
+    binary_client.recv(65536)
+    binary_client.sendall(b'/binary zlib\n')
+    chat_server.invoke_handler(binary_user.client_socket)
+    data = binary_client.recv(65536)
+    assert data.startswith(b'/binary zlib\n')
+    frames = FrameDecoder().feed(data[len(b'/binary zlib\n'):])
+    assert (FrameType.PRESENCE, b'\x01' + CHAT_HEADER.pack(text_user.user_id) + text_user.username.encode()) in frames
+
+    text_client.sendall(b'hello\n' + b'long ' * 100 + b'\n')
+    chat_server.invoke_handler(text_user.client_socket)
+    decoder = FrameDecoder()
+    frames = decoder.feed(binary_client.recv(65536))
+    assert frames == [
+        (FrameType.CHAT, CHAT_HEADER.pack(text_user.user_id) + b'hello'),
+        (FrameType.CHAT, CHAT_HEADER.pack(text_user.user_id) + b'long ' * 100),
+    ]
+
+    binary_client.sendall(encode_text(FrameType.CHAT, 'from binary'))
+    chat_server.invoke_handler(binary_user.client_socket)
+    assert text_client.recv(65536).decode().endswith('] from binary\n')
+
+
+def test_chat_frame_lines_are_separate_messages(chat_server, chat_client):
+    binary_client, binary_user = chat_client()
+    text_client, text_user = chat_client()
+    binary_client.sendall(b'/binary\n')
+    chat_server.invoke_handler(binary_user.client_socket)
+    read_lines(text_client)
+
+    binary_client.sendall(encode_text(FrameType.CHAT, 'hi\r\n=== Server ===\n[Bob] forged\n'))
+    chat_server.invoke_handler(binary_user.client_socket)
+    prefix = '[%s] ' % binary_user.formatted_user_addr
+    assert read_lines(text_client) == [prefix + 'hi', prefix + '=== Server ===', prefix + '[Bob] forged']
+
+
+def test_chat_frame_is_built_only_for_binary_rooms(chat_server, chat_client, monkeypatch):
+    built = []
+    monkeypatch.setattr('server.handlers.encode_chat', lambda *args: built.append(args) or encode_chat(*args))
+    (first, alice), (second, bob) = chat_client(), chat_client()
+    first.sendall(b'hello\n')
+    chat_server.invoke_handler(alice.client_socket)
+    assert built == []
+
+    second.sendall(b'/binary\n')
+    chat_server.invoke_handler(bob.client_socket)
+    first.sendall(b'hello\n')
+    chat_server.invoke_handler(alice.client_socket)
+    assert len(built) == 1
@@ -0,0 +1,100 @@
+import socket
+import time
+
+import pytest
+
+from server.handlers import Server
+from server.ratelimit import RateLimitAction, TokenBucket
+from server.settings import ServerSettings
+
+
+def test_token_bucket_refills_lazily():
+    bucket = TokenBucket(rate=10, capacity=2, now=0)
+    assert bucket.wait_time(1, 0) == 0
+    bucket.take(1)
+    bucket.take(1)
+    assert bucket.wait_time(1, 0) == pytest.approx(0.1)
+    assert bucket.wait_time(1, 0.05) == pytest.approx(0.05)
+    assert bucket.wait_time(1, 1) == 0
+    assert bucket.tokens == 2
+
+
+def test_token_bucket_large_request_waits_for_full_bucket():
+    bucket = TokenBucket(rate=100, capacity=10, now=0)
+    bucket.take(5)
+    assert bucket.wait_time(1000, 0) == pytest.approx(0.05)
+    assert bucket.wait_time(1000, 0.05) == 0
+
+
+@pytest.fixture
+def limited_server():
+    """
+    Возвращает функцию, которая создает сервер с ограничением
+    в два сообщения и подключает к нему клиента.
+    """
+    servers = []
+
+    def create(action: RateLimitAction, **settings):
+        server = Server('localhost', 0, ServerSettings(
+            message_rate=1, message_burst=2, rate_limit_action=action, **settings,
+        ))
+        servers.append(server)
+        received = []
+        server.request_received = lambda line: received.append(line)
+        server.server_socket.listen()
+        client = socket.create_connection(server.server_socket.getsockname())
+        connection = server.connections[server.accept_connection()]
+        return server, client, connection, received
+
+    yield create
+    for server in servers:
+        server.close()
+
+
+def test_rate_limit_drop(limited_server):
+    server, client, connection, received = limited_server(RateLimitAction.DROP)
+    client.sendall(b'one\ntwo\nthree\n')
+    server.invoke_handler(connection.client_socket)
+    assert received == ['one', 'two']
+    assert server.metrics.rate_limited.value == 1
+
+
+def test_rate_limit_disconnect(limited_server):
+    server, client, connection, received = limited_server(RateLimitAction.DISCONNECT)
+    client.sendall(b'one\ntwo\nthree\nfour\n')
+    server.invoke_handler(connection.client_socket)
+    assert received == ['one', 'two']
+    assert connection.client_socket in server.closing
+
+
+def test_rate_limit_delay(limited_server):
+    server, client, connection, received = limited_server(RateLimitAction.DELAY)
+    client.sendall(b'one\ntwo\nthree\nfour\n')
+    server.invoke_handler(connection.client_socket)
+    assert received == ['one', 'two']
+    assert connection.throttled
+    assert connection.pending == ['three', 'four']
+    assert connection.client_socket not in server.selector.get_map()
+    connection.limiters[0].messages.updated -= 2
+    server.timers.advance(time.monotonic() + 2)
+    assert received == ['one', 'two', 'three', 'four']
+    assert not connection.throttled
+    assert connection.client_socket in server.selector.get_map()
+
+
+def test_address_limit_is_shared(limited_server):
+    server, client, connection, received = limited_server(
+        RateLimitAction.DROP, address_message_rate=1, address_message_burst=3,
+    )
+    other_client = socket.create_connection(server.server_socket.getsockname())
+    other_connection = server.connections[server.accept_connection()]
+    address_limiter = server.address_limiters['127.0.0.1']
+    assert address_limiter.connections == 2
+    client.sendall(b'one\ntwo\n')
+    other_client.sendall(b'three\nfour\n')
+    server.invoke_handler(connection.client_socket)
+    server.invoke_handler(other_connection.client_socket)
+    assert received == ['one', 'two', 'three']
+    server.close_connection(connection.client_socket)
+    server.close_connection(other_connection.client_socket)
+    assert not server.address_limiters
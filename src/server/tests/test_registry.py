@@ -0,0 +1,67 @@
+import socket
+
+import pytest
+
+from server.user import Presence, User, UserRegistry
+
+
+@pytest.fixture
+def users():
+    sockets = [socket.socket() for _ in range(3)]
+    users = [User(client_socket) for client_socket in sockets]
+    yield users
+    for user in users:
+        user.release()
+        user.client_socket.close()
+
+
+def test_registry_indexes(users):
+    registry = UserRegistry()
+    for user in users:
+        registry.add(user)
+    first = users[0]
+    assert registry.by_fd[first.client_socket.fileno()] is first
+    assert registry.by_name[first.username] is first
+    assert registry.by_id[first.user_id] is first
+    assert registry.get_user(first.client_socket) is first
+
+    assert registry.pop(first.client_socket) is first
+    assert first.username not in registry.by_name
+    assert first.user_id not in registry.by_id
+    assert registry.get_user(first.client_socket) is None
+    assert registry.pop(first.client_socket, None) is None
+    assert len(registry) == 2
+
+
+def test_registry_presence(users):
+    registry = UserRegistry()
+    names = [user.username for user in users]
+    for user in users:
+        registry.add(user)
+    assert registry.presence.get_text() == ', '.join(names)
+    assert registry.presence.get_text(names[-1]) == ', '.join(names[:-1])
+    assert registry.presence.get_text(names[0]) == ', '.join(names[1:])
+
+    del registry[users[1].client_socket]
+    assert registry.presence.get_text() == '%s, %s' % (names[0], names[2])
+
+
+def test_presence_without_names():
+    presence = Presence()
+    assert presence.get_text() == ''
+    presence.add('Alice')
+    assert presence.get_text('Alice') == ''
+    presence.discard('Alice')
+    presence.discard('Bob')
+    assert presence.get_text() == ''
+    assert len(presence) == 0
+
+
+def test_presence_ignores_repeated_names():
+    presence = Presence()
+    presence.add('Alice')
+    presence.add('Bob')
+    presence.add('Alice')
+    assert presence.get_text() == 'Alice, Bob'
+    assert presence.get_text('Bob') == 'Alice'
+    assert len(presence) == 2
@@ -0,0 +1,69 @@
+from server.tests.conftest import read_lines, send_line
+
+
+def test_messages_stay_in_room(chat_server, chat_client):
+    (first, alice), (second, bob), (third, carol) = chat_client(), chat_client(), chat_client()
+    send_line(chat_server, third, carol, '/join python')
+    assert carol.room.name == 'python'
+    for client in (first, second, third):
+        read_lines(client)
+
+    send_line(chat_server, first, alice, 'hello')
+    assert read_lines(second) == ['[%s] hello' % alice.formatted_user_addr]
+    assert read_lines(third) == []
+    assert bob.room.name == 'general'
+
+
+def test_room_commands(chat_server, chat_client):
+    (first, alice), (second, bob) = chat_client(), chat_client()
+    send_line(chat_server, second, bob, '/join python')
+    assert read_lines(second)[-2] == 'Room python. None is here.'
+    assert read_lines(first)[-2].endswith('Has left the room.')
+
+    send_line(chat_server, first, alice, '/rooms')
+    assert 'Rooms: general (1), python (1)' in read_lines(first)
+
+    send_line(chat_server, second, bob, '/leave')
+    assert 'python' not in chat_server.rooms
+    assert read_lines(first)[-2].endswith('Has joined the room!')
+    assert 'Room general. %s are in the chat.' % alice in read_lines(second)
+
+    send_line(chat_server, first, alice, '/join bad room')
+    assert 'Usage: /join <room>' in read_lines(first)
+    send_line(chat_server, first, alice, '/dance')
+    assert 'Unknown command /dance.' in read_lines(first)
+
+
+def test_history_is_replayed_on_join(chat_server, chat_client):
+    chat_server.settings.history_replay = 2
+    first, alice = chat_client()
+    for i in range(3):
+        send_line(chat_server, first, alice, 'message %d' % i)
+    history = chat_server.rooms['general'].history.get_last(2)
+
+    second, bob = chat_client()
+    lines = read_lines(second)
+    assert lines[:2] == ['[%s] message 1' % alice.formatted_user_addr, '[%s] message 2' % alice.formatted_user_addr]
+    assert lines[2] == '%s are in the chat.' % alice
+
+    send_line(chat_server, second, bob, '/join python')
+    send_line(chat_server, second, bob, '/leave')
+    assert chat_server.rooms['general'].history.get_last(2) == history
+
+
+def test_private_messages_reach_only_recipients(chat_server, chat_client):
+    (first, alice), (second, bob), (third, carol) = chat_client(), chat_client(), chat_client()
+    send_line(chat_server, third, carol, '/join python')
+    for client in (first, second, third):
+        read_lines(client)
+
+    send_line(chat_server, first, alice, '/msg %s,%s hi there' % (carol.username, carol.username))
+    assert read_lines(third) == ['[%s] (private) hi there' % alice.formatted_user_addr]
+    assert read_lines(second) == []
+    assert read_lines(first) == []
+
+    send_line(chat_server, first, alice, '/msg %s,nobody hi' % bob.username)
+    assert read_lines(second) == ['[%s] (private) hi' % alice.formatted_user_addr]
+    assert 'Unknown user: nobody.' in read_lines(first)
+    send_line(chat_server, first, alice, '/msg %s' % bob.username)
+    assert 'Usage: /msg <name>[,<name>...] <text>' in read_lines(first)
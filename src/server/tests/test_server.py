@@ -1,6 +1,11 @@
+import socket
+
 import pytest
 
-from server.handlers import Server
+from server.handlers import Chat, Server
+from server.settings import ServerSettings
+from server.tests.conftest import read_lines
+from server.user import User
 
 
 @pytest.mark.parametrize(
@@ -63,9 +68,12 @@ def test_handler_calling(server, client_socket):
 def test_handler_invoking(server, client_socket):
     connected = None
 
+    received = []
+
     def request_received(*args, **kwargs):
         nonlocal connected
         connected = True
+        received.append(args[-1])
 
     def connection_closed(*args, **kwargs):
         nonlocal connected
@@ -86,13 +94,110 @@ def test_handler_invoking(server, client_socket):
         client_socket_created_by_server = server.accept_connection()
         assert connected == 'is connected'
 
-        client_socket.send('data'.encode('utf-8'))
+        client_socket.send('data\nmore'.encode('utf-8'))
         server.invoke_handler(client_socket_created_by_server)
         assert connected is True
-        client_socket_created_by_server.recv(24)
+        assert received == ['data']
 
         client_socket.close()
         server.invoke_handler(client_socket_created_by_server)
         assert connected is False
         assert client_socket_created_by_server.fileno() == -1
         assert not server.selector.get_map().values()
+
+
+def test_user_prefix_matches_formatted_message(chat_server):
+    with chat_server.server_socket as server_socket:
+        server_socket.listen()
+        client_socket = socket.create_connection(server_socket.getsockname())
+        connection = chat_server.accept_connection()
+        user = chat_server.registered_users[connection]
+        assert user.user_address == client_socket.getsockname()
+        assert chat_server.encode_message(user, 'hi') == \
+            chat_server.format_message_before_send(chat_server.format_message(user, 'hi'))
+        assert not hasattr(user, '__dict__')
+
+        client_socket.close()
+        chat_server.invoke_handler(connection)
+        assert user.username not in User.names_generator._registered_names
+
+
+def test_batch_dispatch_flushes_each_recipient_once():
+    chat_server = Chat('localhost', 0, ServerSettings(batch_dispatch=True, batch_max_lines=3))
+    chat_server.server_socket.listen()
+    clients = []
+    for _ in range(3):
+        client = socket.create_connection(chat_server.server_socket.getsockname())
+        client.settimeout(1)
+        clients.append((client, chat_server.registered_users[chat_server.accept_connection()]))
+    for client, _ in clients:
+        read_lines(client)
+    flushed = []
+    flush = chat_server.flush
+    chat_server.flush = lambda sock: flushed.append(sock) or flush(sock)
+
+    clients[0][0].sendall(b'one\ntwo\n')
+    clients[1][0].sendall(b'three\n')
+    events = []
+    while len(events) < 2:
+        events = chat_server.selector.select(1)
+    chat_server.handle_batch(events)
+
+    assert sorted(flushed, key=id) == sorted((user.client_socket for _, user in clients), key=id)
+    assert sorted(line.split('] ')[1] for line in read_lines(clients[2][0])) == ['one', 'three', 'two']
+    assert not chat_server.unflushed and not chat_server.batching
+    for client, _ in clients:
+        client.close()
+    chat_server.close()
+
+
+def test_connections_accepted_together_are_announced_once():
+    chat_server = Chat('localhost', 0, ServerSettings(max_connections=4))
+    chat_server.server_socket.listen()
+    chat_server.server_socket.setblocking(False)
+    chat_server.register_for_reading(chat_server.server_socket, chat_server.accept_connections)
+    address = chat_server.server_socket.getsockname()
+    first = socket.create_connection(address)
+    first.settimeout(1)
+    chat_server.selector.select(1)
+    chat_server.accept_connections()
+    read_lines(first)
+
+    clients = [socket.create_connection(address) for _ in range(4)]
+    chat_server.selector.select(1)
+    chat_server.accept_connections()
+
+    lines = read_lines(first)
+    assert len(lines) == 3 and lines[1].endswith(' have connected!')
+    assert lines[1].count(', ') == 2
+    assert clients[-1].recv(1024) == Chat.reject_message
+    assert len(chat_server.connections) == 4
+    assert chat_server.metrics.connections_rejected.value == 1
+    for client in [first, *clients]:
+        client.close()
+    chat_server.close()
+
+
+def test_batch_mode_ends_when_handler_fails():
+    chat_server = Chat('localhost', 0, ServerSettings(batch_dispatch=True))
+    chat_server.server_socket.listen()
+    clients = []
+    for _ in range(2):
+        client = socket.create_connection(chat_server.server_socket.getsockname())
+        client.settimeout(1)
+        clients.append((client, chat_server.registered_users[chat_server.accept_connection()]))
+    for client, _ in clients:
+        read_lines(client)
+
+    def fail(user, request):
+        chat_server.send_to(clients[1][1], 'before failure')
+        raise RuntimeError
+    chat_server.request_received = fail
+    clients[0][0].sendall(b'hello\n')
+    with pytest.raises(RuntimeError):
+        chat_server.handle_batch(chat_server.selector.select(1))
+    assert not chat_server.batching and not chat_server.unflushed
+    assert read_lines(clients[1][0]) == ['before failure']
+    for client, _ in clients:
+        client.close()
+    chat_server.close()
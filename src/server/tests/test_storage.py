@@ -0,0 +1,124 @@
+import os
+import socket
+
+import pytest
+
+from server.handlers import Chat
+from server.settings import ServerSettings
+from server.storage import MessageLog
+
+
+@pytest.fixture
+def log_directory(tmp_path):
+    return str(tmp_path / 'log')
+
+
+def fill(log: MessageLog, count: int, room: str = 'general'):
+    for i in range(count):
+        log.append(room, 'Alice', b'message %d\n' % i, timestamp=float(i))
+    log.flush()
+
+
+def test_log_reads_records(log_directory):
+    log = MessageLog(log_directory, index_interval=4)
+    fill(log, 10)
+    records = list(log.read_range(3, 6))
+    assert [record.number for record in records] == [3, 4, 5]
+    assert records[0].payload == b'message 3\n'
+    assert records[0].sender == 'Alice'
+    assert records[0].room == 'general'
+    assert records[0].timestamp == 3.0
+    log.close()
+
+
+def test_log_reads_last_records_of_room(log_directory):
+    log = MessageLog(log_directory, index_interval=4)
+    for i in range(20):
+        log.append('even' if i % 2 == 0 else 'odd', 'Bob', b'%d' % i)
+    log.flush()
+    assert [record.payload for record in log.read_last(3, 'odd')] == [b'15', b'17', b'19']
+    assert [record.payload for record in log.read_last(2)] == [b'18', b'19']
+    log.close()
+
+
+def test_log_indexes_records_of_rooms(log_directory):
+    log = MessageLog(log_directory, index_interval=4, room_records=2, max_rooms=2)
+    for i in range(20):
+        log.append('rare' if i in (1, 17) else 'busy', 'Bob', b'%d' % i)
+    log.flush()
+    assert [record.payload for record in log.read_last(5, 'rare')] == [b'1', b'17']
+    assert [record.payload for record in log.read_last(5, 'busy')] == [b'18', b'19']
+    log.append('third', 'Bob', b'20')
+    assert log.read_last(5, 'rare') == []
+    log.close()
+
+    log = MessageLog(log_directory, index_interval=4, room_records=3, room_scan=5)
+    assert [record.payload for record in log.read_last(5, 'busy')] == [b'16', b'18', b'19']
+    assert [record.payload for record in log.read_last(5, 'rare')] == [b'17']
+    log.close()
+
+
+def test_log_rolls_segments_and_recovers(log_directory):
+    log = MessageLog(log_directory, segment_bytes=256, index_interval=2)
+    fill(log, 30)
+    log.close()
+    assert len([name for name in os.listdir(log_directory) if name.endswith('.log')]) > 1
+
+    log = MessageLog(log_directory, segment_bytes=256, index_interval=2)
+    assert log.next_number == 30
+    assert [record.number for record in log.read_range(0, 30)] == list(range(30))
+    assert log.append('general', 'Alice', b'after restart\n') == 30
+    log.flush()
+    assert log.read_last(1)[0].payload == b'after restart\n'
+    log.close()
+
+
+def test_log_truncates_torn_record(log_directory):
+    log = MessageLog(log_directory, index_interval=2)
+    fill(log, 5)
+    log.close()
+    [segment] = [name for name in os.listdir(log_directory) if name.endswith('.log')]
+    path = os.path.join(log_directory, segment)
+    os.truncate(path, os.path.getsize(path) - 3)
+
+    log = MessageLog(log_directory, index_interval=2)
+    assert log.next_number == 4
+    assert [record.number for record in log.read_range(0, 10)] == [0, 1, 2, 3]
+    fill(log, 3)
+    assert [record.payload for record in log.read_last(3)] == [b'message 0\n', b'message 1\n', b'message 2\n']
+    assert log.read_last(5)[0].number == 2
+    log.close()
+
+
+def test_log_writer_thread_flushes(log_directory):
+    log = MessageLog(log_directory, fsync_interval=0.01)
+    log.append('general', 'Alice', b'hello\n')
+    log.close()
+    log = MessageLog(log_directory)
+    assert log.read_last(1)[0].payload == b'hello\n'
+    log.close()
+
+
+def test_chat_restores_history_from_log(log_directory):
+    settings = ServerSettings(log_directory=log_directory)
+    chat = Chat('localhost', 0, settings)
+    chat.server_socket.listen()
+    client = socket.create_connection(chat.server_socket.getsockname())
+    connection = chat.accept_connection()
+    for i in range(3):
+        client.sendall(b'message %d\n' % i)
+        chat.invoke_handler(connection)
+    client.close()
+    chat.close()
+
+    chat = Chat('localhost', 0, settings)
+    history = chat.rooms['general'].history.get_last(10)
+    assert [bytes(payload).split(b'] ')[1] for payload in history] == [
+        b'message 0\n', b'message 1\n', b'message 2\n',
+    ]
+    assert chat.message_log.read_last(1)[0].sender == chat_sender(history[0])
+    chat.close()
+
+
+def chat_sender(payload: bytes) -> str:
+    return bytes(payload).split(b' | ')[1].split(b']')[0].decode()
@@ -0,0 +1,69 @@
+import socket
+
+import pytest
+
+from server.handlers import Server
+from server.settings import ServerSettings
+from server.timers import TimerWheel
+from server.tests.conftest import read_lines
+
+
+@pytest.fixture
+def wheel():
+    wheel = TimerWheel(resolution=1, bits=3, levels=3)
+    wheel.started = 0
+    return wheel
+
+
+@pytest.mark.parametrize('delay', [1, 7, 8, 9, 63, 64, 65, 300, 511])
+def test_timer_fires_on_time(wheel, delay):
+    wheel.advance(5)
+    fired = []
+    wheel.schedule(delay, lambda: fired.append(wheel.ticks))
+    for now in range(6, 1100):
+        wheel.advance(now)
+    assert fired == [5 + delay]
+    assert not wheel
+
+
+def test_timer_cancel_and_reschedule(wheel):
+    fired = []
+    cancelled = wheel.schedule(10, lambda: fired.append('cancelled'))
+    moved = wheel.schedule(10, lambda: fired.append(wheel.ticks))
+    wheel.cancel(cancelled)
+    wheel.advance(5)
+    wheel.reschedule(moved, 100)
+    wheel.advance(104)
+    assert fired == []
+    wheel.advance(105)
+    assert fired == [105]
+
+
+def test_wheel_timeout(wheel):
+    assert wheel.get_timeout(0) is None
+    wheel.schedule(3, lambda: None)
+    assert wheel.get_timeout(0.25) == 0.75
+
+
+def test_idle_connection_is_pinged_and_closed():
+    server = Server('localhost', 0, ServerSettings(idle_timeout=2, heartbeat_interval=1, timer_resolution=0.5))
+    server.server_socket.listen()
+    client = socket.create_connection(server.server_socket.getsockname())
+    client.settimeout(1)
+    connection = server.connections[server.accept_connection()]
+    started = server.timers.started
+
+    server.timers.advance(started + 1)
+    assert read_lines(client) == ['/ping']
+    client.sendall(b'/pong\n')
+    server.invoke_handler(connection.client_socket)
+    server.timers.advance(started + 2.5)
+    assert read_lines(client) == ['/ping']
+    assert connection.client_socket not in server.closing
+
+    server.timers.advance(started + 3)
+    assert connection.client_socket in server.closing
+    server.close_scheduled()
+    assert not server.timers
+    client.close()
+    server.close()
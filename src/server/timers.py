@@ -0,0 +1,139 @@
+import math
+import time
+from typing import Callable
+
+
+class Timer:
+    """Таймер колеса таймеров."""
+
+    __slots__ = ('expires', 'callback', 'bucket')
+
+    def __init__(self, expires: int, callback: Callable):
+        # Номер тика, на котором таймер сработает.
+        self.expires = expires
+        self.callback = callback
+        # Ячейка колеса, в которой лежит таймер, или `None`, если
+        # он сработал или отменен.
+        self.bucket: dict[Timer, None] | None = None
+
+
+class TimerWheel:
+    """
+    Иерархическое колесо таймеров. Время делится на тики по
+    `resolution` секунд. Первый уровень - `2 ** bits` ячеек по
+    одному тику, каждый следующий - столько же ячеек, но в
+    `2 ** bits` раз крупнее. Таймеры дальних уровней при
+    обороте младшего переносятся на уровень ниже.
+
+    Поставить и отменить таймер можно за O(1), а сработавшие
+    таймеры достаются целой ячейкой, без кучи и сортировки.
+    """
+
+    def schedule(self, delay: float, callback: Callable) -> Timer:
+        """Вызывает `callback` не раньше чем через `delay` секунд."""
+        ticks = max(1, math.ceil(delay / self.resolution))
+        timer = Timer(self.ticks + ticks, callback)
+        self._place(timer)
+        return timer
+
+    def reschedule(self, timer: Timer, delay: float):
+        """Переносит таймер на `delay` секунд от текущего момента."""
+        self.cancel(timer)
+        timer.expires = self.ticks + max(1, math.ceil(delay / self.resolution))
+        self._place(timer)
+
+    def cancel(self, timer: Timer):
+        """Отменяет таймер, если он еще не сработал."""
+        if timer.bucket is not None:
+            del timer.bucket[timer]
+            timer.bucket = None
+            self.count -= 1
+
+    def _place(self, timer: Timer):
+        """
+        Кладет таймер в ячейку по времени его срабатывания. Таймер
+        текущего тика попадает в ячейку, которую `advance` сейчас
+        обработает.
+        """
+        delta = timer.expires - self.ticks
+        if delta < 0:
+            timer.expires = self.ticks
+            delta = 0
+        bits = self.bits
+        level = 0
+        while level < self.levels - 1 and delta >> (bits * (level + 1)):
+            level += 1
+        if delta >> (bits * (level + 1)):
+            # Дальше, чем охватывает колесо, таймер срабатывает на
+            # его краю.
+            timer.expires = self.ticks + (1 << (bits * self.levels)) - 1
+        bucket = self.wheels[level][(timer.expires >> (bits * level)) & self.mask]
+        bucket[timer] = None
+        timer.bucket = bucket
+        self.count += 1
+
+    def advance(self, now: float = None):
+        """Продвигает колесо до момента `now` и вызывает сработавшие таймеры."""
+        if now is None:
+            now = time.monotonic()
+        target = int((now - self.started) / self.resolution)
+        if not self.count:
+            self.ticks = max(self.ticks, target)
+            return
+        while self.ticks < target:
+            self.ticks += 1
+            self._cascade()
+            wheel = self.wheels[0]
+            index = self.ticks & self.mask
+            bucket = wheel[index]
+            if not bucket:
+                continue
+            wheel[index] = {}
+            for timer in bucket:
+                timer.bucket = None
+                self.count -= 1
+            for timer in bucket:
+                timer.callback()
+
+    def _cascade(self):
+        """Переносит таймеры старших уровней, чья очередь подошла."""
+        level = 0
+        while level < self.levels - 1 and not (self.ticks >> (self.bits * level)) & self.mask:
+            level += 1
+            wheel = self.wheels[level]
+            index = (self.ticks >> (self.bits * level)) & self.mask
+            bucket = wheel[index]
+            if bucket:
+                wheel[index] = {}
+                for timer in bucket:
+                    timer.bucket = None
+                    self.count -= 1
+                    self._place(timer)
+
+    def get_timeout(self, now: float = None) -> float | None:
+        """
+        Возвращает, сколько секунд осталось до следующего тика,
+        или `None`, если таймеров нет.
+        """
+        if not self.count:
+            return None
+        if now is None:
+            now = time.monotonic()
+        return max(0.0, self.started + (self.ticks + 1) * self.resolution - now)
+
+    def __len__(self):
+        return self.count
+
+    def __init__(self, resolution: float = 0.1, bits: int = 8, levels: int = 4):
+        self.resolution = resolution
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.levels = levels
+        self.started = time.monotonic()
+        self.ticks = 0
+        self.count = 0
+        # Ячейка - словарь вместо множества, чтобы таймеры
+        # срабатывали в порядке постановки.
+        self.wheels: list[list[dict[Timer, None]]] = [
+            [{} for _ in range(1 << bits)] for _ in range(levels)
+        ]
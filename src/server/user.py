@@ -1,103 +1,242 @@
+import functools
+import itertools
+import random
 import socket
 
-from faker import Faker
+
+@functools.cache
+def load_names() -> tuple[str, ...]:
+    """
+    Загружает список имён один раз за время работы процесса.
+    Faker нужен только здесь, поэтому импортируется лениво.
+    """
+    from faker.providers.person.en_US import Provider
+    return tuple(sorted(set(Provider.first_names)))
 
 
 class Names:
-    """Класс, что выдает случайные имена."""
+    """
+    Класс, что выдает случайные имена. Имена берутся из
+    перемешанного списка свободных за O(1); когда он пуст, к
+    случайному имени добавляется числовой суффикс.
+
+    Воркеры одного сервера получают непересекающиеся части
+    списка (`shard` из `shards`), поэтому имена уникальны на
+    всём сервере.
+    """
 
     def get_name(self) -> str:
         """
         Возвращает случайное имя, которое ещё
         не использовалось.
         """
-        while True:
-            name = self.faker.first_name()
-            if name not in self._registered_names:
-                self._registered_names.add(name)
-                break
+        if self._free_names:
+            name = self._free_names.pop()
+        else:
+            # Имя с суффиксом могло быть занято через `reserve_name`,
+            # например, пользователем из старого процесса.
+            name = '%s%d' % (random.choice(self._pool), next(self._suffixes))
+            while name in self._registered_names:
+                name = '%s%d' % (random.choice(self._pool), next(self._suffixes))
+        self._registered_names.add(name)
         return name
 
+    def reserve_name(self, name: str) -> bool:
+        """
+        Помечает имя занятым, например, если пользователь
+        пришел с ним из другого процесса. Вернет `False`, если
+        имя уже занято.
+        """
+        if name in self._registered_names:
+            return False
+        self._registered_names.add(name)
+        if name in self._pool_set:
+            self._free_names.remove(name)
+        return True
+
     def delete_name(self, name) -> bool:
         """
         Удаляет имя из множества уже использованных
         имён. Если имя там было, вернет `True`, иначе -
-        False.
+        False. Имя из списка снова становится свободным.
         """
         try:
             self._registered_names.remove(name)
         except KeyError:
             return False
+        if name in self._pool_set:
+            self._free_names.append(name)
+            # Ставим имя на случайное место, чтобы его не выдали
+            # следующему же пользователю.
+            index = random.randrange(len(self._free_names))
+            self._free_names[index], self._free_names[-1] = self._free_names[-1], self._free_names[index]
         return True
 
-    def __init__(self):
-        self.faker = Faker()
+    def __init__(self, shard: int = 0, shards: int = 1):
+        self._pool = load_names()[shard::shards] or load_names()
+        self._pool_set = frozenset(self._pool)
+        self._free_names = list(self._pool)
+        random.shuffle(self._free_names)
         self._registered_names = set()
+        self._suffixes = itertools.count(shards + shard, shards)
 
 
 class User:
-    """Абстракция, что предоставляет пользователя."""
-
-    names_generator = Names()
+    """
+    Абстракция, что предоставляет пользователя. Адрес и
+    префикс сообщений вычисляются один раз при подключении.
+    """
 
-    @property
-    def user_address(self) -> tuple[str, int]:
-        """Возвращает данные об адресе пользователя."""
-        return self.client_socket.getpeername()
+    __slots__ = (
+        'client_socket', 'user_id', 'username', 'user_address', 'formatted_user_addr', 'prefix', 'room',
+        'binary', 'compressed',
+    )
 
-    @property
-    def formatted_user_addr(self) -> str:
-        """
-        Возвращает строку удаленного адреса пользователя
-        вида `HOST:PORT | name`.
-        """
-        return ':'.join(map(str, self.user_address)) + f' | {self.username}'
+    names_generator = Names()
+    id_generator = itertools.count(1)
 
-    def __del__(self):
+    def release(self):
         """
-        При удалении пользователя удаляет его имя из
-        генератора имен.
+        Освобождает имя пользователя в генераторе имен.
+        Вызывается при отключении пользователя.
         """
         self.names_generator.delete_name(self.username)
 
+    @staticmethod
+    def get_user_address(client_socket: socket.socket) -> tuple[str, int]:
+        """Возвращает данные об адресе пользователя."""
+        try:
+            return client_socket.getpeername()[:2]
+        except OSError:
+            return '?', 0
+
     def __repr__(self):
         return self.username
 
-    def __init__(self, client_socket: socket.socket):
-        self.username = self.names_generator.get_name()
+    def __init__(self, client_socket: socket.socket, username: str = None, user_id: int = None):
+        # Имя и номер передаются, если пользователь пришел из
+        # другого процесса при горячем перезапуске.
+        self.user_id = next(self.id_generator) if user_id is None else user_id
+        if username is None:
+            self.username = self.names_generator.get_name()
+        else:
+            self.names_generator.reserve_name(username)
+            self.username = username
         self.client_socket = client_socket
+        self.user_address = self.get_user_address(client_socket)
+        # Строка удаленного адреса вида `HOST:PORT | name`.
+        self.formatted_user_addr = ':'.join(map(str, self.user_address)) + f' | {self.username}'
+        # Готовое начало каждого сообщения пользователя.
+        self.prefix = ('[%s] ' % self.formatted_user_addr).encode('utf-8')
+        # Комната `server.rooms.Room`, в которой пользователь сейчас.
+        self.room = None
+        # Клиент перешел на двоичный протокол и, возможно, сжатие.
+        self.binary = False
+        self.compressed = False
+
+
+class Presence:
+    """
+    Имена пользователей в порядке подключения и готовая строка
+    `X, Y` из них. Строка дописывается при подключении, а после
+    отключения собирается заново при первом обращении.
+    """
+
+    def add(self, name: str):
+        """Добавляет имя в конец списка. Повторное имя не добавляется."""
+        if name in self._names:
+            return
+        self._names[name] = None
+        if self._text is not None:
+            self._previous_text = self._text
+            self._text = f'{self._text}, {name}' if self._text else name
+            self._last_name = name
+
+    def discard(self, name: str):
+        """Убирает имя из списка, если оно там есть."""
+        if self._names.pop(name, False) is None:
+            self._text = self._previous_text = self._last_name = None
+
+    def get_text(self, exclude: str = None) -> str:
+        """
+        Возвращает имена через запятую без имени `exclude`.
+        Исключить последнего подключившегося ничего не стоит.
+        """
+        if exclude is None or exclude not in self._names:
+            if self._text is None:
+                self._text = ', '.join(self._names)
+            return self._text
+        if exclude == self._last_name and self._previous_text is not None:
+            return self._previous_text
+        return ', '.join(name for name in self._names if name != exclude)
 
+    def __contains__(self, name: str):
+        return name in self._names
 
-class UserChatList(set):
-    """Коллекция списка пользователей."""
+    def __len__(self):
+        return len(self._names)
 
-    def remove(self, user: User = None, user_socket: socket.socket = None) -> bool:
-        """
-        Удаляет пользователя. Если он был, возвращает `True`,
-        иначе `False`.
-        """
-        if user:
-            try:
-                super().remove(user)
-            except KeyError:
-                return False
-        elif user_socket:
-            for user in self:
-                if user.client_socket == user_socket:
-                    super().remove(user)
-                    break
-            else:
-                return False
-        else:
-            raise ValueError("Предоставьте пользователя или его сокет.")
-        return True
+    def __init__(self):
+        self._names: dict[str, None] = {}
+        self._text: str | None = ''
+        self._previous_text: str | None = None
+        self._last_name: str | None = None
+
+
+class UserRegistry(dict):
+    """
+    Пользователи по их сокетам с индексами по дескриптору
+    сокета, имени и идентификатору. Все поиски и изменения
+    стоят O(1). Менять коллекцию нужно через `registry[...] =`,
+    `del`, `pop` и `clear`, иначе индексы разойдутся.
+    """
+
+    def __setitem__(self, client_socket: socket.socket, user: User):
+        if client_socket in self:
+            self.pop(client_socket)
+        super().__setitem__(client_socket, user)
+        self.by_fd[client_socket.fileno()] = user
+        self.by_name[user.username] = user
+        self.by_id[user.user_id] = user
+        self.presence.add(user.username)
+
+    def __delitem__(self, client_socket: socket.socket):
+        self.pop(client_socket)
+
+    def pop(self, client_socket: socket.socket, *default) -> User:
+        """Удаляет пользователя с сокетом `client_socket`."""
+        if client_socket not in self and default:
+            return default[0]
+        user = super().pop(client_socket)
+        self.by_fd.pop(client_socket.fileno(), None)
+        self.by_name.pop(user.username, None)
+        self.by_id.pop(user.user_id, None)
+        self.presence.discard(user.username)
+        return user
+
+    def clear(self):
+        super().clear()
+        self.by_fd.clear()
+        self.by_name.clear()
+        self.by_id.clear()
+        self.presence = Presence()
+
+    def add(self, user: User):
+        """Добавляет пользователя."""
+        self[user.client_socket] = user
+
+    def get_user(self, user_socket: socket.socket) -> User | None:
+        """Возвращает пользователя, который имеет сокет `user_socket`."""
+        return self.get(user_socket)
 
     @property
     def users_sockets(self) -> list[socket.socket]:
         """Возвращает список сокетов пользователей."""
-        return [user.client_socket for user in self]
+        return list(self)
 
-    def get_user(self, user_socket: socket.socket) -> User:
-        """Возвращает пользователя, который имеет сокет `user_socket`."""
-        for user in self:
-            return user if user.client_socket == user_socket else None
+    def __init__(self):
+        super().__init__()
+        self.by_fd: dict[int, User] = {}
+        self.by_name: dict[str, User] = {}
+        self.by_id: dict[int, User] = {}
+        self.presence = Presence()